@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+# Call budgets for the bot's listeners. Canned payloads are passed to the real
+# listener functions, with Slack and TidyHQ replaced by the benchmark stubs, and
+# the calls each invocation makes are counted by utils.instrument. Any count over
+# its budget fails the run, so a change that adds a round trip to a hot path is
+# caught before it's deployed.
+#
+# Budgets cover the calls made while the listener runs and, separately under
+# "background", the calls made by refreshes it queued. When a change legitimately
+# needs another call, raise the budget in BUDGETS alongside it.
+#
+# python -m benchmarks.budgets [--projects 200] [-v]
+
+import argparse
+import inspect
+import sys
+from collections import Counter
+from typing import Any, Callable
+
+from benchmarks.suite import ORGANISATION, run_worker, scratch
+from utils import instrument
+
+# Fixture projects written on top of the synthetic store, so budgets don't depend on generated data
+DONORS = 5
+FIXTURE_TOTAL = 10000
+
+# Highest count allowed for each listener. Keys are counts from utils.instrument, or
+# "slack" and "tidyhq" for all calls to either, prefixed with "background." for queued work
+BUDGETS: dict[str, dict[str, int]] = {
+    "donate10": {"slack": 2, "store.write": 1, "store.parse": 0, "background.slack": DONORS + 2},
+    "donate20_home": {"slack": 2, "store.write": 1, "store.parse": 0, "background.slack": DONORS + 2},
+    "donate_amount": {"slack": 2, "store.write": 1, "store.parse": 0, "background.slack": DONORS + 2},
+    "donate_amount_home": {"slack": 2, "store.write": 1, "store.parse": 0, "background.slack": DONORS + 2},
+    "donate_amount_invalid": {"slack": 1, "store.write": 0, "store.parse": 0, "background.slack": 0},
+    "donate_rest": {"slack": 3, "store.write": 1, "store.parse": 0, "background.slack": DONORS + 2},
+    "approve": {"slack": 4, "store.write": 1, "store.parse": 0, "background.slack": 0},
+    "approve_as_dgr": {"slack": 4, "store.write": 1, "store.parse": 0, "background.slack": 0},
+    "request_project_approval": {"slack": 4, "store.write": 0, "store.parse": 0, "background.slack": 0},
+    "project_details": {"slack": 1, "store.write": 0, "store.parse": 0, "background.slack": 0},
+    "project_selector": {"slack": 0, "store.write": 0, "store.parse": 0, "background.slack": 0},
+    "sendInvoices": {
+        "slack": 2 * DONORS + 4,
+        # Invoices only, the contact mapping is kept warm in the background
+        "tidyhq": DONORS,
+        "store.write": 2 * DONORS + 1,
+        "store.parse": 0,
+        "background.slack": 0,
+    },
+    "app_home_opened": {"slack": 1, "store.write": 0, "store.parse": 0, "background.slack": 0},
+    "app_home_opened_admin": {"slack": 1, "store.write": 0, "store.parse": 0, "background.slack": 0},
+}
+
+
+def fixtures(now: int) -> dict[str, dict[str, Any]]:
+    from benchmarks.synthetic import user_id
+
+    def project(n: int, **fields: Any) -> dict[str, Any]:
+        donors = {user_id(n * DONORS + d): 20 for d in range(DONORS)}
+        return {
+            "title": f"Budget project {n}",
+            "desc": "A project used for call budgets",
+            "img": "",
+            "created by": user_id(4000 + n),
+            "created at": now - 86400,
+            "last updated by": user_id(4000 + n),
+            "approved": True,
+            "approved at": now - 3600,
+            "dgr": False,
+            "total": FIXTURE_TOTAL,
+            "pledges": donors,
+            "promotions": [{"channel": "CPROMO0001", "ts": f"{now}.000001"}],
+            **fields,
+        }
+
+    return {
+        "budget-donate10": project(0),
+        "budget-donate20_home": project(1),
+        "budget-donate_amount": project(2),
+        "budget-donate_amount_home": project(3),
+        "budget-donate_rest": project(4),
+        "budget-approve": project(5, approved=False),
+        "budget-approve_as_dgr": project(6, approved=False),
+        "budget-request_project_approval": project(7, approved=False),
+        "budget-sendInvoices": project(8, total=DONORS * 20, **{"funded at": now - 60}),
+    }
+
+
+def action(user: str, action_id: str, value: str, container: str = "message", block_id: str = "block") -> dict[str, Any]:
+    body: dict[str, Any] = {
+        "type": "block_actions",
+        "user": {"id": user, "username": user.lower()},
+        "trigger_id": "1.2.trigger",
+        "actions": [{"action_id": action_id, "block_id": block_id, "value": value, "type": "button"}],
+        "channel": {"id": "CPROMO0001"},
+    }
+    if container == "view":
+        body["container"] = {"type": "view", "view_id": "V0001"}
+        body["view"] = {"id": "V0001", "type": "home", "blocks": []}
+    else:
+        body["container"] = {"type": "message", "channel_id": "CADMIN0001", "message_ts": "1700000000.000100"}
+        body["message"] = {
+            "ts": "1700000000.000100",
+            "blocks": [
+                {"type": "section", "text": {"type": "mrkdwn", "text": "Project\n"}},
+                {"type": "actions", "elements": []},
+            ],
+        }
+    return body
+
+
+def cases(bot: Any) -> list[tuple[str, Callable[..., Any], dict[str, Any]]]:
+    """(budget name, listener, payload) for every budgeted listener"""
+    from benchmarks.synthetic import ADMIN, user_id
+
+    donor = user_id(4999)
+    return [
+        ("donate10", bot.donate10, action(donor, "donate10", "budget-donate10")),
+        ("donate20_home", bot.donate20_home, action(donor, "donate20_home", "budget-donate20_home", "view")),
+        (
+            "donate_amount",
+            bot.donate_amount,
+            action(donor, "donate_amount", "25", block_id=bot.slack_id_shuffle("budget-donate_amount")),
+        ),
+        (
+            "donate_amount_home",
+            bot.donate_amount_home,
+            action(donor, "donate_amount_home", "25", "view", bot.slack_id_shuffle("budget-donate_amount_home")),
+        ),
+        (
+            "donate_amount_invalid",
+            bot.donate_amount,
+            action(donor, "donate_amount", "lots", block_id=bot.slack_id_shuffle("budget-donate_amount")),
+        ),
+        ("donate_rest", bot.donate_rest, action(donor, "donate_rest", "budget-donate_rest")),
+        ("approve", bot.approve, action(ADMIN, "approve", "budget-approve")),
+        ("approve_as_dgr", bot.approve_as_dgr, action(ADMIN, "approve_as_dgr", "budget-approve_as_dgr", "view")),
+        (
+            "request_project_approval",
+            bot.request_project_approval,
+            action(user_id(4007), "request_project_approval", "budget-request_project_approval", "view"),
+        ),
+        ("project_details", bot.project_details, action(ADMIN, "project_details", "budget-donate10", "view")),
+        ("project_selector", bot.project_selector, {"type": "block_suggestion", "user": {"id": donor}, "value": ""}),
+        ("sendInvoices", bot.invoice, action(ADMIN, "sendInvoices", "budget-sendInvoices", "view")),
+        ("app_home_opened", bot.app_home_opened, {"event": {"type": "app_home_opened", "user": donor, "tab": "home"}}),
+        ("app_home_opened_admin", bot.app_home_opened, {"event": {"type": "app_home_opened", "user": ADMIN, "tab": "home"}}),
+    ]
+
+
+def invoke(listener: Callable[..., Any], payload: dict[str, Any], client: Any) -> None:
+    # Pass arguments by name the way Bolt does
+    available = {
+        "ack": lambda *args, **kwargs: None,
+        "body": payload,
+        "payload": payload,
+        "event": payload.get("event"),
+        "client": client,
+        # Bolt responds through the action's response_url rather than the Web API
+        "respond": lambda **kwargs: instrument.count("slack.response_url"),
+        "say": lambda **kwargs: client.chat_postMessage(**kwargs),
+    }
+    names = inspect.getfullargspec(inspect.unwrap(listener)).args
+    listener(**{name: available[name] for name in names})
+
+
+def totals(counts: Counter[str], prefix: str = "") -> dict[str, int]:
+    result: dict[str, int] = {}
+    for kind, n in counts.items():
+        result[prefix + kind] = result.get(prefix + kind, 0) + n
+        service = kind.split(".", 1)[0]
+        if service in ("slack", "tidyhq"):
+            result[prefix + service] = result.get(prefix + service, 0) + n
+    return result
+
+
+def worker() -> dict[str, dict[str, int]]:
+    import time
+
+    import pledgeBot as bot
+    from benchmarks.stub_client import StubWebClient, install
+
+    client = StubWebClient()
+    install(bot, client, ORGANISATION)
+    bot.store.put_many(fixtures(int(time.time())))
+
+    # Warm the caches a running bot would already have
+    bot.store.load()
+    bot.admins.refresh(client)
+    bot.utils.project_output.update_users()
+
+    results: dict[str, dict[str, int]] = {}
+    for name, listener, payload in cases(bot):
+        bot.home_refresh.wait_idle(60)
+        bot.promotion_refresh.wait_idle(60)
+        instrument.reset()
+        invoke(listener, payload, client)
+        bot.home_refresh.wait_idle(60)
+        bot.promotion_refresh.wait_idle(60)
+
+        invocation = instrument.last.get(listener.__name__, Counter())
+        background = Counter(instrument.totals)
+        background.subtract(invocation)
+        results[name] = {**totals(invocation), **totals(+background, "background.")}
+    return results
+
+
+def check(results: dict[str, dict[str, int]], verbose: bool = False) -> list[str]:
+    failures: list[str] = []
+    for name, budget in BUDGETS.items():
+        counts = results.get(name)
+        if counts is None:
+            failures.append(f"{name}: not run")
+            continue
+        over = {kind: counts.get(kind, 0) for kind, limit in budget.items() if counts.get(kind, 0) > limit}
+        status = "OVER" if over else "ok"
+        print(f"{status:4} {name}")
+        if over or verbose:
+            for kind, n in sorted(counts.items()):
+                limit = budget.get(kind)
+                print(f"       {kind:32} {n:4}" + (f" / {limit}" if limit is not None else ""))
+        for kind, n in over.items():
+            failures.append(f"{name}: {kind} {n} > {budget[kind]}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check the Slack, TidyHQ and store calls made by each listener")
+    parser.add_argument("--projects", type=int, default=200, help="synthetic projects alongside the fixtures")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show every count")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        import json
+
+        print(json.dumps(worker()))
+        return 0
+
+    with scratch(args.projects, max_pledges=50) as directory:
+        results = run_worker("benchmarks.budgets", directory, [])
+    failures = check(results, args.verbose)
+    if failures:
+        print(f"{len(failures)} budgets exceeded")
+        return 1
+    print("All listeners within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+
+# Concurrent pledge load against the real donate listeners. Simulated users click
+# donate10, donate20, donate_rest and donate_amount (and their _home variants) on
+# a handful of shared projects. Each click is dispatched through the bot's Bolt app
+# the way Socket Mode hands it over, so middleware, ack and Bolt's listener pool
+# are all part of the run. Each simulated user waits for their pledge to finish
+# before clicking again. The bot's own Slack calls go to the benchmark stub or a
+# local stand-in server, and clients Bolt builds for each request always go to a
+# stand-in.
+#
+# Reports ack and handler latency percentiles and throughput, then reopens the
+# store from disk and checks that every pledge made it, with the right amount,
+# and that the stored totals agree with the pledges.
+#
+# python -m benchmarks.pledge_load [--users 200] [--pledges 5] [--targets 10] [--concurrency 10] [--slack stub|standin]
+
+import argparse
+import json
+import math
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from benchmarks.suite import ORGANISATION, run_worker, scratch
+
+ACTIONS = (
+    "donate10",
+    "donate20",
+    "donate_rest",
+    "donate_amount",
+    "donate10_home",
+    "donate20_home",
+    "donate_rest_home",
+    "donate_amount_home",
+)
+
+# Large enough that percentage pledges from every user don't all land on funded projects
+TARGET_TOTAL = 1_000_000
+
+
+class ListenerPool(ThreadPoolExecutor):
+    """Replaces Bolt's listener pool, timing the listener each dispatching thread queues"""
+
+    def __init__(self, workers: int) -> None:
+        super().__init__(max_workers=workers, thread_name_prefix="listener")
+        self._local = threading.local()
+
+    def expect(self) -> dict[str, Any]:
+        """Filled in with the seconds the next listener queued from this thread ran for"""
+        run: dict[str, Any] = {"queued": False, "seconds": 0.0, "done": threading.Event()}
+        self._local.run = run
+        return run
+
+    def submit(self, fn: Any, /, *args: Any, **kwargs: Any) -> Any:
+        run = getattr(self._local, "run", None)
+        self._local.run = None
+        if run is not None:
+            run["queued"] = True
+
+        def timed() -> Any:
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if run is not None:
+                    run["seconds"] = time.perf_counter() - started
+                    run["done"].set()
+
+        return super().submit(timed)
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def targets(count: int, now: int) -> dict[str, dict[str, Any]]:
+    from benchmarks.synthetic import user_id
+
+    return {
+        f"load-{n:03d}": {
+            "title": f"Load project {n}",
+            "desc": "A project used for load testing",
+            "img": "",
+            "created by": user_id(n),
+            "created at": now - 86400,
+            "last updated by": user_id(n),
+            "approved": True,
+            "approved at": now - 3600,
+            "dgr": False,
+            "total": TARGET_TOTAL,
+            "pledges": {},
+            "promotions": [{"channel": f"CPROMO{p:04d}", "ts": f"{now}.{p:06d}"} for p in range(3)],
+        }
+        for n in range(count)
+    }
+
+
+def payload(bot: Any, action: str, user: str, project_id: str, amount: str) -> dict[str, Any]:
+    home = action.endswith("_home")
+    button = {"action_id": action, "type": "button", "block_id": "donate", "value": project_id}
+    if action.startswith("donate_amount"):
+        button = {
+            "action_id": action,
+            "type": "plain_text_input",
+            "block_id": bot.slack_id_shuffle(project_id),
+            "value": amount,
+        }
+    body: dict[str, Any] = {
+        "type": "block_actions",
+        "team": {"id": "TBENCHMARK", "domain": "benchmark"},
+        "user": {"id": user, "team_id": "TBENCHMARK"},
+        "api_app_id": "ABENCHMARK",
+        "actions": [button],
+        "trigger_id": "1.2.trigger",
+    }
+    if home:
+        body["container"] = {"type": "view", "view_id": "V0001"}
+    else:
+        body["container"] = {"type": "message", "channel_id": "CPROMO0000", "message_ts": "1.000000"}
+    return body
+
+
+def expected_amount(action: str, amount: str) -> int | None:
+    """Amount the store should hold for a pledge, None where it depends on the other pledges"""
+    if action.startswith("donate10"):
+        return int(TARGET_TOTAL * 10 / 100)
+    if action.startswith("donate20"):
+        return int(TARGET_TOTAL * 20 / 100)
+    if action.startswith("donate_amount"):
+        return int(amount)
+    return None
+
+
+def worker(args: argparse.Namespace) -> dict[str, Any]:
+    from benchmarks.slack_standin import SlackStandIn
+
+    # Answers the clients Bolt builds for each request, and with --slack standin every call the bot makes.
+    # Started before the bot is imported so its clients can be pointed at it
+    limited = args.slack == "standin"
+    standin = SlackStandIn(latency=args.latency, limit_scale=args.limit_scale if limited else 0).start()
+    if limited:
+        with open("config.json", "r") as f:
+            config = json.load(f)
+        config["slack_base_url"] = standin.base_url
+        with open("config.json", "w") as f:
+            json.dump(config, f, indent=4)
+
+    from slack_bolt.request import BoltRequest
+
+    import pledgeBot as bot
+    from benchmarks.stub_client import StubWebClient, install
+    from benchmarks.synthetic import USERS, user_id
+    from utils import instrument
+
+    if not limited:
+        install(bot, StubWebClient(latency=args.latency, base_url=standin.base_url), ORGANISATION)
+
+    bot.store.put_many(targets(args.targets, int(time.time())))
+    bot.store.load()
+
+    # Every simulated user pledges once to each of several different projects, in a random order
+    rng = random.Random(args.seed)
+    project_ids = sorted(targets(args.targets, 0))
+    plan: list[tuple[str, str, str, str]] = []
+    for n in range(args.users):
+        user = user_id(USERS + n)
+        for project_id in rng.sample(project_ids, min(args.pledges, len(project_ids))):
+            plan.append((rng.choice(ACTIONS), user, project_id, str(rng.choice((5, 15, 30, 120)))))
+    rng.shuffle(plan)
+
+    latencies: list[float] = []
+    acks: list[float] = []
+    unacknowledged: list[str] = []
+    errors: list[str] = []
+    lock = threading.Lock()
+
+    listener_pool = ListenerPool(args.concurrency)
+    bot.app.listener_runner.listener_executor = listener_pool
+
+    # Listener exceptions are handed to the app's error handler rather than raised from dispatch
+    @bot.app.error  # type: ignore
+    def failed(error: Exception, body: dict[str, Any]) -> None:
+        with lock:
+            errors.append(f"{body['actions'][0]['action_id']} {body['user']['id']}: {error!r}")
+
+    def click(step: tuple[str, str, str, str]) -> None:
+        action, user, project_id, amount = step
+        body = payload(bot, action, user, project_id, amount)
+        run = listener_pool.expect()
+        start = time.perf_counter()
+        response = bot.app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+        acked = time.perf_counter() - start
+        if run["queued"]:
+            run["done"].wait()
+        with lock:
+            if response.status != 200:
+                unacknowledged.append(f"{action} {user} {project_id}: {response.status}")
+            else:
+                acks.append(acked)
+            if run["queued"]:
+                latencies.append(run["seconds"])
+
+    # An action no listener handles still goes through Bolt's auth.test, so the first clicks aren't timed with it
+    bot.app.dispatch(BoltRequest(body=payload(bot, "warm_up", user_id(USERS), "", ""), mode="socket_mode"))
+
+    instrument.reset()
+    standin.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="load") as pool:
+        list(pool.map(click, plan))
+    elapsed = time.perf_counter() - started
+    listener_pool.shutdown(wait=True)
+
+    # Let queued home and promotion refreshes finish before counting their calls
+    bot.home_refresh.wait_idle(300)
+    bot.promotion_refresh.wait_idle(300)
+    drained = time.perf_counter() - started
+
+    # Read the store back from disk rather than trusting the bot's in-memory copy
+    import utils.store
+
+    fresh = type(bot.store)(bot.config["projects"])
+    final = fresh.load()
+    missing: list[str] = []
+    wrong: list[str] = []
+    for action, user, project_id, amount in plan:
+        pledged = final.get(project_id, {}).get("pledges", {}).get(user)
+        if pledged is None:
+            missing.append(f"{action} {user} {project_id}")
+            continue
+        expected = expected_amount(action, amount)
+        if expected is not None and pledged != expected:
+            wrong.append(f"{action} {user} {project_id}: {pledged} != {expected}")
+
+    slack_calls = {k: v for k, v in instrument.totals.items() if k.startswith("slack.")}
+    standin.stop()
+
+    completed = len(latencies) - len(errors)
+    return {
+        "pledges": len(plan),
+        "completed": completed,
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "seconds": elapsed,
+        "seconds_until_idle": drained,
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "ack": {
+            "p50": percentile(acks, 50) if acks else 0.0,
+            "p95": percentile(acks, 95) if acks else 0.0,
+            "max": max(acks) if acks else 0.0,
+        },
+        "unacknowledged": unacknowledged[:20],
+        "unacknowledged_count": len(unacknowledged),
+        "latency": {
+            "mean": statistics.mean(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50) if latencies else 0.0,
+            "p95": percentile(latencies, 95) if latencies else 0.0,
+            "p99": percentile(latencies, 99) if latencies else 0.0,
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "missing": missing[:20],
+        "missing_count": len(missing),
+        "wrong": wrong[:20],
+        "wrong_count": len(wrong),
+        "stale_totals": utils.store.verify_aggregates(fresh),
+        "slack_calls": slack_calls,
+        "home_refreshes": bot.home_refresh.processed,
+        "home_refreshes_coalesced": bot.home_refresh.coalesced,
+        "promotion_updates": bot.promotion_refresh.updated,
+        "throttled": standin.throttled(),
+    }
+
+
+def report(result: dict[str, Any]) -> None:
+    latency = result["latency"]
+    print(f"{result['completed']}/{result['pledges']} pledges in {result['seconds']:.2f}s, {result['throughput']:.1f} pledges/s")
+    ack = result["ack"]
+    print(f"  ack              p50 {ack['p50'] * 1000:.1f}ms  p95 {ack['p95'] * 1000:.1f}ms  max {ack['max'] * 1000:.1f}ms")
+    print(
+        f"  handler latency  p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+        f"p99 {latency['p99'] * 1000:.1f}ms  max {latency['max'] * 1000:.1f}ms"
+    )
+    print(
+        f"  background work finished after {result['seconds_until_idle']:.2f}s: {result['home_refreshes']} home refreshes "
+        f"({result['home_refreshes_coalesced']} merged), {result['promotion_updates']} promotion updates"
+    )
+    print(f"  Slack calls: {sum(result['slack_calls'].values())}, {result['throttled']} refused with 429")
+    for error in result["errors"]:
+        print(f"  error: {error}")
+    for click in result["unacknowledged"]:
+        print(f"  not acknowledged: {click}")
+    for pledge in result["missing"]:
+        print(f"  lost: {pledge}")
+    for pledge in result["wrong"]:
+        print(f"  wrong amount: {pledge}")
+    for project_id in result["stale_totals"]:
+        print(f"  stored totals don't match pledges: {project_id}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Drive concurrent pledges through the donate listeners")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--pledges", type=int, default=5, help="pledges per user, each to a different project")
+    parser.add_argument("--targets", type=int, default=10, help="projects receiving pledges")
+    parser.add_argument("--concurrency", type=int, default=10, help="listeners running at once, Bolt's default is 10")
+    parser.add_argument("--projects", type=int, default=500, help="other synthetic projects in the store")
+    parser.add_argument("--slack", choices=("stub", "standin"), default="stub")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each Slack call")
+    parser.add_argument("--limit-scale", type=float, default=1.0, help="stand-in rate limits relative to Slack's")
+    parser.add_argument("--refresh-window", type=float, default=2.0, help="home_refresh_window for the bot")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args)))
+        return 0
+
+    config = {"home_refresh_window": args.refresh_window, "promotion_refresh_window": 1}
+    forwarded = [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in ("users", "pledges", "targets", "concurrency", "slack", "latency", "limit_scale", "seed")
+    ]
+    with scratch(args.projects, max_pledges=50, seed=args.seed, config=config) as directory:
+        result = run_worker("benchmarks.pledge_load", directory, forwarded)
+    report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+
+    ok = not (
+        result["error_count"]
+        or result["unacknowledged_count"]
+        or result["missing_count"]
+        or result["wrong_count"]
+        or result["stale_totals"]
+    )
+    print("  OK, no pledges lost" if ok else "  FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+# Replays requests recorded by utils.recorder (record_requests in config.json)
+# through the bot's Bolt app, at the recorded pace or faster. The app starts from
+# the store and admin group snapshot at the start of the recording, with the
+# bot's own Slack calls going to the benchmark stub. Clients Bolt builds for each
+# request, and response URLs, are pointed at an in-process benchmarks.slack_standin.
+#
+# Reports how long Bolt took to acknowledge each kind of request, the time spent
+# in each listener and the Slack and store calls the traffic caused, so store and
+# caching changes can be compared on real traffic.
+#
+# python -m benchmarks.replay requests.jsonl [--speed 1] [--limit 1000] [--latency 0.05] [--output results.json]
+
+import argparse
+import copy
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from benchmarks.pledge_load import percentile
+from benchmarks.suite import run_worker, scratch
+
+# Socket Mode hands each request to a pool of this size
+DISPATCH_WORKERS = 10
+
+
+def read(path: str, limit: int | None = None) -> tuple[dict[str, Any], list[dict[str, Any]], int]:
+    """The first start record, the requests after it and how many restarts were skipped over"""
+    start: dict[str, Any] | None = None
+    requests: list[dict[str, Any]] = []
+    restarts = 0
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "start":
+                if start is None:
+                    start = record
+                else:
+                    # The running bot carried its state over the restart, so keep replaying
+                    restarts += 1
+            elif start is not None and record["type"] == "request":
+                if limit is not None and len(requests) >= limit:
+                    break
+                requests.append(record)
+    if start is None:
+        raise ValueError(f"{path} has no start record, was it written by utils.recorder?")
+    return start, requests, restarts
+
+
+def recorded_users(start: dict[str, Any]) -> list[str]:
+    """Slack ids of the creators and pledgers in the recorded store, and the admins"""
+    users: list[str] = list(start["admins"])
+    for project in start["projects"].values():
+        if project.get("created by"):
+            users.append(project["created by"])
+        users.extend(project.get("pledges", {}))
+    return list(dict.fromkeys(users))
+
+
+def describe(body: dict[str, Any]) -> str:
+    """Short name for the kind of request, used to group timings"""
+    kind = body.get("type", "")
+    if kind == "block_actions" and body.get("actions"):
+        return f"action {body['actions'][0].get('action_id')}"
+    if kind in ("view_submission", "view_closed"):
+        return f"{kind} {body.get('view', {}).get('callback_id')}"
+    if kind == "event_callback":
+        return f"event {body.get('event', {}).get('type')}"
+    if "command" in body:
+        return f"command {body['command']}"
+    if kind == "shortcut":
+        return f"shortcut {body.get('callback_id')}"
+    return kind or "unknown"
+
+
+def summary(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def worker(args: argparse.Namespace) -> dict[str, Any]:
+    from slack_bolt.request import BoltRequest
+
+    from benchmarks.slack_standin import SlackStandIn
+    from benchmarks.stub_client import StubWebClient, install
+    from benchmarks.suite import ORGANISATION
+    from utils import instrument
+
+    start, requests, restarts = read(args.recording, args.limit)
+    standin = SlackStandIn(latency=args.latency, limit_scale=0, admins=start["admins"]).start()
+
+    import pledgeBot as bot
+
+    # Recorded ids are anonymised, so link every recorded creator and pledger to a stub TidyHQ contact
+    users = recorded_users(start)
+    client = StubWebClient(admins=start["admins"], latency=args.latency, base_url=standin.base_url, users=users)
+    install(bot, client, ORGANISATION, users)
+
+    # Warm the caches the recording bot would have had
+    bot.store.load()
+    bot.admins.refresh(client)
+    bot.utils.project_output.update_users()
+    instrument.reset()
+    standin.reset()
+
+    acks: dict[str, list[float]] = {}
+    statuses: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def dispatch(record: dict[str, Any]) -> None:
+        body = copy.deepcopy(record["body"])
+        # Recorded response URLs were removed, send responses to the stand-in instead
+        if "response_url" in body:
+            body["response_url"] = standin.base_url + "response_url"
+        for url in body.get("response_urls", []):
+            url["response_url"] = standin.base_url + "response_url"
+        name = describe(body)
+        started = time.perf_counter()
+        response = bot.app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+        seconds = time.perf_counter() - started
+        with lock:
+            acks.setdefault(name, []).append(seconds)
+            statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+
+    first = requests[0]["at"] if requests else 0.0
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=DISPATCH_WORKERS, thread_name_prefix="replay") as pool:
+        for record in requests:
+            if args.speed:
+                delay = (record["at"] - first) / args.speed - (time.perf_counter() - began)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(dispatch, record)
+    dispatched = time.perf_counter() - began
+
+    # Listeners run on after the ack, wait for them and the refreshes they queued
+    bot.app.listener_runner.listener_executor.shutdown(wait=True)
+    bot.home_refresh.wait_idle(600)
+    bot.promotion_refresh.wait_idle(600)
+    finished = time.perf_counter() - began
+    standin.stop()
+
+    listeners = {
+        name: {
+            "invocations": stats["invocations"],
+            "mean": stats["seconds"] / stats["invocations"],
+            "counts": dict(stats["counts"]),
+        }
+        for name, stats in sorted(instrument.listeners.items())
+    }
+    return {
+        "requests": len(requests),
+        "restarts": restarts,
+        "speed": args.speed,
+        "recorded_seconds": requests[-1]["at"] - first if requests else 0.0,
+        "seconds": dispatched,
+        "seconds_until_idle": finished,
+        "statuses": statuses,
+        "ack": {name: {**summary(values), "count": len(values)} for name, values in sorted(acks.items())},
+        "listeners": listeners,
+        "totals": dict(sorted(instrument.totals.items())),
+        "response_urls": standin.counts().get("response_url", 0),
+        "home_refreshes": bot.home_refresh.processed,
+        "home_refreshes_coalesced": bot.home_refresh.coalesced,
+        "promotion_updates": bot.promotion_refresh.updated,
+    }
+
+
+def report(result: dict[str, Any]) -> None:
+    print(
+        f"Replayed {result['requests']} requests recorded over {result['recorded_seconds']:.0f}s "
+        f"in {result['seconds']:.1f}s, idle after {result['seconds_until_idle']:.1f}s"
+    )
+    if result["restarts"]:
+        print(f"  the recording spans {result['restarts']} restarts, replayed without resetting the store")
+    print(f"  responses: {', '.join(f'{status} x{n}' for status, n in sorted(result['statuses'].items()))}")
+    print(f"  {'request':44} {'count':>6} {'ack p50':>9} {'ack p95':>9} {'ack p99':>9}")
+    for name, ack in result["ack"].items():
+        print(
+            f"  {name[:44]:44} {ack['count']:6} {ack['p50'] * 1000:7.1f}ms {ack['p95'] * 1000:7.1f}ms "
+            f"{ack['p99'] * 1000:7.1f}ms"
+        )
+    print(f"  {'listener':44} {'calls':>6} {'mean':>9} {'slack':>6} {'reads':>6} {'writes':>6} {'parses':>6}")
+    for name, stats in result["listeners"].items():
+        counts = stats["counts"]
+        slack = sum(n for kind, n in counts.items() if kind.startswith("slack."))
+        print(
+            f"  {name[:44]:44} {stats['invocations']:6} {stats['mean'] * 1000:7.1f}ms {slack:6} "
+            f"{counts.get('store.read', 0):6} {counts.get('store.write', 0):6} {counts.get('store.parse', 0):6}"
+        )
+    slack = sum(n for kind, n in result["totals"].items() if kind.startswith("slack."))
+    print(
+        f"  in total {slack} Slack calls, {result['response_urls']} responses, {result['home_refreshes']} home refreshes "
+        f"({result['home_refreshes_coalesced']} merged) and {result['promotion_updates']} promotion updates"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded Slack requests through the bot")
+    parser.add_argument("recording", help="file written by record_requests")
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of the recorded pace, 0 sends requests as fast as possible")
+    parser.add_argument("--limit", type=int, help="replay only the first LIMIT requests")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each Slack call")
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args)))
+        return 0
+
+    recording = os.path.abspath(args.recording)
+    start, _, _ = read(recording, limit=0)
+    forwarded = [recording, f"--speed={args.speed}", f"--latency={args.latency}"]
+    if args.limit is not None:
+        forwarded.append(f"--limit={args.limit}")
+    with scratch(0, projects=start["projects"]) as directory:
+        result = run_worker("benchmarks.replay", directory, forwarded)
+    report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+# Local stand-in for the parts of the Slack Web API the bot uses, so load and
+# integration runs don't need a workspace or network access. Point the bot at it
+# by setting slack_base_url in config.json to the URL it prints.
+#
+# Each call is answered by benchmarks.stub_client after a configurable delay. Calls
+# over a per method budget, and optionally a random share of the rest, are refused
+# with HTTP 429 and Retry-After the way Slack does. Budgets are counted the way
+# utils.slack_client paces calls, chat.postMessage per channel and workspace wide,
+# and Retry-After is the time left until the budget's minute ends. Every call is recorded and can
+# be fetched from /_calls (or cleared with /_reset) while the stand-in runs.
+#
+# python -m benchmarks.slack_standin [--port 8999] [--latency 0.05] [--jitter 0.02] [--limit-scale 1] [--random-429 0.01]
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qsl, urlsplit
+
+from benchmarks.stub_client import StubWebClient
+from utils.slack_client import DEFAULT_LIMIT, METHOD_LIMITS, PER_CHANNEL, WORKSPACE_LIMITS
+
+METHODS = {
+    "chat.postMessage",
+    "chat.update",
+    "conversations.open",
+    "views.publish",
+    "views.open",
+    "views.update",
+    "usergroups.list",
+    "usergroups.users.list",
+    "users.info",
+    "users.list",
+    "auth.test",
+}
+
+
+class SlackStandIn:
+    """Threaded HTTP server answering Slack Web API calls with canned responses"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        limit_scale: float = 1.0,
+        random_429: float = 0.0,
+        retry_after: int = 1,
+        admins: list[str] | None = None,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        # Requests per minute allowed for each method, relative to Slack's tiers. 0 disables the limits
+        self.limit_scale = limit_scale
+        self.random_429 = random_429
+        self.retry_after = retry_after
+        self.stub = StubWebClient(admins=admins)
+        self.calls: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._windows: dict[tuple[str, str | None], tuple[int, int]] = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def _limited(self, method: str, channel: str | None) -> int | None:
+        """Seconds the caller should wait if the call is refused, None if it's allowed"""
+        with self._lock:
+            if self.random_429 and self._rng.random() < self.random_429:
+                return self.retry_after
+            if not self.limit_scale:
+                return None
+            # Fixed one minute windows, like Slack's own accounting
+            now = time.time()
+            minute = int(now // 60)
+            budgets = [((method, channel if method in PER_CHANNEL else None), METHOD_LIMITS.get(method, DEFAULT_LIMIT))]
+            if method in WORKSPACE_LIMITS:
+                budgets.append(((method, "*"), WORKSPACE_LIMITS[method]))
+            counts = []
+            for key, per_minute in budgets:
+                window, count = self._windows.get(key, (minute, 0))
+                if window != minute:
+                    count = 0
+                if count >= max(1, int(per_minute * self.limit_scale)):
+                    return max(1, math.ceil((minute + 1) * 60 - now))
+                counts.append(count)
+            # Only calls that are let through count against the budgets
+            for (key, _), count in zip(budgets, counts):
+                self._windows[key] = (minute, count + 1)
+            return None
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def call(self, method: str, params: dict[str, Any]) -> tuple[int, dict[str, Any], int | None]:
+        """Answers a single API call, returns the HTTP status, body and Retry-After for a 429"""
+        started = time.time()
+        retry_after = self._limited(method, params.get("channel")) if method in METHODS else None
+        if method not in METHODS:
+            status, body = 200, {"ok": False, "error": "unknown_method"}
+        elif retry_after is not None:
+            status, body = 429, {"ok": False, "error": "ratelimited"}
+        else:
+            time.sleep(self._delay())
+            status, body = 200, dict(getattr(self.stub, method.replace(".", "_"))(**params))
+        with self._lock:
+            self.calls.append(
+                {
+                    "method": method,
+                    "status": status,
+                    "started": started,
+                    "seconds": time.time() - started,
+                    "channel": params.get("channel"),
+                    "user": params.get("user") or params.get("user_id") or params.get("users"),
+                }
+            )
+        return status, body, retry_after
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(Counter(call["method"] for call in self.calls))
+
+    def throttled(self) -> int:
+        with self._lock:
+            return sum(1 for call in self.calls if call["status"] == 429)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = []
+            self._windows = {}
+        self.stub.reset()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status: int, body: dict[str, Any] | list[Any], retry_after: int | None = None) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _params(self) -> dict[str, Any]:
+                url = urlsplit(self.path)
+                params: dict[str, Any] = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    raw = self.rfile.read(length).decode()
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(raw))
+                    else:
+                        params.update(parse_qsl(raw))
+                return params
+
+            def _dispatch(self) -> None:
+                path = urlsplit(self.path).path
+                if path == "/_calls":
+                    self._send(200, {"counts": standin.counts(), "calls": standin.calls})
+                elif path == "/_reset":
+                    standin.reset()
+                    self._send(200, {"ok": True})
+                elif path.startswith("/api/"):
+                    self._send(*standin.call(path[len("/api/"):], self._params()))
+                else:
+                    self._send(404, {"ok": False, "error": "not_found"})
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+            def log_message(self, format: str, *args: Any) -> None:
+                # Recorded in standin.calls instead
+                pass
+
+        return Handler
+
+    def start(self) -> "SlackStandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="slack-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "SlackStandIn":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Slack Web API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random variation in latency")
+    parser.add_argument("--limit-scale", type=float, default=1.0, help="fraction of Slack's per method limits to allow, 0 for no limits")
+    parser.add_argument("--random-429", type=float, default=0.0, help="share of calls to refuse regardless of limits")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After for the randomly refused calls")
+    parser.add_argument("--admin", action="append", help="members of the admin group, may be repeated")
+    args = parser.parse_args()
+
+    standin = SlackStandIn(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        limit_scale=args.limit_scale,
+        random_429=args.random_429,
+        retry_after=args.retry_after,
+        admins=args.admin,
+    )
+    print(f'Set "slack_base_url": "{standin.base_url}" in config.json')
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for method, count in sorted(standin.counts().items()):
+        print(f"  {method:24} {count}")
+    print(f"  {standin.throttled()} calls refused with 429")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# Measures how long the bot takes to import, which is everything that happens
+# before Socket Mode starts connecting. Each run is a fresh interpreter with
+# outbound connections blocked, so any network I/O at import time shows up as a
+# failed connection attempt (and usually a failed import) rather than a slow one.
+#
+# Run from the bot's working directory (the one with config.json) with:
+# python -m benchmarks.startup [--async] [--runs 10] [--budget 0.5]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter
+PROBE = """
+import json, socket, sys, time
+attempts = []
+def blocked(self, address):
+    attempts.append(repr(address))
+    raise OSError("network disabled by benchmarks.startup")
+socket.socket.connect = blocked
+start = time.perf_counter()
+error = None
+try:
+    __import__(sys.argv[1])
+except Exception as e:
+    error = repr(e)
+print(json.dumps({"seconds": time.perf_counter() - start, "attempts": attempts, "error": error}))
+"""
+
+
+def run_once(module: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+    r = subprocess.run(
+        [sys.executable, "-c", PROBE, module],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return json.loads(r.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Time how long pledgeBot takes to import")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="time pledgeBotAsync instead")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=0.5, help="median seconds allowed")
+    args = parser.parse_args()
+
+    module = "pledgeBotAsync" if args.use_async else "pledgeBot"
+    results = [run_once(module) for _ in range(args.runs)]
+    times = [r["seconds"] for r in results]
+    attempts = sorted({a for r in results for a in r["attempts"]})
+    errors = sorted({r["error"] for r in results if r["error"]})
+
+    print(f"{module}: {args.runs} imports")
+    print(f"  min {min(times):.3f}s  median {statistics.median(times):.3f}s  max {max(times):.3f}s")
+    if attempts:
+        print(f"  network access attempted at import: {', '.join(attempts)}")
+    for error in errors:
+        print(f"  import failed: {error}")
+
+    ok = not attempts and not errors and statistics.median(times) <= args.budget
+    print("  OK" if ok else f"  FAILED (budget {args.budget}s, no network access)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+# Stand-ins for the Slack WebClient and TidyHQ used by the benchmarks. Every Slack
+# method call is recorded with the size of its serialised payload and answered
+# immediately with a plausible response, and TidyHQ requests are answered with
+# contacts for the synthetic users, plus any other Slack ids a benchmark needs
+# linked, so handlers can run without a workspace or network.
+
+import itertools
+import json
+import logging
+import threading
+import time
+from typing import Any
+
+from benchmarks.synthetic import ADMIN, USERS, user_id
+from utils import instrument
+from utils.tidyhq import TidyHQClient
+
+
+def directory(users: list[str] | None = None) -> list[str]:
+    """The synthetic users followed by any others, such as the anonymised ids in a recording"""
+    synthetic = [user_id(n) for n in range(USERS)]
+    known = set(synthetic)
+    return synthetic + [user for user in dict.fromkeys(users or []) if user not in known]
+
+
+class StubResponse(dict):
+    """Dict response that also has the .data and .get used on SlackResponse"""
+
+    @property
+    def data(self) -> dict[str, Any]:
+        return self
+
+
+class StubWebClient:
+    """Records Slack API calls and returns canned responses"""
+
+    # Read by Bolt when it builds the client passed to each listener, which calls base_url directly
+    timeout = 30
+    ssl = None
+    proxy = None
+    headers: dict[str, str] = {}
+    retry_handlers = None
+    logger = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        admins: list[str] | None = None,
+        latency: float = 0.0,
+        base_url: str = "https://slack.com/api/",
+        users: list[str] | None = None,
+    ) -> None:
+        self.admins = admins if admins is not None else [ADMIN]
+        self.users = directory(users)
+        self.base_url = base_url
+        self.latency = latency
+        self.calls: list[tuple[str, int]] = []
+        self._lock = threading.Lock()
+        self._ts = itertools.count(1)
+
+    def with_priority(self, priority: int) -> "StubWebClient":
+        return self
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = []
+
+    @property
+    def bytes_sent(self) -> int:
+        return sum(size for _, size in self.calls)
+
+    def _respond(self, method: str, kwargs: dict[str, Any]) -> StubResponse:
+        if method == "conversations_open":
+            return StubResponse(ok=True, channel={"id": f"D{kwargs.get('users', 'U')}"})
+        if method in ("chat_postMessage", "chat_update"):
+            ts = kwargs.get("ts") or f"{int(time.time())}.{next(self._ts):06d}"
+            return StubResponse(ok=True, channel=kwargs.get("channel"), ts=ts)
+        if method == "usergroups_users_list":
+            return StubResponse(ok=True, users=list(self.admins))
+        if method == "users_info":
+            user = kwargs.get("user", "U")
+            return StubResponse(ok=True, user={"id": user, "name": user.lower(), "real_name": user})
+        if method == "usergroups_list":
+            return StubResponse(ok=True, usergroups=[{"id": "SBENCHMARK", "handle": "admins", "users": list(self.admins)}])
+        if method == "auth_test":
+            return StubResponse(ok=True, user_id="UBOT000001", bot_id="BBOT000001", team_id="TBENCHMARK")
+        if method == "users_list":
+            offset = int(kwargs.get("cursor") or 0)
+            limit = int(kwargs.get("limit") or 200)
+            users = self.users[offset : offset + limit]
+            cursor = str(offset + limit) if offset + limit < len(self.users) else ""
+            return StubResponse(
+                ok=True,
+                members=[{"id": user, "name": user.lower(), "real_name": user} for user in users],
+                response_metadata={"next_cursor": cursor},
+            )
+        if method in ("views_open", "views_publish", "views_update"):
+            view = kwargs.get("view", {})
+            # Sent as a JSON string when the call is form encoded
+            if isinstance(view, str):
+                view = json.loads(view)
+            return StubResponse(ok=True, view={"id": "V0001", **view})
+        return StubResponse(ok=True)
+
+    def __getattr__(self, method: str) -> Any:
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(**kwargs: Any) -> StubResponse:
+            # Counted like RateLimitedWebClient.api_call does
+            instrument.count(f"slack.{method.replace('_', '.')}")
+            size = len(json.dumps(kwargs, default=str))
+            with self._lock:
+                self.calls.append((method, size))
+            if self.latency:
+                time.sleep(self.latency)
+            return self._respond(method, kwargs)
+
+        return call
+
+
+class StubTidyHQResponse:
+    def __init__(self, data: Any) -> None:
+        self.status_code = 200
+        self.headers: dict[str, str] = {}
+        self._body = json.dumps(data).encode()
+
+    def json(self) -> Any:
+        return json.loads(self._body)
+
+    def iter_content(self, chunk_size: int = 1) -> Any:
+        for i in range(0, len(self._body), chunk_size):
+            yield self._body[i : i + chunk_size]
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class StubTidyHQSession:
+    """Answers TidyHQClient's requests: one contact per user in the directory, no existing invoices"""
+
+    def __init__(self, field_id: str, organisation: dict[str, Any], users: list[str] | None = None) -> None:
+        self.field_id = field_id
+        self.organisation = organisation
+        self.users = directory(users)
+        self._invoice_ids = itertools.count(1)
+        self.params: dict[str, Any] = {}
+
+    def mount(self, *args: Any) -> None:
+        pass
+
+    def request(self, method: str, url: str, params: dict[str, Any] | None = None, **kwargs: Any) -> StubTidyHQResponse:
+        path = url.split("/v1/", 1)[1]
+        params = params or {}
+        if method == "POST" and path == "invoices":
+            return StubTidyHQResponse({"id": next(self._invoice_ids), "amount": params.get("amount")})
+        if path == "organization":
+            return StubTidyHQResponse(self.organisation)
+        if path == "contacts":
+            # Only the first sync sees every contact, incremental syncs find nothing new
+            if params.get("updated_since"):
+                return StubTidyHQResponse([])
+            offset, limit = int(params.get("offset", 0)), int(params.get("limit", 500))
+            return StubTidyHQResponse(
+                [
+                    {
+                        "id": n,
+                        "contact_id": n,
+                        "display_name": self.users[n],
+                        "custom_fields": [{"id": self.field_id, "value": self.users[n]}],
+                    }
+                    for n in range(offset, min(len(self.users), offset + limit))
+                ]
+            )
+        return StubTidyHQResponse([])
+
+
+def install(
+    bot: Any, client: StubWebClient, organisation: dict[str, Any] | None = None, users: list[str] | None = None
+) -> None:
+    """Points an imported pledgeBot at the stubs instead of Slack and TidyHQ, with contacts for users as well"""
+    # Bolt keeps the client it was given in App._client, listeners read it through app.client
+    bot.app._client = client
+    bot.background_client = client
+    bot.promotion_refresh.client = client
+    bot.reconciler.client = client
+    # Invoicing posts through its own app, share the bot's
+    bot.utils.project_output.invoice_slack_app = bot.app
+
+    tidyhq = TidyHQClient("benchmark", per_minute=10**6)
+    tidyhq.session = StubTidyHQSession(  # type: ignore
+        str(bot.config["tidyhq_slack_id_field"]),
+        organisation or {"name": "Benchmark", "domain_prefix": "benchmark"},
+        users,
+    )
+    bot.utils.tidyhq._client = tidyhq
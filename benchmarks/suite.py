@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+# Benchmarks the rendering and pledge hot paths against synthetic stores of
+# increasing size. Each size runs in a fresh interpreter, in a scratch directory
+# holding a generated projects.json and a config.json, with Slack replaced by
+# benchmarks.stub_client.
+#
+# For each function it reports the median wall time per call along with, per call:
+#   file_reads   files opened for reading
+#   store_parses times the store parsed projects.json from scratch
+#   store_bytes  bytes added to the store's files on disk
+#   slack_calls  Slack API calls, including background refreshes the call triggered
+#   slack_bytes  bytes of serialised Slack payloads
+#   alloc_peak   peak traced allocations in bytes during a single call
+#
+# Results can be saved as JSON and compared with an earlier run. A comparison
+# fails if a function makes more file reads, store parses or Slack calls than
+# before, or if an App Home function is slower by more than the tolerance.
+#
+# python -m benchmarks.suite [--sizes 100,1000,10000] [--runs 5] [--output results.json] [--baseline baseline.json]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A slower App Home is what users notice, so these are held to the wall time tolerance
+HOME_PATH = {"display_home_projects", "display_home_projects_admin", "display_home_projects_cold", "home_view"}
+
+# Compared exactly, any increase is a regression
+COUNTERS = ("file_reads", "store_parses", "slack_calls")
+
+CONFIG = {
+    "SLACK_BOT_TOKEN": "xoxb-benchmark",
+    "SLACK_APP_TOKEN": "xapp-benchmark",
+    "tidyhq_token": "benchmark",
+    "projects": "projects.json",
+    "tidyhq_dgr_category": 1,
+    "tidyhq_project_category": 2,
+    "tidyhq_slack_id_field": "0",
+    "admin_group": "SBENCHMARK",
+    "admin_channel": "CADMIN0001",
+    "home_refresh_window": 0,
+    "promotion_refresh_window": 0,
+    "tax_info": "https://example.com/tax",
+    "age_out_threshold": 14,
+    "default_promotion_channel": "CPROMO0001",
+}
+
+ORGANISATION = {"name": "Benchmark Makerspace", "domain_prefix": "benchmark"}
+
+
+class Counters:
+    """Counts files opened for reading through an audit hook, which can't be removed once added"""
+
+    def __init__(self) -> None:
+        self.file_reads = 0
+        self.active = False
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event: str, args: tuple) -> None:
+        if not self.active or event != "open":
+            return
+        _, mode, flags = args
+        if mode is None:
+            reading = flags & (os.O_WRONLY | os.O_RDWR) == 0
+        else:
+            reading = not any(c in str(mode) for c in "wax+")
+        if reading:
+            self.file_reads += 1
+
+
+def store_size(path: str) -> int:
+    total = 0
+    for suffix in ("", ".journal", ".journal.compacting"):
+        try:
+            total += os.path.getsize(path + suffix)
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def worker(runs: int) -> dict[str, dict[str, float]]:
+    # Imported here so the bot reads the scratch directory's config.json
+    import pledgeBot as bot
+    from benchmarks.stub_client import StubWebClient, install
+    from benchmarks.synthetic import ADMIN, USERS, user_id
+
+    counters = Counters()
+    client = StubWebClient()
+    install(bot, client, ORGANISATION)
+    store = bot.store
+    path = bot.config["projects"]
+
+    def settle() -> None:
+        # Background refreshes triggered by a call are part of its cost
+        bot.home_refresh.wait_idle(60)
+        bot.promotion_refresh.wait_idle(60)
+
+    def measure(call: Callable[[int], Any], setup: Callable[[], Any] | None = None, repeat: int = 1) -> dict[str, float]:
+        times: list[float] = []
+        settle()
+        client.reset()
+        counters.file_reads = 0
+        parses, size = store.reads, store_size(path)
+        calls = 0
+        for run in range(runs):
+            if setup:
+                setup()
+            counters.active = True
+            start = time.perf_counter()
+            for i in range(repeat):
+                call(run * repeat + i)
+            times.append((time.perf_counter() - start) / repeat)
+            counters.active = False
+            calls += repeat
+            settle()
+        result = {
+            "wall": statistics.median(times),
+            "file_reads": counters.file_reads / calls,
+            "store_parses": (store.reads - parses) / calls,
+            "store_bytes": (store_size(path) - size) / calls,
+            "slack_calls": len(client.calls) / calls,
+            "slack_bytes": client.bytes_sent / calls,
+        }
+
+        if setup:
+            setup()
+        tracemalloc.start()
+        call(runs * repeat)
+        result["alloc_peak"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        settle()
+        return result
+
+    # Warm the store and the admin group before anything is timed
+    store.load()
+    bot.admins.refresh(client)
+    seeking = [id for id, _ in store.seeking_donations()]
+    popular = max(store.load(), key=lambda id: len(store.get(id).get("pledges", {})))  # type: ignore
+    donor = user_id(0)
+
+    results: dict[str, dict[str, float]] = {}
+    results["create_progress_bar"] = measure(lambda i: bot.create_progress_bar(i % 1000, 1000), repeat=1000)
+    results["project_options"] = measure(lambda i: bot.project_options())
+    results["project_options_approved"] = measure(lambda i: bot.project_options(approved=True))
+    results["display_project_details"] = measure(lambda i: bot.display_project_details(popular))
+    results["display_home_projects_cold"] = measure(
+        lambda i: bot.display_home_projects(user=donor, client=client), setup=bot.fragments.clear
+    )
+    results["display_home_projects"] = measure(lambda i: bot.display_home_projects(user=donor, client=client))
+    results["display_home_projects_admin"] = measure(lambda i: bot.display_home_projects(user=ADMIN, client=client))
+    results["home_view"] = measure(lambda i: bot.home_view(user=donor, client=client))
+    if seeking:
+        # New donors pledging a dollar so no project is funded part way through
+        results["pledge"] = measure(lambda i: bot.pledge(seeking[i % len(seeking)], 1, user_id(USERS + i)))
+    return results
+
+
+@contextmanager
+def scratch(
+    size: int,
+    max_pledges: int = 500,
+    seed: int = 0,
+    config: dict[str, Any] | None = None,
+    projects: dict[str, dict[str, Any]] | None = None,
+) -> Iterator[str]:
+    """Temporary bot working directory with a config.json and a synthetic store of size projects, or the given projects"""
+    from benchmarks import synthetic
+
+    with tempfile.TemporaryDirectory(prefix="pledgebot-bench-") as directory:
+        with open(os.path.join(directory, "config.json"), "w") as f:
+            json.dump({**CONFIG, **(config or {})}, f, indent=4)
+        if projects is None:
+            projects = synthetic.generate(size, max_pledges=max_pledges, seed=seed)
+        synthetic.write(os.path.join(directory, CONFIG["projects"]), projects)
+        # Saved organisation details so rendering never asks TidyHQ
+        with open(os.path.join(directory, "tidyhq_org.json"), "w") as f:
+            json.dump({"fetched": time.time(), "organization": ORGANISATION}, f)
+        yield directory
+
+
+def run_worker(module: str, directory: str, args: list[str]) -> Any:
+    """Runs module with --worker in directory and returns the JSON it prints last"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+    r = subprocess.run(
+        [sys.executable, "-m", module, "--worker", *args],
+        cwd=directory,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if r.returncode != 0:
+        raise RuntimeError(f"{module} failed:\n{r.stderr}")
+    return json.loads(r.stdout.strip().splitlines()[-1])
+
+
+def run_size(size: int, runs: int, max_pledges: int, seed: int) -> dict[str, dict[str, float]]:
+    with scratch(size, max_pledges, seed) as directory:
+        return run_worker("benchmarks.suite", directory, ["--runs", str(runs)])
+
+
+def revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Returns a description of each regression from baseline"""
+    regressions: list[str] = []
+    for size, functions in results["sizes"].items():
+        for name, metrics in functions.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            for counter in COUNTERS:
+                if metrics[counter] > before[counter]:
+                    regressions.append(f"{name} ({size} projects): {counter} {before[counter]:g} -> {metrics[counter]:g}")
+            if name in HOME_PATH and metrics["wall"] > before["wall"] * (1 + tolerance):
+                regressions.append(
+                    f"{name} ({size} projects): {before['wall'] * 1000:.2f}ms -> {metrics['wall'] * 1000:.2f}ms"
+                )
+    return regressions
+
+
+def report(results: dict[str, Any]) -> None:
+    for size, functions in results["sizes"].items():
+        print(f"{size} projects")
+        for name, m in functions.items():
+            print(
+                f"  {name:30} {m['wall'] * 1000:9.3f}ms  reads {m['file_reads']:g}  parses {m['store_parses']:g}  "
+                f"store {m['store_bytes']:.0f}B  slack {m['slack_calls']:g} calls/{m['slack_bytes']:.0f}B  "
+                f"peak {m['alloc_peak'] / 1024:.0f}KiB"
+            )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark pledgeBot's rendering and pledge paths")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated project counts")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-pledges", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed App Home slowdown, 0.25 is 25%%")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.runs)))
+        return 0
+
+    results: dict[str, Any] = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "time": int(time.time()),
+        "runs": args.runs,
+        "max_pledges": args.max_pledges,
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for size in (int(s) for s in args.sizes.split(",")):
+        results["sizes"][str(size)] = run_size(size, args.runs, args.max_pledges, args.seed)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+# Deterministic synthetic project stores for benchmarking. The same size and seed
+# always produce the same projects, so results from different runs and different
+# branches can be compared directly. Timestamps are relative to now so funded
+# projects age out of the App Home the same way whenever the store is generated.
+#
+# Projects are a mix of approved and seeking donations, recently and long ago
+# funded, reconciled and awaiting approval. Most have a handful of pledges, a few
+# have up to max_pledges, and promoted projects carry a list of promotions.
+#
+# python -m benchmarks.synthetic projects.json --projects 1000 [--seed 0]
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Any
+
+from utils.store import stamp_aggregates
+
+USERS = 5000
+ADMIN = "UADMIN0001"
+CHANNELS = [f"C{n:08d}" for n in range(40)]
+
+
+def user_id(n: int) -> str:
+    return f"U{n:09d}"
+
+
+def generate(
+    projects: int,
+    max_pledges: int = 500,
+    max_promotions: int = 30,
+    seed: int = 0,
+    now: int | None = None,
+) -> dict[str, dict[str, Any]]:
+    """Returns projects keyed by id, as they'd be found in projects.json"""
+    rng = random.Random(seed)
+    now = now if now is not None else int(time.time())
+    store: dict[str, dict[str, Any]] = {}
+    for n in range(projects):
+        creator = user_id(rng.randrange(USERS))
+        # Skewed so most projects are small and a few are very popular
+        donors = rng.sample(range(USERS), int(max_pledges * rng.random() ** 3))
+        pledges = {user_id(d): rng.choice((10, 20, 25, 50, 100, 250)) for d in donors}
+        pledged = sum(pledges.values())
+        project: dict[str, Any] = {
+            "title": f"Synthetic project {n}",
+            "desc": " ".join(rng.choice(("laser", "lathe", "shelving", "3D printer", "tools", "space")) for _ in range(30)),
+            "img": "" if rng.random() < 0.5 else f"https://example.com/{n}.png",
+            "created by": creator,
+            "created at": now - rng.randrange(86400 * 365),
+            "last updated by": creator,
+            "dgr": rng.random() < 0.3,
+            "pledges": pledges,
+            "promotions": [],
+        }
+
+        state = rng.random()
+        if state < 0.15:
+            # Awaiting approval
+            project["approved"] = False
+            project["total"] = pledged + rng.randrange(100, 5000)
+        else:
+            project["approved"] = True
+            project["approved at"] = project["created at"] + 3600
+            if state < 0.75:
+                project["total"] = pledged + rng.randrange(100, 5000)
+            else:
+                project["total"] = max(1, pledged - rng.randrange(0, 20))
+                # Funded, some recently enough to show on the App Home
+                project["funded at"] = now - rng.randrange(86400 * (30 if state < 0.85 else 365))
+                if state > 0.9:
+                    project["reconciled at"] = project["funded at"] + 86400
+
+        if project["approved"] and rng.random() < 0.4:
+            project["promotions"] = [
+                {"channel": rng.choice(CHANNELS), "ts": f"{now - rng.randrange(10**6)}.{rng.randrange(10**6):06d}"}
+                for _ in range(rng.randrange(1, max_promotions + 1))
+            ]
+
+        stamp_aggregates(project)
+        store[f"synthetic-{n:05d}"] = project
+    return store
+
+
+def write(path: str, projects: dict[str, dict[str, Any]]) -> int:
+    """Writes a snapshot with no journal. Returns its size in bytes"""
+    data = json.dumps(projects, indent=4)
+    with open(path, "w") as f:
+        f.write(data)
+    return len(data)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Write a synthetic projects.json")
+    parser.add_argument("path")
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--max-pledges", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    size = write(args.path, generate(args.projects, max_pledges=args.max_pledges, seed=args.seed))
+    print(f"Wrote {args.projects} projects ({size} bytes) to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,27 @@
 #!/usr/bin/python3
 
+import copy
 import json
 import random
 import string
 import time
 from datetime import datetime
 from pprint import pprint  # type: ignore # This has been left in for debugging purposes
-from typing import Any
+from typing import Any, Callable
+import utils.admin_cache
+import utils.debounce
+import utils.dm_cache
+import utils.instrument
 import utils.project_output
+import utils.promotions
+import utils.reconcile
+import utils.recorder
+import utils.render_cache
+import utils.slack_client
+import utils.store
+import utils.tidyhq
+from utils.locks import project_locks
 
-import requests
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk.web.client import WebClient  # for typing
@@ -19,81 +31,83 @@ from slack_sdk.web.slack_response import SlackResponse  # for typing
 with open("config.json", "r") as f:
     config = json.load(f)
 
+# Shared in-memory project store
+store = utils.store.configured_store(config)
+
+# Rendered App Home fragments, keyed by project version
+fragments = utils.render_cache.FragmentCache(
+    max_bytes=config.get("fragment_cache_bytes", 4 * 1024 * 1024)
+)
+
+# Cached membership of the admin group, kept up to date by subteam events
+admins = utils.admin_cache.GroupMembership(
+    config["admin_group"], ttl=config.get("admin_cache_ttl", 300)
+)
+
 ########################
 # Processing functions #
 ########################
 
 
-# Load projects
-def load_projects():
-    with open("projects.json", "r") as f:
-        return json.load(f)
-
+# Load projects, the returned dict is shared and should not be modified
+def load_projects() -> dict[str, dict[str, Any]]:
+    return store.load()
 
-# Update project, data should be an entire project initially pulled with get_project
-def write_project(id: str, data: dict[str, Any], user: str | bool):
-    projects = load_projects()
-    if id not in projects.keys():
-        data["created by"] = user
-        data["created at"] = int(time.time())
-        data["last updated by"] = user
-        data["last updated at"] = int(time.time())
-        # Projects should default to DGR False
-        data["dgr"] = False
-        projects[id] = data
-        with open("projects.json", "w") as f:
-            json.dump(projects, f, indent=4, sort_keys=True)
-
-        # Notify the admin channel
-        app.client.chat_postMessage(  # type: ignore
-            channel=config["admin_channel"],
-            text=f'"{data["title"]}" has been created by <@{user}>. It will need to be approved before it will show up on the full list of projects or to be marked as DGR eligible. This can be completed by any member of <!subteam^{config["admin_group"]}> by clicking on my name or waiting for the creator to request approval themselves.',
-        )
 
-    else:
-        if user:
+# Write the project and return the previous version, or None if the project is new
+def save_project(
+    id: str, data: dict[str, Any], user: str | bool
+) -> dict[str, Any] | None:
+    with project_locks.project(id):
+        old = store.get(id)
+        if old is None:
+            data["created by"] = user
+            data["created at"] = int(time.time())
+            data["last updated by"] = user
+            data["last updated at"] = int(time.time())
+            # Projects should default to DGR False
+            data["dgr"] = False
+        elif user:
             data["last updated by"] = user
             data["last updated at"] = int(time.time())
+        store.put(id, data)
+    return old
 
-            # Send a notice to the admin channel and add further details as a thread
-            reply = app.client.chat_postMessage(  # type: ignore
-                channel=config["admin_channel"],
-                text=f'"{data["title"]}" has been updated by <@{user}>.',
-            )
 
-            app.client.chat_postMessage(  # type: ignore
-                channel=config["admin_channel"],
-                thread_ts=reply["ts"],  # type: ignore
-                text=f"Old:\n```{json.dumps(load_projects()[id], indent=4, sort_keys=True)}```",
-            )
+# Update project, data should be an entire project initially pulled with get_project
+def write_project(id: str, data: dict[str, Any], user: str | bool):
+    old = save_project(id, data, user)
+    announce_write(data, old, user)
 
-            app.client.chat_postMessage(  # type: ignore
-                channel=config["admin_channel"],
-                thread_ts=reply["ts"],  # type: ignore
-                text=f"New:\n```{json.dumps(data, indent=4, sort_keys=True)}```",
-            )
 
-            # Send a notice to the project creator if they're not the one updating it
-            if data["created by"] != user:
-                # Open a slack conversation with the creator and get the channel ID
-                r: SlackResponse = app.client.conversations_open(users=data["created by"])  # type: ignore
-                channel_id: str = str(r["channel"]["id"])  # type: ignore
+# Let the admins and the creator know a project was created or changed
+def announce_write(
+    data: dict[str, Any], old: dict[str, Any] | None, user: str | bool
+) -> None:
+    if old is None:
+        # Notify the admin channel
+        app.client.chat_postMessage(**created_notice(data, user))  # type: ignore
 
-                # Notify the creator
-                app.client.chat_postMessage(  # type: ignore
-                    channel=channel_id,
-                    text=f'A project you created ({data["title"]}) has been updated by <@{user}>.',
-                )
+    elif user:
+        # Send a notice to the admin channel and add further details as a thread
+        reply = app.client.chat_postMessage(**updated_notice(data, user))  # type: ignore
 
-        projects[id] = data
-        with open("projects.json", "w") as f:
-            json.dump(projects, f, indent=4, sort_keys=True)
+        for details in updated_details(old, data):
+            app.client.chat_postMessage(thread_ts=reply["ts"], **details)  # type: ignore
+
+        # Send a notice to the project creator if they're not the one updating it
+        if data["created by"] != user:
+            # Notify the creator
+            utils.dm_cache.send_dm(  # type: ignore
+                app.client, data["created by"], **creator_update_notice(data, user)
+            )
 
 
+# Returns a copy of the project that can be safely modified and passed back to write_project
 def get_project(id: str) -> dict[str, Any]:
-    projects = load_projects()
-    if id in projects.keys():
-        return projects[id]
+    project = store.checkout(id)
+    if project is not None:
+        return project
     else:
         return {
             "title": "Your new project",
@@ -104,27 +118,106 @@ def get_project(id: str) -> dict[str, Any]:
         }
 
 
+# Returns the shared copy of a project for display purposes, this should not be modified
+def peek_project(id: str) -> dict[str, Any]:
+    project = store.get(id)
+    if project is not None:
+        return project
+    return get_project(id)
+
+
 def unapprove_project(id: str) -> None:
-    project = get_project(id)
-    project["approved"] = False
-    write_project(id, project, user=False)
+    with project_locks.project(id):
+        project = get_project(id)
+        project["approved"] = False
+        write_project(id, project, user=False)
+
+
+def mark_approved(id: str, dgr: bool) -> dict[str, Any]:
+    with project_locks.project(id):
+        project: dict[str, Any] = get_project(id)
+        project["approved"] = True
+        project["approved_at"] = int(time.time())
+        project["dgr"] = dgr
+        save_project(id, project, user=False)
+    return project
 
 
 def log_promotion(project_id: str, slack_response: SlackResponse) -> None:
-    project = get_project(project_id)
-    if "promotions" not in project.keys():
-        project["promotions"] = []
-    project["promotions"].append(  # type: ignore
-        {"channel": slack_response["channel"], "ts": slack_response["ts"]}
-    )
-    write_project(project_id, project, user=False)
+    with project_locks.project(project_id):
+        project = get_project(project_id)
+        if "promotions" not in project.keys():
+            project["promotions"] = []
+        project["promotions"].append(  # type: ignore
+            {"channel": slack_response["channel"], "ts": slack_response["ts"]}
+        )
+        write_project(project_id, project, user=False)
 
 
 def delete_project(id: str) -> None:
-    projects = load_projects()
-    del projects[id]
-    with open("projects.json", "w") as f:
-        json.dump(projects, f, indent=4, sort_keys=True)
+    with project_locks.project(id):
+        store.delete(id)
+
+
+# Project id submitted with an edit modal
+def modal_project_id(body: dict[str, Any]) -> str:
+    if "private_metadata" in body["view"].keys():
+        return body["view"]["private_metadata"]
+    return body["view"]["state"]["values"]["projectDropdown"]["project_selector"][
+        "selected_option"
+    ][
+        "value"
+    ]  # Gotta be an easier way
+
+
+# Find our slack_id_shuffle'd total field
+def total_field(data: dict[str, Any]) -> str:
+    total_shuffled = False
+    for field in data:
+        if slack_id_shuffle(field, r=True) == "total":
+            total_shuffled = field
+
+    if not total_shuffled:
+        # This should never happen
+        pass
+    return total_shuffled  # type: ignore
+
+
+# Returns the errors to show on the edit modal, empty if the update can be saved
+def validate_update(body: dict[str, Any]) -> dict[str, str]:
+    data = body["view"]["state"]["values"]
+    errors = {}
+    field = total_field(data)
+
+    # Is cost a number
+    total = data[field]["plain_text_input-action"]["value"].replace("$", "")
+    if check_bad_currency(total):
+        errors[field] = check_bad_currency(total)
+    return errors  # type: ignore
+
+
+# Save a validated edit modal, returns the project id, the updated project and the previous version
+def apply_update(
+    body: dict[str, Any]
+) -> tuple[str, dict[str, Any], dict[str, Any] | None]:
+    data = body["view"]["state"]["values"]
+    project_id = modal_project_id(body)
+    total = int(data[total_field(data)]["plain_text_input-action"]["value"].replace("$", ""))
+
+    with project_locks.project(project_id):
+        # Get existing project info
+        project = get_project(project_id)
+
+        for v in data:
+            # Slack preserves field input when updating a view based on IDs. Because this cannot be disabled we add junk data to each ID to confuse slack.
+            v_clean = slack_id_shuffle(v, r=True)
+            if v_clean == "total":
+                project[v_clean] = total
+            else:
+                if "plain_text_input-action" in data[v].keys():
+                    project[v_clean] = data[v]["plain_text_input-action"]["value"]
+        old = save_project(project_id, project, body["user"]["id"])
+    return project_id, project, old
 
 
 def validate_id(id: str) -> bool:
@@ -134,119 +227,98 @@ def validate_id(id: str) -> bool:
     return False
 
 
+# Record a pledge, returns the updated project, the pledged amount and whether the pledge funded the project
+def record_pledge(
+    id: str, amount: int | str, user: str, percentage: bool = False
+) -> tuple[dict[str, Any], int, bool]:
+    # Hold the project lock from reading the project until the pledge has been written so concurrent pledges aren't lost
+    with project_locks.project(id):
+        project = store.checkout(id)
+        if project is None:
+            raise Exception("Project not found")
+        if "pledges" not in project.keys():
+            project["pledges"] = {}
+        if amount == "remaining":
+            pledged, _, _ = utils.store.aggregates(project)
+            current_total = pledged - int(project["pledges"].get(user, 0))
+            amount = project["total"] - current_total
+        if percentage:
+            amount = int(project["total"] * (int(amount) / 100))
+        project["pledges"][user] = int(amount)
+        # The aggregates in the checked out copy still describe the pledges before this one
+        utils.store.stamp_aggregates(project)
+
+        funded = check_if_funded(project)
+        if funded:
+            # Mark when the project was funded
+            project["funded at"] = int(time.time())
+        save_project(id, project, user=False)
+    return project, int(amount), funded
+
+
+# Send a notice about a change that has already been saved. Once the client has used
+# up its rate limit retries the notice is dropped, the handler shouldn't report an error
+# for a change that went through
+def notify_saved(send: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    try:
+        return send(*args, **kwargs)
+    except Exception as e:
+        if not utils.slack_client.rate_limited(e):
+            raise
+        print(f"Still rate limited after retries, dropped {getattr(send, '__name__', 'notice')}: {e}")
+        return None
+
+
 def pledge(
     id: str, amount: int | str, user: str, percentage: bool = False
 ) -> list[dict[str, Any]]:
-    project: dict[str, Any] = load_projects()[id]
-    if "pledges" not in project.keys():
-        project["pledges"] = {}
-    if amount == "remaining":
-        current_total = 0
-        for pledge in project["pledges"]:  # type: ignore
-            if pledge != user:
-                current_total += int(project["pledges"][pledge])  # type: ignore
-        amount = project["total"] - current_total
-    if percentage:
-        amount = int(project["total"] * (int(amount) / 100))
-    project["pledges"][user] = int(amount)
-    write_project(id, project, user=False)
-
-    # Open a slack conversation with the donor and get the channel ID
-    r = app.client.conversations_open(users=user)  # type: ignore
-    channel_id = r["channel"]["id"]  # type: ignore
+    project, amount, funded = record_pledge(id, amount, user, percentage)
 
     # Notify/thank the donor
-
-    app.client.chat_postMessage(  # type: ignore
-        channel=channel_id,  # type: ignore
-        text=f'We\'ve updated your *total* pledge for "{project["title"]}" to ${amount}. Thank you for your support!\n\nOnce the project is fully funded I\'ll be in touch to arrange payment.',
-    )
+    notify_saved(utils.dm_cache.send_dm, app.client, user, **pledge_thanks(project, amount))
 
     # Check if the project has met its goal
-    if check_if_funded(id=id):
+    if funded:
         # Notify the admin channel
-        app.client.chat_postMessage(  # type: ignore
-            channel=config["admin_channel"],
-            text=f'"{project["title"]}" has met its funding goal!',
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f'"{project["title"]}" has met its funding goal!',
-                    },
-                    "accessory": {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Send invoices",
-                            "emoji": True,
-                        },
-                        "value": id,
-                        "action_id": "sendInvoices",
-                    },
-                }
-            ],
-        )
+        notify_saved(app.client.chat_postMessage, **funded_notice(id, project))
 
-        # Mark when the project was funded
-        project["funded at"] = int(time.time())
-        write_project(id, project, user=False)
-
-    # Update all promotions
-    message_blocks = display_project(id) + display_spacer() + display_donate(id)
-    for promotion in project.get("promotions", []):
-        app.client.chat_update(  # type: ignore
-            channel=promotion["channel"],
-            ts=promotion["ts"],
-            blocks=message_blocks,
-            text="A project was donated to",
-        )
+    # Update all promotions in the background
+    promotion_refresh.request(id)
 
     # Update app home of donor first so they see the updated pledge faster
-    update_home(user=user, client=app.client)
+    home_refresh.request(user, urgent=True)
 
-    # Update app homes of all donors
+    # Update app homes of all donors. Refreshes are merged so a burst of pledges only re-renders each home once
     for donor in project.get("pledges", {}):
         if donor != user:
-            update_home(user=donor, client=app.client)
+            home_refresh.request(donor)
 
     # Send back an updated project block
-    return display_project(id) + display_spacer() + display_donate(id)
+    return promotion_blocks(id)
 
 
 def project_options(restricted: str | bool = False, approved: bool = False):
-    projects = load_projects()
-    options: list[dict[str, Any]] = []
-    for project in projects:
-        # Don't present funded projects as options
-        if check_if_funded(id=project):
-            continue
-
+    # Don't present funded projects as options
+    if restricted:
+        projects = [
+            (id, project)
+            for id, project in store.awaiting_approval(created_by=str(restricted))
+            if not check_if_funded(project)
+        ]
+    elif approved:
         # If only approved projects have been requested, skip unapproved projects
-        if approved and not projects[project].get("approved", False):
-            continue
-
-        if restricted:
-            if projects[project]["created by"] == restricted and not projects[
-                project
-            ].get("approved", False):
-                options.append(
-                    {
-                        "text": {
-                            "type": "plain_text",
-                            "text": projects[project]["title"],
-                        },
-                        "value": project,
-                    }
-                )
-        else:
-            options.append(
-                {
-                    "text": {"type": "plain_text", "text": projects[project]["title"]},
-                    "value": project,
-                }
-            )
+        projects = store.seeking_donations()
+    else:
+        projects = store.unfunded()
+
+    options: list[dict[str, Any]] = []
+    for id, project in projects:
+        options.append(
+            {
+                "text": {"type": "plain_text", "text": project["title"]},
+                "value": id,
+            }
+        )
     return options
 
 
@@ -271,31 +343,21 @@ def check_bad_currency(s: str) -> bool | str:
 
 
 def auth(client, user) -> bool:  # type: ignore
-    r = client.usergroups_list(include_users=True)  # type: ignore
-    groups: list[dict[str, Any]] = r.data["usergroups"]  # type: ignore
-    for group in groups:  # type: ignore
-        if group["id"] == config["admin_group"] and user in group["users"]:
-            return True
-    return False
+    return admins.is_member(user=user, client=client)
 
 
 def check_if_funded(
     raw_project: dict[str, Any] | None = None, id: str | None = None
 ) -> bool:
     if id and not raw_project:
-        project: dict[str, Any] = get_project(id)
+        project: dict[str, Any] = peek_project(id)
     elif raw_project == None:
         raise ValueError("No project provided to check_if_funded")
     else:
         project = raw_project
 
-    current_pledges = 0
-    if "pledges" in project.keys():
-        for pledge in project["pledges"]:
-            current_pledges += int(project["pledges"][pledge])
-    if current_pledges >= project["total"]:
-        return True
-    return False
+    _, _, funded = utils.store.aggregates(project)
+    return funded
 
 
 def check_if_old(
@@ -303,7 +365,7 @@ def check_if_old(
 ) -> bool:
     """Returns True if the project was funded more than age_out_threshold days ago"""
     if id and not raw_project:
-        project: dict[str, Any] = get_project(id)
+        project: dict[str, Any] = peek_project(id)
     elif raw_project == None:
         raise ValueError("No project provided to check_if_old")
     else:
@@ -410,16 +472,11 @@ def construct_edit(project_id: str) -> list[dict[str, Any]]:
 
 
 def display_project(id: str, bar: bool = True) -> list[dict[str, Any]]:
-    project = get_project(id)
+    project = peek_project(id)
     image = "https://github.com/Perth-Artifactory/branding/blob/main/artifactory_logo/png/Artifactory_logo_MARK-HEX_ORANG.png?raw=true"  # default image
     if project["img"]:
         image = project["img"]
-    current_pledges = 0
-    backers = 0
-    if "pledges" in project.keys():
-        for pledge in project["pledges"]:
-            backers += 1
-            current_pledges += int(project["pledges"][pledge])
+    current_pledges, backers, _ = utils.store.aggregates(project)
     if bar:
         bar_emoji = create_progress_bar(current_pledges, project["total"]) + " "
     else:
@@ -453,12 +510,9 @@ def display_project(id: str, bar: bool = True) -> list[dict[str, Any]]:
 
 
 def display_project_details(project_id: str) -> list[dict[str, Any]]:
-    project = get_project(project_id)
+    project = peek_project(project_id)
 
-    current_pledges = 0
-    if "pledges" in project.keys():
-        for pledge in project["pledges"]:
-            current_pledges += int(project["pledges"][pledge])
+    current_pledges, _, funded = utils.store.aggregates(project)
 
     blocks = [
         {
@@ -481,8 +535,8 @@ def display_project_details(project_id: str) -> list[dict[str, Any]]:
         )
 
     # Funding
-    fields["Funded"] = bool_to_emoji(check_if_funded(project))
-    if check_if_funded(project) and project.get("funded at", False):
+    fields["Funded"] = bool_to_emoji(funded)
+    if funded and project.get("funded at", False):
         fields["Funded at"] = format_date(
             timestamp=project["funded at"], action="Funded at", raw=True
         )
@@ -493,6 +547,10 @@ def display_project_details(project_id: str) -> list[dict[str, Any]]:
         fields["Invoices sent at"] = format_date(
             timestamp=project["invoices_sent"], action="Invoices sent at", raw=True
         )
+    elif project.get("invoices", False):
+        # An earlier invoicing run didn't finish
+        done = sum(1 for invoice in project["invoices"].values() if invoice.get("notified"))
+        fields["Invoiced donors"] = f'{done}/{len(project.get("pledges", {}))}'
 
     # Reconciled
     fields["Reconciled"] = bool_to_emoji(project.get("reconciled at", False))
@@ -649,6 +707,43 @@ def display_admin_actions(id: str) -> list[dict[str, Any]]:
     return blocks
 
 
+def display_personal_actions(id: str) -> list[dict[str, Any]]:
+    return [
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Edit project",
+                        "emoji": True,
+                    },
+                    "value": id,
+                    "action_id": "edit_specific_project",
+                },
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Request approval",
+                        "emoji": True,
+                    },
+                    "value": id,
+                    "style": "primary",
+                    "confirm": display_confirm(
+                        title="Request Approval",
+                        text=str(display_help("approval", raw=True)),
+                        confirm="Request approval",
+                        abort="Cancel",
+                    ),
+                    "action_id": "request_project_approval",
+                },
+            ],
+        }
+    ]
+
+
 def display_confirm(
     title: str = "Are you sure?",
     text: str = "Do you want to do this?",
@@ -666,6 +761,11 @@ def display_confirm(
 
 
 def display_donate(id: str, user: str | None = None, home: bool = False):
+    return personalise_donate(id, render_donate(id, home=home), user=user)
+
+
+# Renders the parts of the donation blocks that are the same for every user
+def render_donate(id: str, home: bool = False) -> list[dict[str, Any]]:
     home_add = ""
     if home:
         home_add = "_home"
@@ -736,7 +836,7 @@ def display_donate(id: str, user: str | None = None, home: bool = False):
                 ],
             },
         ]
-        project = get_project(id)
+        project = peek_project(id)
         if project.get("dgr", False):
             blocks += [
                 {
@@ -744,20 +844,35 @@ def display_donate(id: str, user: str | None = None, home: bool = False):
                     "elements": [
                         {
                             "type": "mrkdwn",
-                            "text": f'Donations to this project are considered gifts to {tidyhq_org["name"]} and are <{config["tax_info"]}|tax deductible>.',
+                            "text": f'Donations to this project are considered gifts to {utils.tidyhq.organisation(config)["name"]} and are <{config["tax_info"]}|tax deductible>.',
                         }
                     ],
                 }
             ]
 
-    project = get_project(id)
+    return blocks
+
+
+# Adds per user details to blocks from render_donate without modifying them, so they can be shared between users
+def personalise_donate(
+    id: str, blocks: list[dict[str, Any]], user: str | None = None
+) -> list[dict[str, Any]]:
+    project = peek_project(id)
+    funded = check_if_funded(project)
+
+    if not funded:
+        # A fresh block id stops Slack carrying over anything previously typed into the input
+        blocks = [dict(blocks[0], block_id=slack_id_shuffle(id))] + blocks[1:]
+
     # This should really only be used in the App Home since it provides personalised results
 
     # Has the project received pledges?
     if "pledges" in project.keys():
         # Check if the user has already donated to this project
         if user in project["pledges"]:
-            if check_if_funded(id=id):
+            # Only the first block is personalised
+            blocks = copy.deepcopy(blocks[:1]) + blocks[1:]
+            if funded:
                 try:
                     blocks[0]["elements"][0]["text"] += f' Thank you for your ${project["pledges"][user]} donation!'  # type: ignore
                 except KeyError:
@@ -768,7 +883,7 @@ def display_donate(id: str, user: str | None = None, home: bool = False):
                     blocks[0]["element"]["initial_value"] = str(project["pledges"][user])  # type: ignore
                 except KeyError:
                     raise Exception("Blocks malformed")
-                blocks += [
+                blocks = blocks + [
                     {
                         "type": "context",
                         "elements": [
@@ -803,7 +918,7 @@ def display_edit_load(project_id: str | bool) -> list[dict[str, Any]]:
         }
     ]
     if project_id and isinstance(project_id, str):
-        project: dict[str, Any] = get_project(project_id)
+        project: dict[str, Any] = peek_project(project_id)
         initial = {
             "text": {"text": project["title"], "type": "plain_text"},
             "value": project_id,
@@ -815,6 +930,11 @@ def display_edit_load(project_id: str | bool) -> list[dict[str, Any]]:
     return box
 
 
+# The project as shown in promoted messages
+def promotion_blocks(id: str) -> list[dict[str, Any]]:
+    return display_project(id) + display_spacer() + display_donate(id)
+
+
 def display_detail_button(id: str) -> list[dict[str, Any]]:
     return [
         {
@@ -931,13 +1051,19 @@ def format_date(timestamp: int, action: str, raw: bool = False) -> str:
     return f"<!date^{timestamp}^{action} {{date_pretty}}|{action} {str(datetime.fromtimestamp(timestamp))}>"
 
 
-def display_home_projects(user: str, client: WebClient) -> list[dict[str, Any]]:
-    projects = load_projects()
+# Returns blocks for a project from the fragment cache, render is only called if the project has changed
+def cached_fragment(
+    project_id: str, name: str, render: Callable[[], list[dict[str, Any]]]
+) -> list[dict[str, Any]]:
+    return fragments.get((project_id, store.version(project_id), name), render)
 
+
+def display_home_projects(user: str, client: WebClient) -> list[dict[str, Any]]:
     blocks: list[dict[str, Any]] = []
+    admin = auth(user=user, client=client)
 
     # Let admins know that they're seeing extra stuff on this page
-    if auth(user=user, client=client):
+    if admin:
         blocks += [
             {
                 "type": "section",
@@ -959,47 +1085,70 @@ def display_home_projects(user: str, client: WebClient) -> list[dict[str, Any]]:
         }
     ]
 
-    for project in projects:
-        if projects[project].get("approved", False) and not check_if_funded(id=project):
-            blocks += display_project(project)
-            blocks += display_donate(project, user=user, home=True)
-            blocks += display_promote_button(id=project)
-            if auth(user=user, client=client):
-                blocks += display_admin_actions(project)
-            blocks += display_spacer()
+    # Project fragments are rendered once per project change and shared between users
+    for project, _ in store.seeking_donations():
+        blocks += cached_fragment(project, "project", lambda: display_project(project))
+        blocks += personalise_donate(
+            project,
+            cached_fragment(
+                project, "donate_home", lambda: render_donate(project, home=True)
+            ),
+            user=user,
+        )
+        if admin:
+            blocks += cached_fragment(
+                project,
+                "home_actions_admin",
+                lambda: display_promote_button(id=project)
+                + display_admin_actions(project)
+                + display_spacer(),
+            )
+        else:
+            blocks += cached_fragment(
+                project,
+                "home_actions",
+                lambda: display_promote_button(id=project) + display_spacer(),
+            )
 
     blocks += display_header("Recently funded projects")
-    for project in projects:
-        if check_if_funded(id=project) and not check_if_old(id=project):
-            blocks += display_project(project, bar=False)
-            if auth(user=user, client=client):
-                blocks += display_detail_button(id=project)
-            blocks += display_spacer()
-
-    if auth(user=user, client=client):
-        not_yet_approved: list[str] = []
-        for project in projects:
-            if not projects[project].get("approved", False):
-                not_yet_approved.append(project)
+    age_out = int(time.time()) - 86400 * config["age_out_threshold"]
+    for project, _ in store.recently_funded(since=age_out):
+        if admin:
+            blocks += cached_fragment(
+                project,
+                "funded_admin",
+                lambda: display_project(project, bar=False)
+                + display_detail_button(id=project)
+                + display_spacer(),
+            )
+        else:
+            blocks += cached_fragment(
+                project,
+                "funded",
+                lambda: display_project(project, bar=False) + display_spacer(),
+            )
+
+    if admin:
+        not_yet_approved: list[str] = [id for id, _ in store.awaiting_approval()]
 
         blocks += display_header("Projects awaiting approval")
 
         if len(not_yet_approved) > 0:
             for project in not_yet_approved:
-                blocks += display_project(project)
-                blocks += display_approve(project)
-                blocks += display_spacer()
+                blocks += cached_fragment(
+                    project,
+                    "approval",
+                    lambda: display_project(project)
+                    + display_approve(project)
+                    + display_spacer(),
+                )
 
         else:
             blocks += display_help("no_projects_in_queue", raw=False)  # type: ignore # When raw is False the return is always a list
     else:
-        not_yet_approved: list[str] = []
-        for project in projects:
-            if (
-                not projects[project].get("approved", False)
-                and projects[project]["created by"] == user
-            ):
-                not_yet_approved.append(project)
+        not_yet_approved: list[str] = [
+            id for id, _ in store.awaiting_approval(created_by=user)
+        ]
 
         if len(not_yet_approved) > 0:
             blocks += display_header("Your projects awaiting approval")
@@ -1016,42 +1165,13 @@ def display_home_projects(user: str, client: WebClient) -> list[dict[str, Any]]:
                 }
             ]
             for project in not_yet_approved:
-                blocks += display_project(project)
-                blocks += [
-                    {
-                        "type": "actions",
-                        "elements": [
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Edit project",
-                                    "emoji": True,
-                                },
-                                "value": project,
-                                "action_id": "edit_specific_project",
-                            },
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Request approval",
-                                    "emoji": True,
-                                },
-                                "value": project,
-                                "style": "primary",
-                                "confirm": display_confirm(
-                                    title="Request Approval",
-                                    text=str(display_help("approval", raw=True)),
-                                    confirm="Request approval",
-                                    abort="Cancel",
-                                ),
-                                "action_id": "request_project_approval",
-                            },
-                        ],
-                    }
-                ]
-                blocks += display_spacer()
+                blocks += cached_fragment(
+                    project,
+                    "personal_unapproved",
+                    lambda: display_project(project)
+                    + display_personal_actions(project)
+                    + display_spacer(),
+                )
     return blocks  # type: ignore # Every instance of display_help used in this function returns a list
 
 
@@ -1092,158 +1212,366 @@ We also suggest actively talking about your project in the most relevant channel
     return [{"type": "section", "text": {"type": "mrkdwn", "text": articles[article]}}]
 
 
-######################
-# Listener functions #
-######################
+#####################
+# Message functions #
+#####################
 
-# Initialise slack
+# Keyword arguments for the messages and modals sent by listeners, shared by the sync and async apps
 
-app = App(token=config["SLACK_BOT_TOKEN"])
 
-### Actions ###
+def created_notice(data: dict[str, Any], user: str | bool) -> dict[str, Any]:
+    return {
+        "channel": config["admin_channel"],
+        "text": f'"{data["title"]}" has been created by <@{user}>. It will need to be approved before it will show up on the full list of projects or to be marked as DGR eligible. This can be completed by any member of <!subteam^{config["admin_group"]}> by clicking on my name or waiting for the creator to request approval themselves.',
+    }
 
 
-def update_home(user: str, client: WebClient) -> None:
-    home_view = {  # type: ignore # When raw is False the return is always a list
-        "type": "home",
-        "blocks": display_home_projects(client=client, user=user) + display_header("How to create a project") + display_help("create_CTA", raw=False) + display_create(),  # type: ignore # When raw is False the return is always a list
+def updated_notice(data: dict[str, Any], user: str | bool) -> dict[str, Any]:
+    return {
+        "channel": config["admin_channel"],
+        "text": f'"{data["title"]}" has been updated by <@{user}>.',
     }
 
-    client.views_publish(user_id=user, view=home_view)  # type: ignore
+
+# Thread replies to updated_notice, thread_ts is added by the caller
+def updated_details(old: dict[str, Any], data: dict[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {
+            "channel": config["admin_channel"],
+            "text": f"Old:\n```{json.dumps(old, indent=4, sort_keys=True)}```",
+        },
+        {
+            "channel": config["admin_channel"],
+            "text": f"New:\n```{json.dumps(data, indent=4, sort_keys=True)}```",
+        },
+    ]
 
 
-@app.view("update_data")  # type: ignore
-def update_data(ack, body: dict[str, Any], client: WebClient):  # type: ignore
-    data = body["view"]["state"]["values"]
-    if "private_metadata" in body["view"].keys():
-        project_id = body["view"]["private_metadata"]
-    else:
-        project_id = body["view"]["state"]["values"]["projectDropdown"][
-            "project_selector"
-        ]["selected_option"][
-            "value"
-        ]  # Gotta be an easier way
+def creator_update_notice(data: dict[str, Any], user: str | bool) -> dict[str, Any]:
+    return {
+        "text": f'A project you created ({data["title"]}) has been updated by <@{user}>.'
+    }
 
-    user = body["user"]["id"]
-    # Validation
-    errors = {}
 
-    total_shuffled = False
+def pledge_thanks(project: dict[str, Any], amount: int) -> dict[str, Any]:
+    return {
+        "text": f'We\'ve updated your *total* pledge for "{project["title"]}" to ${amount}. Thank you for your support!\n\nOnce the project is fully funded I\'ll be in touch to arrange payment.'
+    }
 
-    # Find our slack_id_shuffle'd field
-    for field in data:
-        if slack_id_shuffle(field, r=True) == "total":
-            total_shuffled = field
 
-    if not total_shuffled:
-        # This should never happen
-        pass
+def funded_notice(id: str, project: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "channel": config["admin_channel"],
+        "text": f'"{project["title"]}" has met its funding goal!',
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f'"{project["title"]}" has met its funding goal!',
+                },
+                "accessory": {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Send invoices",
+                        "emoji": True,
+                    },
+                    "value": id,
+                    "action_id": "sendInvoices",
+                },
+            }
+        ],
+    }
 
-    # Is cost a number
 
-    total = data[total_shuffled]["plain_text_input-action"]["value"].replace("$", "")
-    if check_bad_currency(total):
-        errors[total_shuffled] = check_bad_currency(total)
-        ack({"response_action": "errors", "errors": errors})
-        return False
+def approved_notice(project_id: str, project: dict[str, Any], dgr: bool) -> dict[str, Any]:
+    if dgr:
+        text = f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice. Additionally, we have marked this project as qualifying for <{config["tax_info"]}|tax deductible donations>.'
+        block_text = f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice.\nAdditionally, we have marked this project as qualifying for <{config["tax_info"]}|tax deductible donations>.'
     else:
-        total = int(total)
-        ack()
+        text = block_text = f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice.'
+    return {
+        "text": text,
+        "blocks": [
+            {
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": block_text},
+                "accessory": {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Promote",
+                        "emoji": True,
+                    },
+                    "value": project_id,
+                    "action_id": "promote_specific_project_entry",
+                },
+            }
+        ],
+    }
 
-    # Get existing project info
-    project = get_project(project_id)
 
-    for v in data:
-        # Slack preserves field input when updating a view based on IDs. Because this cannot be disabled we add junk data to each ID to confuse slack.
-        v_clean = slack_id_shuffle(v, r=True)
-        if v_clean == "total":
-            project[v_clean] = total
+# Where the approval came from decides how admins are told: a new message for modals, or an edit of the approval request
+def approval_admin_notice(
+    body: dict[str, Any], project: dict[str, Any], user: str, dgr: bool
+) -> tuple[str, dict[str, Any]] | None:
+    # Coming from a modal, typically home
+    if body["container"]["type"] == "view":
+        if dgr:
+            text = f'"{project["title"]}" has been marked as tax deductible and approved by <@{user}>.'
         else:
-            if "plain_text_input-action" in data[v].keys():
-                project[v_clean] = data[v]["plain_text_input-action"]["value"]
-    write_project(project_id, project, user)
-    update_home(user=user, client=client)
-
-
-@app.view("promote_project")  # type: ignore
-def promote_project(ack, body: dict[str, Any]):  # type: ignore
-    ack()
-    project_id = body["view"]["private_metadata"]
+            text = f'"{project["title"]}" has been approved by <@{user}>.'
+        return "chat_postMessage", {"channel": config["admin_channel"], "text": text}
 
-    # Channel id we need is double nested inside two dicts with random keys.
+    # Coming from a message, which means we can just update that message
+    elif body["container"]["type"] == "message":
+        if dgr:
+            context = f"<@{user}> marked this as tax deductible and approved"
+        else:
+            context = f"<@{user}> approved this project"
+        # Take out the approval buttons
+        blocks: list[dict[str, Any]] = body["message"]["blocks"][:-1]
+        blocks += [
+            {
+                "type": "context",
+                "elements": [{"type": "mrkdwn", "text": context}],
+            }
+        ]
+        return "chat_update", {
+            "channel": body["container"]["channel_id"],
+            "ts": body["container"]["message_ts"],
+            "blocks": blocks,
+            "text": f"Project approved by <@{user}>",
+            "as_user": True,
+        }
+    return None
+
+
+def approval_request(project_id: str, project: dict[str, Any], user: str) -> dict[str, Any]:
+    # Send prompt to admins
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f'"{project["title"]}" has been submitted for approval by <@{user}>. Please review the project.',
+            },
+        }
+    ]
+    blocks += display_project(project_id)
+    blocks += display_approve(project_id)
+    return {
+        "channel": config["admin_channel"],
+        "text": f'<@{user}> has requested approval for "{project["title"]}".',
+        "blocks": blocks,
+    }
+
+
+def promotion_messages(project_id: str, channel: str, user: str) -> list[dict[str, Any]]:
+    title = peek_project(project_id)["title"]
+    # Add promoting as a separate message so it can be removed by a Slack admin if desired. (ie when promoted as part of a larger post)
+    return [
+        {
+            "channel": channel,
+            "text": f"<@{user}> has promoted a project, check it out!",
+        },
+        {
+            "channel": channel,
+            "blocks": promotion_blocks(project_id),
+            "text": f"Check out our fundraiser for: {title}",
+        },
+    ]
+
+
+def edit_modal(
+    project_id: str, title: str = "Update Project", submit: str = "Update!"
+) -> dict[str, Any]:
+    return {
+        "type": "modal",
+        # View identifier
+        "callback_id": "update_data",
+        "title": {"type": "plain_text", "text": title},
+        "submit": {"type": "plain_text", "text": submit},
+        "blocks": construct_edit(project_id=project_id),
+        "private_metadata": project_id,
+    }
+
+
+def promote_modal(project_id: str | None = None) -> dict[str, Any]:
+    view = {
+        "type": "modal",
+        # View identifier
+        "callback_id": "promote_project",
+        "title": {"type": "plain_text", "text": "Promote a pledge"},
+        "submit": {"type": "plain_text", "text": "Promote!"},
+        "blocks": display_promote(),
+    }
+    if project_id:
+        view["private_metadata"] = project_id
+    return view
+
+
+def promote_preview_modal() -> dict[str, Any]:
+    # callback promote_project
+    return {
+        "title": {"type": "plain_text", "text": "Promote project", "emoji": True},
+        "submit": {"type": "plain_text", "text": "Promote!", "emoji": True},
+        "type": "modal",
+        "blocks": display_promote(),
+    }
+
+
+def select_project_modal() -> dict[str, Any]:
+    return {
+        "type": "modal",
+        "callback_id": "loadProject",
+        "title": {"type": "plain_text", "text": "Select Project"},
+        "submit": {"type": "plain_text", "text": "Update!"},
+        "blocks": display_edit_load(project_id=False),
+    }
+
+
+def details_modal(project_id: str) -> dict[str, Any]:
+    return {
+        "type": "modal",
+        "title": {"type": "plain_text", "text": "Project Details"},
+        "blocks": display_project_details(project_id=project_id),
+    }
+
+
+def new_project_id() -> str:
+    # pick a new id
+    project_id: str = "".join(
+        random.choices(string.ascii_letters + string.digits, k=16)
+    )
+    while project_id in load_projects().keys():
+        project_id = "".join(random.choices(string.ascii_letters + string.digits, k=16))
+    return project_id
+
+
+def home_view(user: str, client: WebClient) -> dict[str, Any]:
+    return {  # type: ignore # When raw is False the return is always a list
+        "type": "home",
+        "blocks": display_home_projects(client=client, user=user) + display_header("How to create a project") + display_help("create_CTA", raw=False) + display_create(),  # type: ignore # When raw is False the return is always a list
+    }
+
+
+######################
+# Listener functions #
+######################
+
+# Initialise slack
+
+# All outbound calls share per method rate limits, listeners should use app.client rather than the client Bolt passes in
+# The token is checked when Socket Mode connects, so skip the separate auth call at startup
+# slack_base_url can point the bot at a local stand-in such as benchmarks.slack_standin
+app = App(
+    token=config["SLACK_BOT_TOKEN"],
+    client=utils.slack_client.RateLimitedWebClient(
+        token=config["SLACK_BOT_TOKEN"],
+        base_url=config.get("slack_base_url", WebClient.BASE_URL),
+    ),
+    token_verification_enabled=False,
+)
+
+# Used for work that isn't a direct response to the user, so it queues behind interactive calls
+background_client = app.client.with_priority(utils.slack_client.BACKGROUND)
+
+# Anonymised copies of incoming requests for benchmarks.replay, only when record_requests is set
+recorder: utils.recorder.RequestRecorder | None = None
+if config.get("record_requests"):
+    recorder = utils.recorder.RequestRecorder(config["record_requests"], salt=config.get("record_salt", ""))
+    app.use(recorder.middleware)
+
+### Actions ###
+
+
+def update_home(user: str, client: WebClient) -> None:
+    client.views_publish(user_id=user, view=home_view(user=user, client=client))  # type: ignore
+
+
+# App Home refreshes triggered by other users' actions. A user's own pledge asks for an
+# urgent refresh, which is published at interactive priority since they're waiting on it
+home_refresh = utils.debounce.CoalescingQueue(
+    lambda user: update_home(user=str(user), client=background_client),
+    urgent_handler=lambda user: update_home(user=str(user), client=app.client),
+    window=config.get("home_refresh_window", 2),
+    workers=config.get("home_refresh_workers", 4),
+    name="home-refresh",
+)
+
+
+# Promoted messages are refreshed in the background with the latest state of the project
+promotion_refresh = utils.promotions.PromotionRefresher(
+    client=background_client,
+    render=promotion_blocks,
+    promotions=lambda id: peek_project(id).get("promotions", []),
+    window=config.get("promotion_refresh_window", 1),
+    workers=config.get("promotion_refresh_workers", 8),
+)
+
+
+@app.view("update_data")  # type: ignore
+@utils.instrument.listener
+def update_data(ack, body: dict[str, Any], client: WebClient):  # type: ignore
+    errors = validate_update(body)
+    if errors:
+        ack({"response_action": "errors", "errors": errors})
+        return False
+    ack()
+
+    user = body["user"]["id"]
+    project_id, project, old = apply_update(body)
+    announce_write(project, old, user)
+    update_home(user=user, client=app.client)
+
+
+@app.view("promote_project")  # type: ignore
+@utils.instrument.listener
+def promote_project(ack, body: dict[str, Any]):  # type: ignore
+    ack()
+    project_id = body["view"]["private_metadata"]
+
+    # Channel id we need is double nested inside two dicts with random keys.
     values = body["view"]["state"]["values"]
     i: str = next(iter(values))
     i2: str = next(iter(values[i]))
     channel: str = values[i][i2]["selected_conversation"]
 
-    title = get_project(project_id)["title"]
-
-    # Add promoting as a separate message so it can be removed by a Slack admin if desired. (ie when promoted as part of a larger post)
-    app.client.chat_postMessage(  # type: ignore
-        channel=channel,
-        text=f'<@{body["user"]["id"]}> has promoted a project, check it out!',
-    )
-    promo_msg = app.client.chat_postMessage(  # type: ignore
-        channel=channel,
-        blocks=display_project(project_id)
-        + display_spacer()
-        + display_donate(project_id),
-        text=f"Check out our fundraiser for: {title}",
-    )
+    notice, promotion = promotion_messages(project_id, channel, body["user"]["id"])
+    app.client.chat_postMessage(**notice)  # type: ignore
+    promo_msg = app.client.chat_postMessage(**promotion)  # type: ignore
 
     # Log this promotion message
     log_promotion(project_id=project_id, slack_response=promo_msg)
 
 
 @app.action("project_selector")  # type: ignore
+@utils.instrument.listener
 def project_selected(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id = body["view"]["state"]["values"]["projectDropdown"]["project_selector"][
         "selected_option"
     ]["value"]
     view_id = body["container"]["view_id"]
-    client.views_update(  # type: ignore
-        view_id=view_id,
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "update_data",
-            "title": {
-                "type": "plain_text",
-                "text": "Update Project",
-            },  # project["title"]
-            "submit": {"type": "plain_text", "text": "Update!"},
-            "blocks": construct_edit(project_id=project_id),
-            "private_metadata": project_id,
-        },
-    )
+    app.client.views_update(view_id=view_id, view=edit_modal(project_id))  # type: ignore
 
 
 @app.action("edit_specific_project")  # type: ignore
+@utils.instrument.listener
 def edit_specific_project(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
 
     project_id = body["actions"][0]["value"]
-    client.views_open(  # type: ignore
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "update_data",
-            "title": {
-                "type": "plain_text",
-                "text": "Update Project",
-            },
-            "submit": {"type": "plain_text", "text": "Update!"},
-            "blocks": construct_edit(project_id=project_id),
-            "private_metadata": project_id,
-        },
-    )
+    app.client.views_open(trigger_id=body["trigger_id"], view=edit_modal(project_id))  # type: ignore
 
 
 # Donate buttons with inline update
 
 
 @app.action("donate10")  # type: ignore
+@utils.instrument.listener
 def donate10(ack, body: dict[str, Any]) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1252,6 +1580,7 @@ def donate10(ack, body: dict[str, Any]) -> None:  # type: ignore
 
 
 @app.action("donate20")  # type: ignore
+@utils.instrument.listener
 def donate20(ack, body: dict[str, Any]) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1260,6 +1589,7 @@ def donate20(ack, body: dict[str, Any]) -> None:  # type: ignore
 
 
 @app.action("donate_rest")  # type: ignore
+@utils.instrument.listener
 def donate_rest(ack, body: dict[str, Any]) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1268,6 +1598,7 @@ def donate_rest(ack, body: dict[str, Any]) -> None:  # type: ignore
 
 
 @app.action("donate_amount")  # type: ignore
+@utils.instrument.listener
 def donate_amount(ack, body: dict[str, Any], respond) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1287,6 +1618,7 @@ def donate_amount(ack, body: dict[str, Any], respond) -> None:  # type: ignore
 
 
 @app.action("donate10_home")  # type: ignore
+@utils.instrument.listener
 def donate10_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1295,6 +1627,7 @@ def donate10_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type
 
 
 @app.action("donate20_home")  # type: ignore
+@utils.instrument.listener
 def donate20_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1303,6 +1636,7 @@ def donate20_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type
 
 
 @app.action("donate_rest_home")  # type: ignore
+@utils.instrument.listener
 def donate_rest_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1311,6 +1645,7 @@ def donate_rest_home(ack, body: dict[str, Any], client: WebClient) -> None:  # t
 
 
 @app.action("donate_amount_home")  # type: ignore
+@utils.instrument.listener
 def donate_amount_home(ack, body: dict[str, Any], client: WebClient, say) -> None:  # type: ignore
     ack()
     user: str = body["user"]["id"]
@@ -1323,256 +1658,88 @@ def donate_amount_home(ack, body: dict[str, Any], client: WebClient, say) -> Non
 
 
 @app.action("conversation_selector")  # type: ignore
+@utils.instrument.listener
 def conversation_selector(ack) -> None:  # type: ignore
     ack()
     # we actually don't want to do anything yet
 
 
 @app.action("project_preview_selector")  # type: ignore
+@utils.instrument.listener
 def project_preview_selector(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     view_id: str = body["container"]["view_id"]
-
-    view = {
-        "title": {"type": "plain_text", "text": "Promote project", "emoji": True},
-        "submit": {"type": "plain_text", "text": "Promote!", "emoji": True},
-        "type": "modal",
-        "blocks": display_promote(),
-    }
-    # callback promote_project
-    client.views_update(  # type: ignore
-        view_id=view_id,
-        view=view,
-    )
+    app.client.views_update(view_id=view_id, view=promote_preview_modal())  # type: ignore
 
 
 @app.action("promote_specific_project_entry")  # type: ignore
+@utils.instrument.listener
 def promote_specific_project_entry(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id: str = body["actions"][0]["value"]
-    client.views_open(  # type: ignore
-        trigger_id=body["trigger_id"],
-        # View payload
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "promote_project",
-            "title": {"type": "plain_text", "text": "Promote a pledge"},
-            "submit": {"type": "plain_text", "text": "Promote!"},
-            "blocks": display_promote(),
-            "private_metadata": project_id,
-        },
-    )
+    app.client.views_open(trigger_id=body["trigger_id"], view=promote_modal(project_id))  # type: ignore
 
 
 @app.action("promote_from_home")  # type: ignore
+@utils.instrument.listener
 def promote_from_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
-    client.views_open(  # type: ignore
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "promote_project",
-            "title": {"type": "plain_text", "text": "Promote a pledge"},
-            "submit": {"type": "plain_text", "text": "Promote!"},
-            "blocks": display_promote(),
-        },
-    )
+    app.client.views_open(trigger_id=body["trigger_id"], view=promote_modal())  # type: ignore
 
 
 @app.action("update_from_home")  # type: ignore
+@utils.instrument.listener
 def update_from_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
-    client.views_open(  # type: ignore
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "loadProject",
-            "title": {"type": "plain_text", "text": "Select Project"},
-            "submit": {"type": "plain_text", "text": "Update!"},
-            "blocks": display_edit_load(project_id=False),
-        },
-    )
+    app.client.views_open(trigger_id=body["trigger_id"], view=select_project_modal())  # type: ignore
 
 
 @app.action("create_from_home")  # type: ignore
+@utils.instrument.listener
 def create_from_home(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
-    # pick a new id
-    project_id: str = "".join(
-        random.choices(string.ascii_letters + string.digits, k=16)
-    )
-    while project_id in load_projects().keys():
-        project_id = "".join(random.choices(string.ascii_letters + string.digits, k=16))
-    client.views_open(  # type: ignore
+    app.client.views_open(  # type: ignore
         trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "update_data",
-            "title": {"type": "plain_text", "text": "Create a pledge"},
-            "submit": {"type": "plain_text", "text": "Create!"},
-            "private_metadata": project_id,
-            "blocks": construct_edit(project_id=project_id),
-        },
+        view=edit_modal(new_project_id(), title="Create a pledge", submit="Create!"),
     )
 
 
-@app.action("approve")  # type: ignore
-def approve(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
-    ack()
+def approve_project(body: dict[str, Any], dgr: bool) -> None:
     project_id: str = body["actions"][0]["value"]
     user: str = body["user"]["id"]
-    project: dict[str, Any] = get_project(project_id)
-
-    # Projects approved in this function should be marked as DGR ineligible
-    project["dgr"] = False
-
-    project["approved"] = True
-    project["approved_at"] = int(time.time())
-    write_project(project_id, project, user=False)
-
-    # Open a slack conversation with the creator and get the channel ID
-    r = app.client.conversations_open(users=project["created by"])  # type: ignore
-    channel_id: str = str(r["channel"]["id"])  # type: ignore
+    project = mark_approved(project_id, dgr)
 
     # Notify the creator
-    app.client.chat_postMessage(  # type: ignore
-        channel=channel_id,
-        text=f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice.',
-        blocks=[
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice.',
-                },
-                "accessory": {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Promote",
-                        "emoji": True,
-                    },
-                    "value": id,
-                    "action_id": "promote_specific_project_entry",
-                },
-            }
-        ],
+    utils.dm_cache.send_dm(  # type: ignore
+        app.client, project["created by"], **approved_notice(project_id, project, dgr)
     )
 
     # Check container type
+    notice = approval_admin_notice(body, project, user, dgr)
+    if notice:
+        method, kwargs = notice
+        getattr(app.client, method)(**kwargs)
 
-    # Coming from a modal, typically home
-    if body["container"]["type"] == "view":
-        # Send a notification to the admin channel
-        app.client.chat_postMessage(  # type: ignore
-            channel=config["admin_channel"],
-            text=f'"{project["title"]}" has been approved by <@{user}>.',
-        )
-
-    # Coming from a message, which means we can just update that message
-    elif body["container"]["type"] == "message":
-        # Take out the approval buttons
-        blocks: list[dict[str, Any]] = body["message"]["blocks"][:-1]
-        blocks += [
-            {
-                "type": "context",
-                "elements": [
-                    {"type": "mrkdwn", "text": f"<@{user}> approved this project"}
-                ],
-            }
-        ]
+    update_home(user=user, client=app.client)
 
-        app.client.chat_update(  # type: ignore
-            channel=body["container"]["channel_id"],
-            ts=body["container"]["message_ts"],
-            blocks=blocks,
-            text=f"Project approved by <@{user}>",
-            as_user=True,
-        )
 
-    update_home(user=user, client=client)
+@app.action("approve")  # type: ignore
+@utils.instrument.listener
+def approve(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
+    ack()
+    # Projects approved in this function should be marked as DGR ineligible
+    approve_project(body, dgr=False)
 
 
 @app.action("approve_as_dgr")  # type: ignore
+@utils.instrument.listener
 def approve_as_dgr(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
-    project_id: str = body["actions"][0]["value"]
-    user: str = body["user"]["id"]
-    project: dict[str, Any] = get_project(project_id)
-    project["approved"] = True
-    project["approved_at"] = int(time.time())
-    project["dgr"] = True
-    write_project(project_id, project, user=False)
-
-    # Open a slack conversation with the creator and get the channel ID
-    r = app.client.conversations_open(users=project["created by"])  # type: ignore
-    channel_id: str = str(r["channel"]["id"])  # type: ignore
-
-    # Notify the creator
-    app.client.chat_postMessage(  # type: ignore
-        channel=channel_id,
-        text=f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice. Additionally, we have marked this project as qualifying for <{config["tax_info"]}|tax deductible donations>.',
-        blocks=[
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f'Your project "{project["title"]}" has been approved! You can now promote it to a channel of your choice.\nAdditionally, we have marked this project as qualifying for <{config["tax_info"]}|tax deductible donations>.',
-                },
-                "accessory": {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Promote",
-                        "emoji": True,
-                    },
-                    "value": id,
-                    "action_id": "promote_specific_project_entry",
-                },
-            }
-        ],
-    )
-
-    # Check container type
-
-    # Coming from a modal, typically home
-    if body["container"]["type"] == "view":
-        # Send a notification to the admin channel
-        app.client.chat_postMessage(  # type: ignore
-            channel=config["admin_channel"],
-            text=f'"{project["title"]}" has been marked as tax deductible and approved by <@{user}>.',
-        )
-
-    # Coming from a message, which means we can just update that message
-    elif body["container"]["type"] == "message":
-        # Take out the approval buttons
-        blocks: list[dict[str, Any]] = body["message"]["blocks"][:-1]
-        blocks += [
-            {
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"<@{user}> marked this as tax deductible and approved",
-                    }
-                ],
-            }
-        ]
-
-        app.client.chat_update(  # type: ignore
-            channel=body["container"]["channel_id"],
-            ts=body["container"]["message_ts"],
-            blocks=blocks,
-            text=f"Project approved by <@{user}>",
-            as_user=True,
-        )
-
-    update_home(user=user, client=client)
+    approve_project(body, dgr=True)
 
 
 @app.action("unapprove")  # type: ignore
+@utils.instrument.listener
 def unapprove(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id: str = body["actions"][0]["value"]
@@ -1580,10 +1747,11 @@ def unapprove(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ig
 
     unapprove_project(project_id)
 
-    update_home(user=user, client=client)
+    update_home(user=user, client=app.client)
 
 
 @app.action("delete")  # type: ignore
+@utils.instrument.listener
 def delete(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id: str = body["actions"][0]["value"]
@@ -1591,29 +1759,22 @@ def delete(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignor
 
     delete_project(project_id)
 
-    update_home(user=user, client=client)
+    update_home(user=user, client=app.client)
 
 
 @app.action("project_details")  # type: ignore
+@utils.instrument.listener
 def project_details(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id = body["actions"][0]["value"]
-    client.views_open(  # type: ignore
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "title": {"type": "plain_text", "text": "Project Details"},
-            "blocks": display_project_details(project_id=project_id),
-        },
-    )
+    app.client.views_open(trigger_id=body["trigger_id"], view=details_modal(project_id))  # type: ignore
 
 
-@app.action("sendInvoices")  # type: ignore
-def invoice(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
-    ack()
+# Runs the whole invoicing process for a sendInvoices button press, this can take a while
+def invoice_project(body: dict[str, Any]) -> None:
     project_id: str = body["actions"][0]["value"]
     user: str = body["user"]["id"]
-    project: dict[str, Any] = get_project(project_id)
+    project: dict[str, Any] = peek_project(project_id)
 
     # Get reply method
     # Coming from a modal, typically home
@@ -1682,82 +1843,105 @@ def invoice(ack, body: dict[str, Any], client: WebClient) -> None:  # type: igno
                 as_user=True,
             )
 
-    else:
-        raise Exception("Unknown container type")
-
     # Add invoicing details as reply to the notification
     app.client.chat_postMessage(  # type: ignore
         channel=config["admin_channel"], thread_ts=reply, text=outcome  # type: ignore
     )
 
 
+@app.action("sendInvoices")  # type: ignore
+@utils.instrument.listener
+def invoice(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
+    ack()
+    invoice_project(body)
+
+
 @app.action("request_project_approval")  # type: ignore
+@utils.instrument.listener
 def request_project_approval(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
     ack()
     project_id: str = body["actions"][0]["value"]
     user: str = body["user"]["id"]
-    project: dict[str, Any] = get_project(project_id)
+    project: dict[str, Any] = peek_project(project_id)
 
     # Send prompt to admins
-    blocks = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f'"{project["title"]}" has been submitted for approval by <@{user}>. Please review the project.',
-            },
-        }
-    ]
-    blocks += display_project(project_id)
-    blocks += display_approve(project_id)
-
-    app.client.chat_postMessage(  # type: ignore
-        channel=config["admin_channel"],
-        text=f'<@{user}> has requested approval for "{project["title"]}".',
-        blocks=blocks,
-    )
-
-    # Open a slack conversation with the creator and get the channel ID
-    r: SlackResponse = app.client.conversations_open(users=project["created by"])  # type: ignore
-    channel_id: str = str(r["channel"]["id"])  # type: ignore
+    app.client.chat_postMessage(**approval_request(project_id, project, user))  # type: ignore
 
     # Notify the creator
-    app.client.chat_postMessage(  # type: ignore
-        channel=channel_id,
+    utils.dm_cache.send_dm(  # type: ignore
+        app.client,
+        project["created by"],
         text=f'Your project "{project["title"]}" has been submitted for approval.',
     )
 
-    update_home(user=user, client=client)
+    update_home(user=user, client=app.client)
 
 
 ### info ###
 
 
 @app.options("project_selector")  # type: ignore
+@utils.instrument.listener
 def project_selector(ack, body: dict[str, Any], client: WebClient) -> None:  # type: ignore
-    if auth(user=body["user"]["id"], client=client):
+    if auth(user=body["user"]["id"], client=app.client):
         ack(options=project_options())
     else:
         ack(options=project_options(restricted=body["user"]["id"], approved=False))
 
 
 @app.options("project_preview_selector")  # type: ignore
+@utils.instrument.listener
 def project_preview_selector_opt(ack) -> None:  # type: ignore
     ack(options=project_options(approved=True))
 
 
 # Update the app home
 @app.event("app_home_opened")  # type: ignore
+@utils.instrument.listener
 def app_home_opened(event: dict[str, Any], client: WebClient) -> None:
-    update_home(user=event["user"], client=client)
+    update_home(user=event["user"], client=app.client)
+
+
+# Keep the cached admin group membership current
+@app.event("subteam_members_changed")  # type: ignore
+@utils.instrument.listener
+def subteam_members_changed(event: dict[str, Any]) -> None:
+    admins.members_changed(event)
+
+
+@app.event("subteam_updated")  # type: ignore
+@utils.instrument.listener
+def subteam_updated(event: dict[str, Any]) -> None:
+    admins.group_updated(event)
+
+
+# Reconciliation shares the bot's store and contact directory, so it can't race the bot's own writes
+reconciler = utils.reconcile.Reconciler(
+    config, store, background_client, utils.project_output.contact_directory()
+)
+
+
+# Keep the TidyHQ contact mapping used for invoicing up to date and reconcile funded projects
+def start_background_jobs() -> None:
+    utils.project_output.contact_directory().start(
+        utils.tidyhq.client(config),
+        background_client,
+        interval=config.get("contact_sync_interval", 3600),
+    )
+    reconciler.start(interval=config.get("reconcile_interval", 86400))
+
 
+# Record the state that requests recorded from now on will be replayed against
+def start_recording() -> None:
+    if recorder is None:
+        return
+    admins.refresh(app.client)
+    recorder.snapshot(store.load(), admins.members)
+    print(f'Recording requests to {config["record_requests"]}')
 
-# Get TidyHQ org details
-tidyhq_org: dict[str, Any] = requests.get(
-    "https://api.tidyhq.com/v1/organization",
-    params={"access_token": config["tidyhq_token"]},
-).json()
 
 # Start listening for commands
 if __name__ == "__main__":
+    start_background_jobs()
+    start_recording()
     SocketModeHandler(app, config["SLACK_APP_TOKEN"]).start()
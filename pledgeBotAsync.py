@@ -0,0 +1,486 @@
+#!/usr/bin/python3
+
+# Runs pledgeBot on slack_bolt's AsyncApp and the async Socket Mode handler.
+# Processing and display functions are shared with pledgeBot.py. Store access and
+# rendering run in a small pool of worker threads while Slack calls are awaited,
+# so a single process can handle many interactions at once.
+#
+# Start with python pledgeBotAsync.py instead of python pledgeBot.py, requires aiohttp.
+
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Hashable
+
+import pledgeBot as bot
+import utils.dm_cache
+import utils.instrument
+import utils.slack_client
+from utils.async_slack_client import AsyncRateLimitedWebClient
+from utils.debounce import AsyncCoalescer
+
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncApp
+
+config = bot.config
+
+# Initialise slack
+
+# As with the sync app, listeners should use app.client so all calls share the same rate limits
+app = AsyncApp(
+    token=config["SLACK_BOT_TOKEN"],
+    client=AsyncRateLimitedWebClient(
+        token=config["SLACK_BOT_TOKEN"],
+        base_url=config.get("slack_base_url", AsyncRateLimitedWebClient.BASE_URL),
+    ),
+)
+
+# Used for work that isn't a direct response to the user, so it queues behind interactive calls
+background_client = app.client.with_priority(utils.slack_client.BACKGROUND)  # type: ignore
+
+# Requests are recorded with the sync app's recorder when record_requests is set
+if bot.recorder is not None:
+    app.use(bot.recorder.middleware_async)
+
+
+async def update_home(user: str, client: AsyncRateLimitedWebClient = app.client) -> None:  # type: ignore
+    # Make sure the admin check during rendering won't need to call Slack from the worker thread
+    await bot.admins.is_member_async(user=user, client=client)
+    view = await asyncio.to_thread(bot.home_view, user, bot.app.client)
+    await client.views_publish(user_id=user, view=view)  # type: ignore
+
+
+async def refresh_promotions(project_id: Hashable) -> None:
+    project_id = str(project_id)
+    project = await asyncio.to_thread(bot.peek_project, project_id)
+    promotions: list[dict[str, str]] = project.get("promotions", [])
+    if not promotions:
+        return
+    blocks = await asyncio.to_thread(bot.promotion_blocks, project_id)
+    results = await asyncio.gather(
+        *[
+            background_client.chat_update(  # type: ignore
+                channel=promotion["channel"],
+                ts=promotion["ts"],
+                blocks=blocks,
+                text="A project was donated to",
+            )
+            for promotion in promotions
+        ],
+        return_exceptions=True,
+    )
+    # One deleted or archived message shouldn't stop the others being updated
+    for result in results:
+        if isinstance(result, Exception):
+            traceback.print_exception(type(result), result, result.__traceback__)
+
+
+# App Home refreshes triggered by other users' actions, urgent ones are the acting user's own
+home_refresh = AsyncCoalescer(
+    lambda user: update_home(user=str(user), client=background_client),
+    urgent_handler=lambda user: update_home(user=str(user), client=app.client),
+    window=config.get("home_refresh_window", 2),
+)
+
+# Promoted messages are refreshed in the background with the latest state of the project
+promotion_refresh = AsyncCoalescer(
+    refresh_promotions, window=config.get("promotion_refresh_window", 1)
+)
+
+
+async def announce_write(
+    data: dict[str, Any], old: dict[str, Any] | None, user: str | bool
+) -> None:
+    if old is None:
+        # Notify the admin channel
+        await app.client.chat_postMessage(**bot.created_notice(data, user))  # type: ignore
+
+    elif user:
+        # Send a notice to the admin channel and add further details as a thread
+        reply = await app.client.chat_postMessage(**bot.updated_notice(data, user))  # type: ignore
+
+        async def details() -> None:
+            # Replies are posted in order so Old stays above New
+            for reply_details in bot.updated_details(old, data):
+                await app.client.chat_postMessage(thread_ts=reply["ts"], **reply_details)  # type: ignore
+
+        notices = [details()]
+
+        # Send a notice to the project creator if they're not the one updating it
+        if data["created by"] != user:
+            notices.append(
+                utils.dm_cache.send_dm_async(  # type: ignore
+                    app.client, data["created by"], **bot.creator_update_notice(data, user)
+                )
+            )
+        await asyncio.gather(*notices)
+
+
+async def pledge(
+    id: str, amount: int | str, user: str, percentage: bool = False
+) -> None:
+    project, amount, funded = await asyncio.to_thread(
+        bot.record_pledge, id, amount, user, percentage
+    )
+
+    # Notify/thank the donor
+    notices = [
+        utils.dm_cache.send_dm_async(app.client, user, **bot.pledge_thanks(project, amount))
+    ]
+
+    # Check if the project has met its goal
+    if funded:
+        # Notify the admin channel
+        notices.append(app.client.chat_postMessage(**bot.funded_notice(id, project)))  # type: ignore
+
+    # Update all promotions in the background
+    promotion_refresh.request(id)
+
+    # Update app home of donor first so they see the updated pledge faster
+    home_refresh.request(user, urgent=True)
+
+    # Update app homes of all donors. Refreshes are merged so a burst of pledges only re-renders each home once
+    for donor in project.get("pledges", {}):
+        if donor != user:
+            home_refresh.request(donor)
+
+    # The pledge is saved, so notices still rate limited after retries are dropped rather than failing the handler
+    for result in await asyncio.gather(*notices, return_exceptions=True):
+        if isinstance(result, BaseException):
+            if not utils.slack_client.rate_limited(result):  # type: ignore
+                raise result
+            print(f"Still rate limited after retries, dropped a pledge notice: {result}")
+
+
+async def approve_project(body: dict[str, Any], dgr: bool) -> None:
+    project_id: str = body["actions"][0]["value"]
+    user: str = body["user"]["id"]
+    project = await asyncio.to_thread(bot.mark_approved, project_id, dgr)
+
+    # Notify the creator
+    calls = [
+        utils.dm_cache.send_dm_async(  # type: ignore
+            app.client, project["created by"], **bot.approved_notice(project_id, project, dgr)
+        ),
+        update_home(user=user),
+    ]
+
+    # Check container type
+    notice = bot.approval_admin_notice(body, project, user, dgr)
+    if notice:
+        method, kwargs = notice
+        calls.append(getattr(app.client, method)(**kwargs))
+
+    await asyncio.gather(*calls)
+
+
+@app.view("update_data")  # type: ignore
+@utils.instrument.listener
+async def update_data(ack, body: dict[str, Any]):  # type: ignore
+    errors = bot.validate_update(body)
+    if errors:
+        await ack({"response_action": "errors", "errors": errors})
+        return False
+    await ack()
+
+    user = body["user"]["id"]
+    project_id, project, old = await asyncio.to_thread(bot.apply_update, body)
+    await asyncio.gather(announce_write(project, old, user), update_home(user=user))
+
+
+@app.view("promote_project")  # type: ignore
+@utils.instrument.listener
+async def promote_project(ack, body: dict[str, Any]):  # type: ignore
+    await ack()
+    project_id = body["view"]["private_metadata"]
+
+    # Channel id we need is double nested inside two dicts with random keys.
+    values = body["view"]["state"]["values"]
+    i: str = next(iter(values))
+    i2: str = next(iter(values[i]))
+    channel: str = values[i][i2]["selected_conversation"]
+
+    notice, promotion = await asyncio.to_thread(
+        bot.promotion_messages, project_id, channel, body["user"]["id"]
+    )
+    await app.client.chat_postMessage(**notice)  # type: ignore
+    promo_msg = await app.client.chat_postMessage(**promotion)  # type: ignore
+
+    # Log this promotion message
+    await asyncio.to_thread(bot.log_promotion, project_id, promo_msg)  # type: ignore
+
+
+@app.action("project_selector")  # type: ignore
+@utils.instrument.listener
+async def project_selected(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    project_id = body["view"]["state"]["values"]["projectDropdown"]["project_selector"][
+        "selected_option"
+    ]["value"]
+    view = await asyncio.to_thread(bot.edit_modal, project_id)
+    await app.client.views_update(view_id=body["container"]["view_id"], view=view)  # type: ignore
+
+
+@app.action("edit_specific_project")  # type: ignore
+@utils.instrument.listener
+async def edit_specific_project(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    view = await asyncio.to_thread(bot.edit_modal, body["actions"][0]["value"])
+    await app.client.views_open(trigger_id=body["trigger_id"], view=view)  # type: ignore
+
+
+# Donate buttons, promoted messages are updated by the pledge itself
+
+
+@app.action("donate10")  # type: ignore
+@utils.instrument.listener
+async def donate10(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], 10, body["user"]["id"], percentage=True)
+
+
+@app.action("donate20")  # type: ignore
+@utils.instrument.listener
+async def donate20(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], 20, body["user"]["id"], percentage=True)
+
+
+@app.action("donate_rest")  # type: ignore
+@utils.instrument.listener
+async def donate_rest(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], "remaining", body["user"]["id"])
+
+
+@app.action("donate_amount")  # type: ignore
+@utils.instrument.listener
+async def donate_amount(ack, body: dict[str, Any], respond) -> None:  # type: ignore
+    await ack()
+    user: str = body["user"]["id"]
+    project_id = bot.slack_id_shuffle(field=body["actions"][0]["block_id"], r=True)
+    amount: str = body["actions"][0]["value"]
+    if bot.check_bad_currency(amount):
+        await respond(
+            text=bot.check_bad_currency(amount),
+            replace_original=False,
+            response_type="ephemeral",
+        )
+    else:
+        await pledge(project_id, amount, user)
+
+
+# Donate buttons with home update
+
+
+@app.action("donate10_home")  # type: ignore
+@utils.instrument.listener
+async def donate10_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], 10, body["user"]["id"], percentage=True)
+
+
+@app.action("donate20_home")  # type: ignore
+@utils.instrument.listener
+async def donate20_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], 20, body["user"]["id"], percentage=True)
+
+
+@app.action("donate_rest_home")  # type: ignore
+@utils.instrument.listener
+async def donate_rest_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await pledge(body["actions"][0]["value"], "remaining", body["user"]["id"])
+
+
+@app.action("donate_amount_home")  # type: ignore
+@utils.instrument.listener
+async def donate_amount_home(ack, body: dict[str, Any], say) -> None:  # type: ignore
+    await ack()
+    user: str = body["user"]["id"]
+    project_id: str = bot.slack_id_shuffle(field=body["actions"][0]["block_id"], r=True)
+    amount: str = body["actions"][0]["value"]
+    if bot.check_bad_currency(amount):
+        await say(text=bot.check_bad_currency(amount), channel=user)
+    else:
+        await pledge(project_id, amount, user)
+
+
+@app.action("conversation_selector")  # type: ignore
+@utils.instrument.listener
+async def conversation_selector(ack) -> None:  # type: ignore
+    await ack()
+    # we actually don't want to do anything yet
+
+
+@app.action("project_preview_selector")  # type: ignore
+@utils.instrument.listener
+async def project_preview_selector(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await app.client.views_update(  # type: ignore
+        view_id=body["container"]["view_id"], view=bot.promote_preview_modal()
+    )
+
+
+@app.action("promote_specific_project_entry")  # type: ignore
+@utils.instrument.listener
+async def promote_specific_project_entry(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await app.client.views_open(  # type: ignore
+        trigger_id=body["trigger_id"],
+        view=bot.promote_modal(body["actions"][0]["value"]),
+    )
+
+
+@app.action("promote_from_home")  # type: ignore
+@utils.instrument.listener
+async def promote_from_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await app.client.views_open(trigger_id=body["trigger_id"], view=bot.promote_modal())  # type: ignore
+
+
+@app.action("update_from_home")  # type: ignore
+@utils.instrument.listener
+async def update_from_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await app.client.views_open(  # type: ignore
+        trigger_id=body["trigger_id"], view=bot.select_project_modal()
+    )
+
+
+@app.action("create_from_home")  # type: ignore
+@utils.instrument.listener
+async def create_from_home(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    project_id = await asyncio.to_thread(bot.new_project_id)
+    view = await asyncio.to_thread(
+        bot.edit_modal, project_id, "Create a pledge", "Create!"
+    )
+    await app.client.views_open(trigger_id=body["trigger_id"], view=view)  # type: ignore
+
+
+@app.action("approve")  # type: ignore
+@utils.instrument.listener
+async def approve(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    # Projects approved in this function should be marked as DGR ineligible
+    await approve_project(body, dgr=False)
+
+
+@app.action("approve_as_dgr")  # type: ignore
+@utils.instrument.listener
+async def approve_as_dgr(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await approve_project(body, dgr=True)
+
+
+@app.action("unapprove")  # type: ignore
+@utils.instrument.listener
+async def unapprove(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await asyncio.to_thread(bot.unapprove_project, body["actions"][0]["value"])
+    await update_home(user=body["user"]["id"])
+
+
+@app.action("delete")  # type: ignore
+@utils.instrument.listener
+async def delete(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    await asyncio.to_thread(bot.delete_project, body["actions"][0]["value"])
+    await update_home(user=body["user"]["id"])
+
+
+@app.action("project_details")  # type: ignore
+@utils.instrument.listener
+async def project_details(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    view = await asyncio.to_thread(bot.details_modal, body["actions"][0]["value"])
+    await app.client.views_open(trigger_id=body["trigger_id"], view=view)  # type: ignore
+
+
+@app.action("sendInvoices")  # type: ignore
+@utils.instrument.listener
+async def invoice(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    # Invoicing is a long sequence of TidyHQ calls, it runs unchanged on a worker thread using the sync client
+    await asyncio.to_thread(bot.invoice_project, body)
+
+
+@app.action("request_project_approval")  # type: ignore
+@utils.instrument.listener
+async def request_project_approval(ack, body: dict[str, Any]) -> None:  # type: ignore
+    await ack()
+    project_id: str = body["actions"][0]["value"]
+    user: str = body["user"]["id"]
+    project: dict[str, Any] = await asyncio.to_thread(bot.peek_project, project_id)
+    request = await asyncio.to_thread(bot.approval_request, project_id, project, user)
+
+    await asyncio.gather(
+        # Send prompt to admins
+        app.client.chat_postMessage(**request),  # type: ignore
+        # Notify the creator
+        utils.dm_cache.send_dm_async(  # type: ignore
+            app.client,
+            project["created by"],
+            text=f'Your project "{project["title"]}" has been submitted for approval.',
+        ),
+        update_home(user=user),
+    )
+
+
+### info ###
+
+
+@app.options("project_selector")  # type: ignore
+@utils.instrument.listener
+async def project_selector(ack, body: dict[str, Any]) -> None:  # type: ignore
+    user: str = body["user"]["id"]
+    if await bot.admins.is_member_async(user=user, client=app.client):
+        options = await asyncio.to_thread(bot.project_options)
+    else:
+        options = await asyncio.to_thread(bot.project_options, user, False)
+    await ack(options=options)
+
+
+@app.options("project_preview_selector")  # type: ignore
+@utils.instrument.listener
+async def project_preview_selector_opt(ack) -> None:  # type: ignore
+    await ack(options=await asyncio.to_thread(bot.project_options, False, True))
+
+
+# Update the app home
+@app.event("app_home_opened")  # type: ignore
+@utils.instrument.listener
+async def app_home_opened(event: dict[str, Any]) -> None:
+    await update_home(user=event["user"])
+
+
+# Keep the cached admin group membership current
+@app.event("subteam_members_changed")  # type: ignore
+@utils.instrument.listener
+async def subteam_members_changed(event: dict[str, Any]) -> None:
+    bot.admins.members_changed(event)
+
+
+@app.event("subteam_updated")  # type: ignore
+@utils.instrument.listener
+async def subteam_updated(event: dict[str, Any]) -> None:
+    bot.admins.group_updated(event)
+
+
+async def main() -> None:
+    # Store access and rendering are handed to this pool, keep it small
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=config.get("async_threads", 8), thread_name_prefix="pledgebot"
+        )
+    )
+    bot.start_background_jobs()
+    bot.start_recording()
+    await AsyncSocketModeHandler(app, config["SLACK_APP_TOKEN"]).start_async()
+
+
+# Start listening for commands
+if __name__ == "__main__":
+    asyncio.run(main())
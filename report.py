@@ -4,16 +4,17 @@ from datetime import datetime, timezone
 from slack_bolt import App
 import csv
 
-# Load projects.json
-
-with open("projects.json", "r") as f:
-    projects = json.load(f)
+from utils.store import configured_store
 
 # Load config
 
 with open("config.json", "r") as f:
     config = json.load(f)
 
+# Load projects
+
+projects = configured_store(config).load()
+
 # Set start and end times
 start_from = int(datetime(2023, 7, 1, 0, 0, 0, tzinfo=timezone.utc).timestamp())
 end_at = int(datetime(2024, 6, 30, 23, 59, 59, tzinfo=timezone.utc).timestamp())
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+import json
+import os
+import tempfile
+import unittest
+from typing import Any
+
+from utils.dm_cache import DMChannelCache
+
+
+class OpeningClient:
+    """Answers conversations.open with a channel named after the user"""
+
+    def __init__(self) -> None:
+        self.opened: list[str] = []
+
+    def conversations_open(self, users: str) -> dict[str, Any]:
+        self.opened.append(users)
+        return {"channel": {"id": f"D{users}"}}
+
+
+class SharedFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "dm_channels.json")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_invalidation_by_another_process_sticks(self) -> None:
+        client = OpeningClient()
+        bot, script = DMChannelCache(self.path), DMChannelCache(self.path)
+        bot.channel(client, "U1")
+        bot.channel(client, "U2")
+
+        # The script finds the bot's channels, then drops one Slack no longer knows about
+        self.assertEqual(script.channel(client, "U1"), "DU1")
+        script.invalidate("U1")
+
+        # The bot saving another channel mustn't bring it back
+        bot.channel(client, "U3")
+        with open(self.path, "r") as f:
+            self.assertEqual(sorted(json.load(f)), ["U2", "U3"])
+        bot.channel(client, "U1")
+        self.assertEqual(client.opened, ["U1", "U2", "U3", "U1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+from typing import Any
+
+from utils.contact_sync import ContactSync
+from utils.invoice_index import InvoiceIndex
+from utils.reconcile import Reconciler
+from utils.store import ProjectStore
+
+
+class InvoiceHistory:
+    """TidyHQ client holding an invoice history, answering updated_since with the invoices changed since"""
+
+    def __init__(self) -> None:
+        self.history: list[dict[str, Any]] = []
+        self.changed: list[dict[str, Any]] = []
+
+    def add(self, name: str, paid: bool = True, changed: bool = False) -> dict[str, Any]:
+        invoice = {"id": len(self.history) + 1, "name": name, "amount": 10, "amount_due": 0 if paid else 10, "paid": paid}
+        self.history.append(invoice)
+        if changed:
+            self.changed.append(invoice)
+        return invoice
+
+    def invoices(self, fields: Any = None, **params: Any) -> list[dict[str, Any]]:
+        return self.changed if params.get("updated_since") else self.history
+
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ProjectStore(os.path.join(self.directory.name, "projects.json"))
+        self.reconciler = Reconciler(
+            {},
+            self.store,
+            client=None,
+            contacts=ContactSync("field", os.path.join(self.directory.name, "tidyslack.json")),
+            invoices=InvoiceIndex(os.path.join(self.directory.name, "tidyhq_invoices.json")),
+            status_path=os.path.join(self.directory.name, "reconcile_status.json"),
+        )
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_only_invoices_of_open_projects_are_kept(self) -> None:
+        history = InvoiceHistory()
+        # Years of reconciled pledges and unrelated invoices
+        for n in range(500):
+            history.add(f"Project pledge: Old {n}")
+            history.add("Membership renewal", paid=n % 2 == 0)
+        self.store.put("old", {"title": "Old 0", "total": 10, "pledges": {"U1": 10}, "funded at": 1, "reconciled at": 2})
+        self.store.put("open", {"title": "Open", "total": 20, "pledges": {"U1": 20}, "funded at": 1})
+        paid = history.add("Project pledge: Open")
+        recorded = history.add("Renamed by hand", paid=False)
+        self.store.put(
+            "open",
+            {**self.store.checkout("open"), "invoices": {"U2": {"id": recorded["id"]}}},  # type: ignore
+        )
+
+        index = self.reconciler.invoices
+        index.sync(history, wanted=self.reconciler.wanted())
+        self.assertEqual(sorted(index.by_id), sorted([str(paid["id"]), str(recorded["id"])]))
+        self.assertEqual(set(index.by_name), {"Project pledge: Open", "Renamed by hand"})
+
+        # Once the project is reconciled its invoices go too, even though they didn't change
+        self.store.put("open", {**self.store.checkout("open"), "reconciled at": 3})  # type: ignore
+        history.add("Project pledge: Old 1", changed=True)
+        index.sync(history, wanted=self.reconciler.wanted())
+        self.assertEqual(index.by_id, {})
+        self.assertEqual(InvoiceIndex(index.path).by_id, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# python -m unittest discover -s tests -t .
+
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from utils.sqlite_store import SQLiteProjectStore
+from utils.store import ProjectStore
+
+
+def project(title: str) -> dict:
+    return {"title": title, "total": 100, "pledges": {}}
+
+
+class TornJournalTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "projects.json")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def tear(self) -> None:
+        """Cuts the last journal record in half, as a crash part way through an append would"""
+        journal = f"{self.path}.journal"
+        size = os.path.getsize(journal)
+        with open(journal, "r+b") as f:
+            f.seek(0)
+            last = f.read().rstrip(b"\n").rfind(b"\n") + 1
+            f.truncate(last + (size - last) // 2)
+
+    def test_write_after_torn_record(self) -> None:
+        store = ProjectStore(self.path)
+        store.put("kept", project("Kept"))
+        store.put("torn", project("Torn"))
+        self.tear()
+
+        # Another process, or the bot after restarting, keeps writing to the torn journal
+        with redirect_stdout(StringIO()):
+            ProjectStore(self.path).put("after", project("After"))
+            projects = ProjectStore(self.path).load()
+
+        self.assertEqual(sorted(projects), ["after", "kept"])
+        self.assertEqual(projects["after"]["title"], "After")
+
+    def test_store_that_read_torn_record(self) -> None:
+        store = ProjectStore(self.path)
+        store.put("kept", project("Kept"))
+        store.put("torn", project("Torn"))
+        self.tear()
+        reader = ProjectStore(self.path)
+        self.assertEqual(sorted(reader.load()), ["kept"])
+
+        with redirect_stdout(StringIO()):
+            ProjectStore(self.path).put("after", project("After"))
+            # The reader carries on from the torn record rather than rereading the journal
+            self.assertEqual(sorted(reader.load()), ["after", "kept"])
+            self.assertTrue(ProjectStore(self.path).compact())
+        self.assertEqual(sorted(ProjectStore(self.path).load()), ["after", "kept"])
+
+
+class BackendOrderTest(unittest.TestCase):
+    def test_backends_list_projects_in_the_same_order(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            json_store = ProjectStore(os.path.join(directory, "projects.json"))
+            sqlite_store = SQLiteProjectStore(os.path.join(directory, "projects.db"))
+            for store in (json_store, sqlite_store):
+                for id in ("zebra", "apple", "mango", "kiwi"):
+                    store.put(id, project(id))
+                updated = project("Apple")
+                updated["approved"] = True
+                store.put("apple", updated)
+                store.delete("mango")
+                store.put("banana", project("banana"))
+
+            expected = ["zebra", "apple", "kiwi", "banana"]
+            self.assertEqual(list(json_store.load()), expected)
+            self.assertEqual(list(sqlite_store.load()), expected)
+            self.assertEqual([id for id, _ in sqlite_store.unfunded()], expected)
+
+            # Folding the journal into the snapshot keeps the order too
+            json_store.compact()
+            self.assertEqual(list(ProjectStore(json_store.path).load()), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
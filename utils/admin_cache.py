@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+# Membership of the admin user group is checked many times per App Home render.
+# Rather than listing every user group on each check the members are cached as a
+# set, refreshed after a TTL and kept current by subteam events in between.
+
+import asyncio
+import threading
+import time
+from typing import Any, Iterable
+
+
+class GroupMembership:
+    """Cached member list for a single Slack user group"""
+
+    def __init__(self, group_id: str, ttl: int = 300) -> None:
+        self.group_id = group_id
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._members: frozenset[str] = frozenset()
+        self._fetched: float | None = None
+        self._async_lock: asyncio.Lock | None = None
+
+    def _stale(self) -> bool:
+        return self._fetched is None or time.monotonic() - self._fetched > self.ttl
+
+    def update(self, users: Iterable[str]) -> None:
+        """Replaces the cached member list"""
+        with self._lock:
+            self._members = frozenset(users)
+            self._fetched = time.monotonic()
+
+    @property
+    def members(self) -> list[str]:
+        return sorted(self._members)
+
+    def refresh(self, client: Any) -> None:
+        r = client.usergroups_users_list(usergroup=self.group_id)  # type: ignore
+        self.update(r["users"])  # type: ignore
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fetched = None
+
+    def is_member(self, user: str, client: Any) -> bool:
+        if self._stale():
+            self.refresh(client)
+        return user in self._members
+
+    async def is_member_async(self, user: str, client: Any) -> bool:
+        """is_member for an AsyncWebClient"""
+        if self._stale():
+            if self._async_lock is None:
+                self._async_lock = asyncio.Lock()
+            # Only the first of several concurrent checks needs to fetch the list
+            async with self._async_lock:
+                if self._stale():
+                    r = await client.usergroups_users_list(usergroup=self.group_id)  # type: ignore
+                    self.update(r["users"])  # type: ignore
+        return user in self._members
+
+    # Event handlers
+
+    def members_changed(self, event: dict[str, Any]) -> None:
+        """Applies a subteam_members_changed event"""
+        if event.get("subteam_id") != self.group_id:
+            return
+        with self._lock:
+            if self._fetched is None:
+                # Nothing cached to apply the change to, the next check will fetch the full list
+                return
+            self._members = (self._members | set(event.get("added_users", []))) - set(
+                event.get("removed_users", [])
+            )
+
+    def group_updated(self, event: dict[str, Any]) -> None:
+        """Applies a subteam_updated event"""
+        subteam: dict[str, Any] = event.get("subteam", {})
+        if subteam.get("id") != self.group_id:
+            return
+        if "users" in subteam:
+            self.update(subteam["users"])
+        else:
+            self.invalidate()
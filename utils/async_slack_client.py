@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# AsyncWebClient counterpart to utils.slack_client.RateLimitedWebClient, used by
+# the asyncio entry point. It paces calls with the same token buckets as the
+# sync client, waiting with asyncio.sleep rather than blocking a thread, so the
+# async app and any sync work it hands to threads share one set of limits.
+#
+# Kept separate from utils.slack_client as AsyncWebClient requires aiohttp.
+
+import asyncio
+from collections import Counter
+from typing import Any
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+from utils import instrument
+from utils.slack_client import (
+    INTERACTIVE,
+    RateLimitScheduler,
+    TokenBucket,
+    _retry_after,
+    shared_scheduler,
+)
+
+# Interactive calls currently waiting on each bucket, background calls hold back while there are any
+_interactive_waiting: Counter[int] = Counter()
+
+
+async def _acquire(bucket: TokenBucket, priority: int) -> None:
+    interactive = priority == INTERACTIVE
+    if interactive:
+        _interactive_waiting[id(bucket)] += 1
+    try:
+        while True:
+            if not interactive and _interactive_waiting[id(bucket)]:
+                await asyncio.sleep(1 / bucket.rate)
+                continue
+            wait = bucket.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+    finally:
+        if interactive:
+            _interactive_waiting[id(bucket)] -= 1
+
+
+class AsyncRateLimitedWebClient(AsyncWebClient):
+    """AsyncWebClient that paces calls per Slack rate limit tier and retries 429 responses"""
+
+    def __init__(
+        self,
+        *args: Any,
+        scheduler: RateLimitScheduler | None = None,
+        priority: int = INTERACTIVE,
+        max_retries: int = 3,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or shared_scheduler
+        self.priority = priority
+        self.max_retries = max_retries
+        self._init_args = (args, kwargs)
+
+    def with_priority(self, priority: int) -> "AsyncRateLimitedWebClient":
+        """Returns a client that shares this one's buckets but queues at a different priority"""
+        args, kwargs = self._init_args
+        return AsyncRateLimitedWebClient(
+            *args,
+            scheduler=self.scheduler,
+            priority=priority,
+            max_retries=self.max_retries,
+            **kwargs,
+        )
+
+    async def api_call(self, api_method: str, **kwargs: Any) -> AsyncSlackResponse:  # type: ignore
+        instrument.count(f"slack.{api_method}")
+        payload = kwargs.get("json") or kwargs.get("data") or kwargs.get("params") or {}
+        buckets = self.scheduler.buckets(api_method, payload.get("channel"))
+        attempt = 0
+        while True:
+            for bucket in buckets:
+                await _acquire(bucket, self.priority)
+            try:
+                return await super().api_call(api_method, **kwargs)  # type: ignore
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.scheduler.retries += 1
+                # Slack doesn't say which limit was hit, back off the narrowest one
+                buckets[0].pause(_retry_after(e.response))
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+# TidyHQ contacts are linked to Slack users through a custom field holding the
+# member's Slack id. ContactSync keeps that link in tidyslack.json along with the
+# time of the last sync, so each sync only asks TidyHQ for contacts changed since
+# then. Newly linked Slack ids are looked up together, through users.list when
+# there are too many for individual users.info calls.
+#
+# The file is replaced atomically. Older files that only hold the member map are
+# read as is and get a full sync the first time.
+
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from utils.fileio import atomic_write_json
+
+# Contacts updated shortly before the previous sync started are fetched again in case of clock drift
+OVERLAP = timedelta(minutes=5)
+
+# Above this many unknown Slack ids it's cheaper to page through users.list than call users.info for each
+BULK_LOOKUP = 20
+
+
+def _user_names(user: dict[str, Any]) -> tuple[str, str]:
+    profile = user.get("profile", {})
+    real_name = user.get("real_name") or profile.get("real_name") or profile.get("display_name") or user["name"]
+    return str(real_name), str(user["name"])
+
+
+class ContactSync:
+    """Slack id to TidyHQ contact mapping, kept current from TidyHQ"""
+
+    def __init__(self, field_id: str, path: str = "tidyslack.json") -> None:
+        self.field_id = field_id
+        self.path = path
+        self._lock = threading.RLock()
+        # Slack id -> (real name, Slack username, contact id)
+        self.members: dict[str, tuple[str, str, int]] = {}
+        # Contact id -> {"name": display name, "slack": linked Slack id or None}
+        self.contacts: dict[str, dict[str, Any]] = {}
+        self.synced_at: str | None = None
+        self._thread: threading.Thread | None = None
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if "members" in data and "synced_at" in data:
+                self.members = {k: tuple(v) for k, v in data["members"].items()}  # type: ignore
+                self.contacts = data.get("contacts", {})
+                self.synced_at = data["synced_at"]
+            else:
+                # Member map written before syncs were incremental
+                self.members = {k: tuple(v) for k, v in data.items()}  # type: ignore
+
+    def save(self) -> None:
+        with self._lock:
+            atomic_write_json(
+                self.path,
+                {"synced_at": self.synced_at, "members": self.members, "contacts": self.contacts},
+                indent=4,
+                sort_keys=True,
+            )
+
+    def add(self, slack_id: str, real_name: str, username: str, contact_id: int) -> None:
+        """Links a Slack user to a contact by hand"""
+        with self._lock:
+            self.members[slack_id] = (real_name, username, int(contact_id))
+            self.save()
+
+    def contact_name(self, contact_id: int | str) -> str | None:
+        contact = self.contacts.get(str(contact_id))
+        return contact["name"] if contact else None
+
+    def _slack_id(self, contact: dict[str, Any]) -> str | None:
+        # Fields TidyHQ left out of a trimmed contact come through as None
+        for field in contact.get("custom_fields") or []:
+            if field["id"] == self.field_id and field["value"]:
+                return str(field["value"])
+        return None
+
+    def _resolve(self, slack_client: Any, slack_ids: list[str]) -> dict[str, tuple[str, str]]:
+        names: dict[str, tuple[str, str]] = {}
+        if len(slack_ids) > BULK_LOOKUP:
+            wanted = set(slack_ids)
+            cursor = None
+            while True:
+                r = slack_client.users_list(limit=1000, cursor=cursor)  # type: ignore
+                for user in r["members"]:  # type: ignore
+                    if user["id"] in wanted:
+                        names[user["id"]] = _user_names(user)
+                cursor = r.get("response_metadata", {}).get("next_cursor")  # type: ignore
+                if not cursor or len(names) == len(wanted):
+                    break
+        else:
+            for slack_id in slack_ids:
+                try:
+                    r = slack_client.users_info(user=slack_id)  # type: ignore
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                names[slack_id] = _user_names(r["user"])  # type: ignore
+        return names
+
+    def sync(self, tidyhq_client: Any, slack_client: Any, full: bool = False) -> dict[str, int]:
+        """Fetches contacts changed since the last sync and links any new Slack ids. Returns counts of what changed"""
+        with self._lock:
+            started = datetime.now(timezone.utc)
+            params: dict[str, Any] = {}
+            if self.synced_at and not full:
+                since = datetime.fromisoformat(self.synced_at) - OVERLAP
+                params["updated_since"] = since.isoformat()
+
+            # Contacts are handled one at a time as they're parsed from TidyHQ's response
+            fetched = 0
+            unlinked = 0
+            pending: dict[str, int] = {}
+            for contact in tidyhq_client.contacts(**params):
+                fetched += 1
+                # Invoices refer to contacts by contact_id
+                contact_id = int(contact["contact_id"])
+                slack_id = self._slack_id(contact)
+                previous = self.contacts.get(str(contact_id), {}).get("slack")
+                self.contacts[str(contact_id)] = {
+                    "name": contact.get("display_name") or f'{contact.get("first_name") or ""} {contact.get("last_name") or ""}'.strip(),
+                    "slack": slack_id,
+                }
+
+                # The Slack id was removed from the contact or moved to another Slack user
+                if previous and previous != slack_id and previous in self.members:
+                    if self.members[previous][2] == contact_id:
+                        del self.members[previous]
+                        unlinked += 1
+
+                if not slack_id:
+                    continue
+                if slack_id in self.members:
+                    real_name, username, _ = self.members[slack_id]
+                    self.members[slack_id] = (real_name, username, contact_id)
+                else:
+                    pending[slack_id] = contact_id
+
+            names = self._resolve(slack_client, list(pending)) if pending else {}
+            for slack_id, contact_id in pending.items():
+                if slack_id not in names:
+                    print(f"Could not find Slack user {slack_id} linked to contact {contact_id}")
+                    continue
+                real_name, username = names[slack_id]
+                self.members[slack_id] = (real_name, username, contact_id)
+                print(f"Added {username} to ({contact_id})")
+
+            self.synced_at = started.isoformat()
+            self.save()
+            return {"contacts": fetched, "added": len(names), "unlinked": unlinked}
+
+    def start(self, tidyhq_client: Any, slack_client: Any, interval: float = 3600) -> None:
+        """Keeps the mapping warm by syncing in a background thread every interval seconds"""
+        if self._thread is not None:
+            return
+
+        def run() -> None:
+            while True:
+                try:
+                    self.sync(tidyhq_client, slack_client)
+                except Exception:
+                    traceback.print_exc()
+                time.sleep(interval)
+
+        self._thread = threading.Thread(target=run, name="contact-sync", daemon=True)
+        self._thread.start()
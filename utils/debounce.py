@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+# Work that only needs to reflect the latest state (ie re-rendering an App Home)
+# is queued by key. Requests for a key that is already waiting are merged, and
+# requests made while a key is being processed cause a single re-run afterwards.
+# AsyncCoalescer does the same with asyncio tasks for the async entry point.
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable, Hashable
+
+
+class CoalescingQueue:
+    """Calls handler(key) from a pool of worker threads, at most once per key per window"""
+
+    def __init__(
+        self,
+        handler: Callable[[Hashable], None],
+        window: float = 2.0,
+        workers: int = 4,
+        name: str = "coalescing-queue",
+        urgent_handler: Callable[[Hashable], None] | None = None,
+    ) -> None:
+        self.handler = handler
+        # Used instead of handler for runs that include an urgent request
+        self.urgent_handler = urgent_handler or handler
+        self.window = window
+        self._cond = threading.Condition()
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+        # Keys waiting to run and when they're due
+        self._pending: dict[Hashable, float] = {}
+        self._running: set[Hashable] = set()
+        # Keys requested again while running, run once more as soon as the current run finishes
+        self._rerun: dict[Hashable, float] = {}
+        # Keys with an urgent request that hasn't been run yet
+        self._urgent: set[Hashable] = set()
+        self.processed = 0
+        self.coalesced = 0
+        self._workers = workers
+        self._name = name
+        self._started = False
+
+    def _start(self) -> None:
+        # Caller must hold self._cond. Workers are only started once there's work for them
+        if not self._started:
+            self._started = True
+            for i in range(self._workers):
+                threading.Thread(target=self._work, name=f"{self._name}-{i}", daemon=True).start()
+
+    def _schedule(self, key: Hashable, due: float) -> None:
+        # Caller must hold self._cond
+        self._pending[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        self._cond.notify_all()
+
+    def request(self, key: Hashable, urgent: bool = False) -> None:
+        """Queues key. Urgent requests skip the debounce window and go to the front of the queue"""
+        due = time.monotonic() + (0 if urgent else self.window)
+        with self._cond:
+            self._start()
+            if urgent:
+                self._urgent.add(key)
+            if key in self._running:
+                self._rerun[key] = min(due, self._rerun.get(key, due))
+                self.coalesced += 1
+            elif key in self._pending:
+                self.coalesced += 1
+                # An urgent request can pull a waiting key forward, but nothing is pushed back
+                if due < self._pending[key]:
+                    self._schedule(key, due)
+            else:
+                self._schedule(key, due)
+
+    def _next(self) -> tuple[Hashable, bool]:
+        with self._cond:
+            while True:
+                # Discard heap entries superseded by an earlier due time
+                while self._heap and self._pending.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                _, _, key = heapq.heappop(self._heap)
+                del self._pending[key]
+                self._running.add(key)
+                urgent = key in self._urgent
+                self._urgent.discard(key)
+                return key, urgent
+
+    def _work(self) -> None:
+        while True:
+            key, urgent = self._next()
+            try:
+                (self.urgent_handler if urgent else self.handler)(key)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running.discard(key)
+                    self.processed += 1
+                    if key in self._rerun:
+                        self._schedule(key, self._rerun.pop(key))
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Blocks until nothing is queued or running. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+class AsyncCoalescer:
+    """asyncio counterpart to CoalescingQueue, awaits handler(key) at most once per key per window"""
+
+    def __init__(
+        self,
+        handler: Callable[[Hashable], Awaitable[None]],
+        window: float = 2.0,
+        urgent_handler: Callable[[Hashable], Awaitable[None]] | None = None,
+    ) -> None:
+        self.handler = handler
+        # Used instead of handler for runs that include an urgent request
+        self.urgent_handler = urgent_handler or handler
+        self.window = window
+        # Tasks sleeping until their key is due
+        self._pending: dict[Hashable, asyncio.Task[None]] = {}
+        # Pending keys that were requested urgently
+        self._urgent: set[Hashable] = set()
+        self._running: dict[Hashable, asyncio.Task[None]] = {}
+        # Keys requested again while running and whether any of those requests were urgent
+        self._rerun: dict[Hashable, bool] = {}
+        self.processed = 0
+        self.coalesced = 0
+
+    def request(self, key: Hashable, urgent: bool = False) -> None:
+        """Queues key. Must be called from the event loop"""
+        if key in self._running:
+            self._rerun[key] = urgent or self._rerun.get(key, False)
+            self.coalesced += 1
+            return
+        if key in self._pending:
+            self.coalesced += 1
+            if not urgent or key in self._urgent:
+                return
+            # Pull the waiting key forward
+            self._pending[key].cancel()
+        if urgent:
+            self._urgent.add(key)
+        self._pending[key] = asyncio.create_task(self._run(key, 0 if urgent else self.window))
+
+    async def _run(self, key: Hashable, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._running[key] = self._pending.pop(key)
+        urgent = key in self._urgent
+        self._urgent.discard(key)
+        try:
+            await (self.urgent_handler if urgent else self.handler)(key)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            del self._running[key]
+            self.processed += 1
+            if key in self._rerun:
+                self.request(key, urgent=self._rerun.pop(key))
+
+    async def wait_idle(self, timeout: float | None = None) -> bool:
+        """Waits until nothing is queued or running. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending or self._running:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+# DM channel ids don't change, so once conversations.open has told us a user's
+# DM channel it's remembered on disk and shared by the bot and the utils scripts.
+# If Slack reports the channel as missing the entry is dropped and reopened.
+
+import json
+import os
+import threading
+from typing import Any
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.slack_response import SlackResponse
+
+from utils.fileio import atomic_write_json
+
+
+class DMChannelCache:
+    """Disk backed map of Slack user id to DM channel id"""
+
+    def __init__(self, path: str = "dm_channels.json") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._channels: dict[str, str] = {}
+        self._signature: tuple[int, int, int] | None = None
+        # Changes made here that haven't reached the file yet, None marks a dropped channel
+        self._unsaved: dict[str, str | None] = {}
+
+    def _refresh(self) -> None:
+        # Caller must hold self._lock. The file replaces what's held here so that channels other
+        # processes opened are picked up and ones they dropped aren't written back
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if signature != self._signature:
+            with open(self.path, "r") as f:
+                channels: dict[str, str] = json.load(f)
+            for user, channel in self._unsaved.items():
+                if channel is None:
+                    channels.pop(user, None)
+                else:
+                    channels[user] = channel
+            self._channels = channels
+            self._signature = signature
+
+    def _set(self, user: str, channel: str | None) -> None:
+        # Caller must hold self._lock
+        self._unsaved[user] = channel
+        if channel is None:
+            self._channels.pop(user, None)
+        else:
+            self._channels[user] = channel
+        atomic_write_json(self.path, self._channels, indent=4, sort_keys=True)
+        st = os.stat(self.path)
+        self._signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self._unsaved = {}
+
+    def channel(self, client: Any, user: str) -> str:
+        """Returns the DM channel for user, opening it if we haven't seen it before"""
+        with self._lock:
+            self._refresh()
+            if user in self._channels:
+                return self._channels[user]
+
+        r: SlackResponse = client.conversations_open(users=user)  # type: ignore
+        channel_id = str(r["channel"]["id"])  # type: ignore
+
+        with self._lock:
+            self._refresh()
+            self._set(user, channel_id)
+        return channel_id
+
+    def invalidate(self, user: str) -> None:
+        with self._lock:
+            self._refresh()
+            if user in self._channels:
+                self._set(user, None)
+
+    def send(self, client: Any, user: str, **kwargs: Any) -> SlackResponse:
+        """Posts a message to a user's DM channel"""
+        try:
+            return client.chat_postMessage(channel=self.channel(client, user), **kwargs)  # type: ignore
+        except SlackApiError as e:
+            if e.response.get("error") != "channel_not_found":
+                raise
+            # The cached channel is no longer valid, reopen it and try once more
+            self.invalidate(user)
+            return client.chat_postMessage(channel=self.channel(client, user), **kwargs)  # type: ignore
+
+    async def channel_async(self, client: Any, user: str) -> str:
+        """channel for an AsyncWebClient"""
+        with self._lock:
+            self._refresh()
+            if user in self._channels:
+                return self._channels[user]
+
+        r = await client.conversations_open(users=user)  # type: ignore
+        channel_id = str(r["channel"]["id"])  # type: ignore
+
+        with self._lock:
+            self._refresh()
+            self._set(user, channel_id)
+        return channel_id
+
+    async def send_async(self, client: Any, user: str, **kwargs: Any) -> Any:
+        """send for an AsyncWebClient"""
+        try:
+            return await client.chat_postMessage(channel=await self.channel_async(client, user), **kwargs)  # type: ignore
+        except SlackApiError as e:
+            if e.response.get("error") != "channel_not_found":
+                raise
+            self.invalidate(user)
+            return await client.chat_postMessage(channel=await self.channel_async(client, user), **kwargs)  # type: ignore
+
+
+dm_channels = DMChannelCache()
+
+
+def send_dm(client: Any, user: str, **kwargs: Any) -> SlackResponse:
+    """Sends a direct message using the shared DM channel cache"""
+    return dm_channels.send(client, user, **kwargs)
+
+
+async def send_dm_async(client: Any, user: str, **kwargs: Any) -> Any:
+    """send_dm for an AsyncWebClient"""
+    return await dm_channels.send_async(client, user, **kwargs)
@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+
+import json
+import os
+from typing import Any
+
+
+def atomic_write_json(path: str, data: Any, **kwargs: Any) -> None:
+    """Writes JSON to a temporary file and moves it into place so readers never see a partial file"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
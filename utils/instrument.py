@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+# Counts the outbound Slack and TidyHQ calls and the store reads and writes made
+# while handling each listener invocation. Most slowdowns in this bot come from
+# an extra round trip rather than extra CPU, so these counts are what the call
+# budgets in benchmarks.budgets check.
+#
+# Counts are keyed like "slack.chat.postMessage", "tidyhq.GET contacts",
+# "store.read", "store.write" and "store.parse". Work done on other threads, such
+# as queued App Home refreshes, isn't part of the invocation that queued it but
+# is still included in the process wide totals.
+
+import functools
+import inspect
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable
+
+_current: ContextVar[Counter[str] | None] = ContextVar("instrument_current", default=None)
+_lock = threading.Lock()
+
+# Everything counted in this process
+totals: Counter[str] = Counter()
+
+# Counts from the most recent invocation of each listener
+last: dict[str, Counter[str]] = {}
+
+# Invocations, seconds and counts summed over every invocation of each listener
+listeners: dict[str, dict[str, Any]] = {}
+
+
+def count(kind: str, n: int = 1) -> None:
+    current = _current.get()
+    with _lock:
+        totals[kind] += n
+        # Shared with any threads the listener handed work to
+        if current is not None:
+            current[kind] += n
+
+
+def _record(name: str, counts: Counter[str], seconds: float) -> None:
+    with _lock:
+        last[name] = counts
+        stats = listeners.setdefault(name, {"invocations": 0, "seconds": 0.0, "counts": Counter()})
+        stats["invocations"] += 1
+        stats["seconds"] += seconds
+        stats["counts"].update(counts)
+
+
+def listener(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Counts calls made by each invocation of a Bolt listener, place it under the @app decorator"""
+    name = func.__name__
+
+    # Bolt passes arguments by the names in the signature, which it reads through __wrapped__
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def run_async(*args: Any, **kwargs: Any) -> Any:
+            counts: Counter[str] = Counter()
+            token = _current.set(counts)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                _record(name, counts, time.perf_counter() - start)
+
+        return run_async
+
+    @functools.wraps(func)
+    def run(*args: Any, **kwargs: Any) -> Any:
+        counts: Counter[str] = Counter()
+        token = _current.set(counts)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+            _record(name, counts, time.perf_counter() - start)
+
+    return run
+
+
+def reset() -> None:
+    with _lock:
+        totals.clear()
+        last.clear()
+        listeners.clear()
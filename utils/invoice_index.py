@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+# Local copy of the TidyHQ invoices needed for reconciliation, indexed by invoice
+# id, name and reference. Only invoices changed since the previous sync are
+# fetched, so reconciliation doesn't download the organisation's entire invoice
+# history each time. Only the fields reconciliation uses are kept, and a sync
+# given a wanted filter drops every invoice it rejects, so the index holds the
+# invoices of projects still open rather than the whole history.
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from utils.fileio import atomic_write_json
+
+# Invoices updated shortly before the previous sync started are fetched again in case of clock drift
+OVERLAP = timedelta(minutes=5)
+
+FIELDS = ("id", "name", "reference", "amount", "amount_due", "paid", "contact_id")
+
+
+def _newest(invoice: dict[str, Any]) -> tuple[bool, int, str]:
+    # Numeric ids compare by length then digits, anything else sorts after them rather than raising
+    invoice_id = str(invoice["id"])
+    return invoice_id.isdigit(), len(invoice_id), invoice_id
+
+
+class InvoiceIndex:
+    """TidyHQ invoices by id, name and reference, kept current from TidyHQ"""
+
+    def __init__(self, path: str = "tidyhq_invoices.json") -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self.by_id: dict[str, dict[str, Any]] = {}
+        self.by_name: dict[str, set[str]] = {}
+        self.by_reference: dict[str, set[str]] = {}
+        self.synced_at: str | None = None
+        self.load()
+
+    def _index(self, invoice: dict[str, Any]) -> None:
+        # Caller must hold self._lock
+        invoice_id = str(invoice["id"])
+        self._discard(invoice_id)
+        self.by_id[invoice_id] = invoice
+        self.by_name.setdefault(invoice.get("name"), set()).add(invoice_id)  # type: ignore
+        self.by_reference.setdefault(invoice.get("reference"), set()).add(invoice_id)  # type: ignore
+
+    def _discard(self, invoice_id: str) -> None:
+        # Caller must hold self._lock
+        old = self.by_id.pop(invoice_id, None)
+        if old is None:
+            return
+        for index, key in ((self.by_name, old.get("name")), (self.by_reference, old.get("reference"))):
+            ids = index.get(key)  # type: ignore
+            if ids is not None:
+                ids.discard(invoice_id)
+                if not ids:
+                    del index[key]  # type: ignore
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.synced_at = data["synced_at"]
+            for invoice in data["invoices"]:
+                self._index(invoice)
+
+    def save(self) -> None:
+        with self._lock:
+            atomic_write_json(
+                self.path,
+                {"synced_at": self.synced_at, "invoices": list(self.by_id.values())},
+            )
+
+    def sync(
+        self, tidyhq_client: Any, full: bool = False, wanted: Callable[[dict[str, Any]], bool] | None = None
+    ) -> int:
+        """Fetches invoices created or changed since the last sync, keeping only those wanted accepts. Returns how many were fetched"""
+        with self._lock:
+            started = datetime.now(timezone.utc)
+            params: dict[str, Any] = {}
+            if self.synced_at and not full:
+                since = datetime.fromisoformat(self.synced_at) - OVERLAP
+                params["updated_since"] = since.isoformat()
+
+            # Invoices are indexed one at a time as they're parsed from TidyHQ's response
+            fetched = 0
+            for invoice in tidyhq_client.invoices(fields=FIELDS, **params):
+                if wanted is None or wanted(invoice):
+                    self._index(invoice)
+                else:
+                    self._discard(str(invoice["id"]))
+                fetched += 1
+
+            # Invoices kept by earlier syncs that are no longer needed
+            if wanted is not None:
+                for invoice_id in [i for i, invoice in self.by_id.items() if not wanted(invoice)]:
+                    self._discard(invoice_id)
+
+            self.synced_at = started.isoformat()
+            self.save()
+            return fetched
+
+    def _lookup(self, ids: set[str]) -> list[dict[str, Any]]:
+        # Newest first, TidyHQ ids increase over time
+        with self._lock:
+            return sorted((self.by_id[i] for i in ids), key=_newest, reverse=True)
+
+    def get(self, invoice_id: int | str) -> dict[str, Any] | None:
+        return self.by_id.get(str(invoice_id))
+
+    def named(self, name: str) -> list[dict[str, Any]]:
+        return self._lookup(self.by_name.get(name, set()))
+
+    def referencing(self, reference: str) -> list[dict[str, Any]]:
+        return self._lookup(self.by_reference.get(reference, set()))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+# Bolt runs listeners on a thread pool so two people can act on the same project
+# at once. Anything that reads a project, modifies it and writes it back should do
+# so while holding that project's lock. Locks for different projects are
+# independent so unrelated pledges don't wait on each other. Whole file commits
+# (journal compaction) are serialised separately by the store itself.
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class LockManager:
+    """Hands out one re-entrant lock per project id"""
+
+    def __init__(self) -> None:
+        self._guard = threading.Lock()
+        self._locks: dict[str, threading.RLock] = {}
+
+    def get(self, id: str) -> threading.RLock:
+        with self._guard:
+            lock = self._locks.get(id)
+            if lock is None:
+                lock = self._locks[id] = threading.RLock()
+            return lock
+
+    @contextmanager
+    def project(self, id: str) -> Iterator[None]:
+        with self.get(id):
+            yield
+
+    @contextmanager
+    def projects(self, ids: list[str]) -> Iterator[None]:
+        """Holds several project locks at once, always acquired in the same order to avoid deadlocks"""
+        locks = [self.get(id) for id in sorted(set(ids))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+# Shared by the bot and anything it imports
+project_locks = LockManager()
@@ -2,36 +2,76 @@
 
 # Slack does not seem to have full type annotations, relevant types are marked with # type: ignore
 
+import contextvars
+import copy
 import json
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any
 
-import requests
 from slack_bolt import App
 from slack_sdk.web.slack_response import SlackResponse
 
+if __name__ == "__main__" and not __package__:
+    # Run by path as python utils/project_output.py, the way cron entries from before the utils package do
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.contact_sync import ContactSync
+from utils.dm_cache import send_dm
+from utils.locks import project_locks
+from utils.slack_client import BACKGROUND, RateLimitedWebClient
+from utils.store import configured_store
+from utils import tidyhq
+
 ########################
 # Processing functions #
 ########################
 
 
-# Load projects
+# Load projects, the returned dict is shared and should not be modified
 def load_projects() -> dict[str, dict[str, Any]]:
-    with open("./projects.json", "r") as f:
-        return json.load(f)
+    return configured_store(config).load()
 
 
 def lookup(id: str) -> tuple[str, str, int]:
     if id not in members.keys():
         r: SlackResponse = invoice_slack_app.client.users_info(user=id)
         tidy: str = input(f'TidyHQ ID for {r["user"]["real_name"]}? ')
-        members[id] = (str(r["user"]["real_name"]), str(r["user"]["name"]), int(tidy))
-        with open("tidyslack.json", "w") as f:
-            json.dump(members, f, indent=4, sort_keys=True)
+        contact_directory().add(id, str(r["user"]["real_name"]), str(r["user"]["name"]), int(tidy))
     return members[id]
 
 
-def send_invoices(p: dict[str, Any], module: bool = False) -> str:
+# Records a donor's invoice on the project as soon as it exists, so a retried run won't bill them twice
+def checkpoint_invoice(project_id: str, pledge: str, record: dict[str, Any]) -> None:
+    store = configured_store(config)
+    with project_locks.project(project_id):
+        project = store.checkout(project_id)
+        if project is None:
+            return
+        project.setdefault("invoices", {})[pledge] = record
+        store.put(project_id, project)
+
+
+# Marks invoicing as finished for the project
+def mark_invoices_sent(project_id: str) -> None:
+    store = configured_store(config)
+    with project_locks.project(project_id):
+        project = store.checkout(project_id)
+        if project is None:
+            return
+        project["invoices_sent"] = int(datetime.now().timestamp())
+        store.put(project_id, project)
+
+
+def send_invoices(
+    p: dict[str, Any], module: bool = False, project_id: str | None = None
+) -> str:
+    # Invoices are checkpointed into the project as they're created when project_id is provided.
+    # Running again after a partial failure only picks up the donors that weren't finished.
 
     # Check if project has already been processed
     if "invoices_sent" in p.keys():
@@ -62,65 +102,132 @@ def send_invoices(p: dict[str, Any], module: bool = False) -> str:
         admin_suffix = "\nThese invoices have **not** been marked as tax deductible."
         category: int = int(config["tidyhq_project_category"])
 
-    admin_notification: str = f'Invoices for {p["title"]} have been created: '
-    sent_total = 0
-
-    for pledge in p["pledges"]:
+    # Get org name for URLs.
+    domain = tidyhq.domain_prefix(config)
+
+    # Invoices from earlier runs, keyed by donor
+    invoiced: dict[str, dict[str, Any]] = copy.deepcopy(p.get("invoices", {}))
+    remaining = [
+        pledge for pledge in p["pledges"] if not invoiced.get(pledge, {}).get("notified")
+    ]
+    if len(remaining) < len(p["pledges"]):
+        print(f'Resuming, {len(p["pledges"]) - len(remaining)} donors already invoiced')
+
+    def checkpoint(pledge: str, record: dict[str, Any]) -> None:
+        invoiced[pledge] = record
+        if project_id:
+            checkpoint_invoice(project_id, pledge, record)
+
+    def invoice_pledge(pledge: str) -> dict[str, Any]:
+        # Runs on the pool, failures are returned rather than raised so the other donors are still invoiced
+        result: dict[str, Any] = {"pledge": pledge, "error": None}
         amount: int = p["pledges"][pledge]
-        details: dict[str, Any] = {
-            "access_token": str(config["tidyhq_token"]),
-            "reference": str(p["title"]),
-            "name": str(title_prefix + p["title"]),
-            "amount": amount,
-            "included_tax_total": amount,
-            "pre_tax_amount": amount,
-            "due_date": datetime.now() + timedelta(days=14),
-            "category_id": category,
-            "contact_id": int(members[pledge][2]),
-            "metadata": "Automatically added via api",
-        }
-
-        invoice: dict[str, Any] = requests.post(
-            "https://api.tidyhq.com/v1/invoices/", params=details
-        ).json()
-        print(
-            f'${invoice.get("amount","?")} invoice created for {members[pledge][0]} (https://{domain}.tidyhq.com/finances/invoices/{invoice["id"]}))'
-        )
-        admin_notification += f'\n• ${invoice.get("amount","?")} for <@{members[pledge][1]}> - <https://{domain}.tidyhq.com/finances/invoices/{invoice["id"]}|{invoice["id"]}>'
-        sent_total += int(invoice["amount"])
 
-        # Open a slack conversation with the donor and get the channel ID
-        r: SlackResponse = invoice_slack_app.client.conversations_open(users=pledge)  # type: ignore
-        channel_id = str(r["channel"]["id"])  # type: ignore
+        if pledge in invoiced:
+            # Created by an earlier run that stopped before the donor was notified
+            record = invoiced[pledge]
+        else:
+            details: dict[str, Any] = {
+                "reference": str(p["title"]),
+                "name": str(title_prefix + p["title"]),
+                "amount": amount,
+                "included_tax_total": amount,
+                "pre_tax_amount": amount,
+                "due_date": datetime.now() + timedelta(days=14),
+                "category_id": category,
+                "contact_id": int(members[pledge][2]),
+                "metadata": "Automatically added via api",
+            }
+
+            try:
+                invoice: dict[str, Any] = tidyhq.client(config).post("invoices", params=details)
+            except Exception as e:
+                traceback.print_exc()
+                result["error"] = f"invoice could not be created ({e})"
+                return result
+            record = {
+                "id": invoice["id"],
+                "amount": int(invoice.get("amount", amount)),
+                "notified": False,
+            }
+            checkpoint(pledge, record)
+            print(
+                f'${record["amount"]} invoice created for {members[pledge][0]} (https://{domain}.tidyhq.com/finances/invoices/{record["id"]}))'
+            )
 
         # Send a message to the donor to let them know an invoice has been created
-        invoice_slack_app.client.chat_postMessage(  # type: ignore
-            channel=channel_id,  # type: ignore
-            text=f'The funding goal for {p["title"]} has been met. I\'ve created an invoice for ${amount} which you can find <https://{domain}.tidyhq.com/public/invoices/{invoice["id"]}|here>.{message_suffix}',
-        )
+        try:
+            send_dm(  # type: ignore
+                invoice_slack_app.client,
+                pledge,
+                text=f'The funding goal for {p["title"]} has been met. I\'ve created an invoice for ${record["amount"]} which you can find <https://{domain}.tidyhq.com/public/invoices/{record["id"]}|here>.{message_suffix}',
+            )
+        except Exception as e:
+            traceback.print_exc()
+            result["error"] = f"invoice created but notification failed ({e})"
+            return result
+        checkpoint(pledge, {**record, "notified": True})
 
         print(f"Invoice notification sent to {members[pledge][0]}")
+        return result
+
+    # Each donor is a TidyHQ call and a Slack call, run them side by side. Results keep the pledge order.
+    # Each donor runs in a copy of the caller's context so its calls are counted against the invoking listener
+    with ThreadPoolExecutor(
+        max_workers=config.get("invoice_workers", 8), thread_name_prefix="invoice"
+    ) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, invoice_pledge, pledge)
+            for pledge in remaining
+        ]
+        results = [future.result() for future in futures]
 
-    # Open a slack conversation with the project creator and get the channel ID
-    r = invoice_slack_app.client.conversations_open(users=p["created by"])  # type: ignore
-    channel_id: str = r["channel"]["id"]  # type: ignore
+    admin_notification: str = f'Invoices for {p["title"]} have been created: '
+    sent_total = 0
+    failures = ""
 
-    # Send a message to the project creator to let them know the invoices have been created
-    invoice_slack_app.client.chat_postMessage(  # type: ignore
-        channel=channel_id,
-        text=f'The funding goal for a project you created ({p["title"]}) has been met and invoices have been sent out. Please contact the Treasurer for the next steps.',
-    )
+    for pledge in p["pledges"]:
+        record = invoiced.get(pledge)
+        if record is not None:
+            admin_notification += f'\n• ${record["amount"]} for <@{members[pledge][1]}> - <https://{domain}.tidyhq.com/finances/invoices/{record["id"]}|{record["id"]}>'
+            sent_total += int(record["amount"])
+            if pledge not in remaining:
+                admin_notification += " (earlier run)"
+    for result in results:
+        if result["error"]:
+            failures += f'\n• <@{members[result["pledge"]][1]}>: {result["error"]}'
+
+    done = sum(1 for pledge in p["pledges"] if invoiced.get(pledge, {}).get("notified"))
+    complete = done == len(p["pledges"])
+
+    if complete:
+        # Send a message to the project creator to let them know the invoices have been created
+        send_dm(  # type: ignore
+            invoice_slack_app.client,
+            p["created by"],
+            text=f'The funding goal for a project you created ({p["title"]}) has been met and invoices have been sent out. Please contact the Treasurer for the next steps.',
+        )
 
-    print(
-        f'Invoice notification sent to {members[p["created by"]][0]} as project creator'
-    )
+        print(
+            f'Invoice notification sent to {members[p["created by"]][0]} as project creator'
+        )
+
+        if project_id:
+            mark_invoices_sent(project_id)
 
     # Send invoice creation details to the admin channel
 
     admin_notification += f'\n\nProject goal: ${p["total"]}'
     admin_notification += f"\nTotal sent: ${sent_total}"
     admin_notification += admin_suffix
-    admin_notification += f'\n\nA notification has also been sent to <@{p["created by"]}> as the project creator. They\'ve been asked to contact the Treasurer for the next steps.'
+    if complete:
+        admin_notification += f'\n\nA notification has also been sent to <@{p["created by"]}> as the project creator. They\'ve been asked to contact the Treasurer for the next steps.'
+    else:
+        admin_notification = (
+            f'Error: Invoicing is incomplete, {done} of {len(p["pledges"])} donors have been invoiced and notified. Send invoices again to retry the rest, donors that are already done will be skipped.\n\n'
+            + admin_notification
+            + f"\n\nSome donors could not be processed:{failures}"
+        )
 
     # If we're running as a module, return the admin notification rather than posting it to slack
     if module:
@@ -128,6 +235,8 @@ def send_invoices(p: dict[str, Any], module: bool = False) -> str:
 
     invoice_slack_app.client.chat_postMessage(channel=str(config["admin_channel"]), text=admin_notification)  # type: ignore
 
+    if not complete:
+        return "Error: Invoicing incomplete."
     return "Success: Invoices sent."
 
 
@@ -136,46 +245,52 @@ def load_config() -> dict[str, str | int]:
         return json.load(f)
 
 
+def contact_directory() -> ContactSync:
+    # Shared with the bot's background sync so invoicing starts from a warm mapping
+    global contact_sync
+    if contact_sync is None:
+        contact_sync = ContactSync(str(config["tidyhq_slack_id_field"]))
+    return contact_sync
+
+
+def linked_members(slack_ids: list[str]) -> dict[str, tuple[str, str, int]]:
+    """The warm contact mapping, only synced first when some of slack_ids aren't linked yet"""
+    global members
+    members = contact_directory().members
+    if any(slack_id not in members for slack_id in slack_ids):
+        update_users()
+    return members
+
+
 def update_users() -> dict[str, tuple[str, str, int]]:
     global members
-    # Populate users from file
-    try:
-        with open("tidyslack.json", "r") as f:
-            members = json.load(f)
-    except FileNotFoundError:
-        members = {}
-
-    print("Pulling TidyHQ contacts...")
-
-    contacts: list[dict[str, Any]] = requests.get(
-        "https://api.tidyhq.com/v1/contacts/",
-        params={"access_token": config["tidyhq_token"]},
-    ).json()
-
-    print(f"Received {len(contacts)} contacts")
-
-    print("Pulling data for Slack users not already cached...")
-    for contact in contacts:
-        for field in contact["custom_fields"]:
-            if (
-                field["id"] == config["tidyhq_slack_id_field"]
-                and field["value"] not in members.keys()
-                and field["value"]
-            ):
-                r: SlackResponse = invoice_slack_app.client.users_info(
-                    user=field["value"]
-                )
-                members[field["value"]] = (
-                    r["user"].get(
-                        "real_name", r["user"].get("display_name", r["user"]["name"])
-                    ),
-                    r["user"]["name"],
-                    contact["contact_id"],
-                )
-                print(f'Added {r["user"]["name"]} to ({contact["contact_id"]})')
-
-    with open("tidyslack.json", "w") as f:
-        json.dump(members, f, indent=4, sort_keys=True)
+    directory = contact_directory()
+
+    # Only contacts changed since the last sync are fetched
+    print("Syncing TidyHQ contacts...")
+    stats = directory.sync(tidyhq.client(config), connect_slack().client)
+    print(
+        f'Received {stats["contacts"]} changed contacts, linked {stats["added"]} new Slack users'
+    )
+
+    members = directory.members
+    return members
+
+
+def connect_slack() -> App:
+    # Reuse the same app between invoicing runs, calls are rate limited alongside the bot's own
+    global invoice_slack_app
+    if invoice_slack_app is None:
+        invoice_slack_app = App(
+            token=str(config["SLACK_BOT_TOKEN"]),
+            client=RateLimitedWebClient(
+                token=str(config["SLACK_BOT_TOKEN"]),
+                base_url=config.get("slack_base_url", RateLimitedWebClient.BASE_URL),
+                priority=BACKGROUND,
+            ),
+            token_verification_enabled=False,
+        )
+    return invoice_slack_app
 
 
 def send_invoices_lib(id: str) -> str:
@@ -188,37 +303,41 @@ def send_invoices_lib(id: str) -> str:
         raise Exception("Project not found")
 
     # Initialise slack
-    global invoice_slack_app
-    invoice_slack_app = App(token=str(config["SLACK_BOT_TOKEN"]))
+    connect_slack()
 
-    # Get users
-    update_users()
-
-    outcome = send_invoices(projects[id], module=True)
+    # The background sync keeps the mapping warm, TidyHQ is only asked when a donor is missing from it
+    linked_members(list(projects[id].get("pledges", {})))
 
-    # Update projects.json if invoices were sent successfully
-    if outcome.startswith("Success"):
-        projects[id]["invoices_sent"] = int(datetime.now().timestamp())
-        with open("projects.json", "w") as f:
-            json.dump(projects, f, indent=4, sort_keys=True)
+    # Two admins pressing the button at once would bill donors twice
+    with invoicing_lock:
+        if id in invoicing:
+            return "Error: Invoicing for this project is already in progress."
+        invoicing.add(id)
+    try:
+        # Work on a fresh copy so invoices checkpointed by an earlier run are skipped
+        project = configured_store(config).checkout(id)
+        outcome = send_invoices(project, module=True, project_id=id)  # type: ignore
+    finally:
+        with invoicing_lock:
+            invoicing.discard(id)
 
     return outcome
 
 
-# Get info that isn't expected to change while the script is running.
-
 # Load config
 config = load_config()
 
-# Get org name for URLs.
-domain: str = requests.get(
-    "https://api.tidyhq.com/v1/organization",
-    params={"access_token": config["tidyhq_token"]},
-).json()["domain_prefix"]
+invoice_slack_app: App | None = None
+contact_sync: ContactSync | None = None
+members: dict[str, tuple[str, str, int]] = {}
+
+# Projects with an invoicing run in progress
+invoicing: set[str] = set()
+invoicing_lock = threading.Lock()
 
 if __name__ == "__main__":
     # Initialise slack
-    app = App(token=str(config["SLACK_BOT_TOKEN"]))
+    connect_slack()
 
     # Get users
     update_users()
@@ -242,4 +361,4 @@ if __name__ == "__main__":
         print("\n")
         i: str = input("Invoice? [y/N]")
         if i == "y":
-            send_invoices(p)
+            send_invoices(copy.deepcopy(p), project_id=project)
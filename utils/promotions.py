@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# Promoted project messages are refreshed in the background after each pledge.
+# Refreshes are debounced per project so a burst of pledges only sends the final
+# state, the message blocks are rendered once per refresh and the messages are
+# updated concurrently through a bounded pool.
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+from utils.debounce import CoalescingQueue
+
+
+class PromotionRefresher:
+    """Pushes the latest project blocks to every message the project was promoted in"""
+
+    def __init__(
+        self,
+        client: Any,
+        render: Callable[[str], list[dict[str, Any]]],
+        promotions: Callable[[str], list[dict[str, str]]],
+        window: float = 1.0,
+        workers: int = 8,
+    ) -> None:
+        self.client = client
+        self.render = render
+        self.promotions = promotions
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="promotion-update")
+        self._queue = CoalescingQueue(self._refresh, window=window, workers=2, name="promotion-refresh")
+        # Counted from the pool's threads
+        self._lock = threading.Lock()
+        self.updated = 0
+        self.failed = 0
+
+    def request(self, project_id: str) -> None:
+        self._queue.request(project_id)
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        return self._queue.wait_idle(timeout)
+
+    def _update(self, promotion: dict[str, str], blocks: list[dict[str, Any]]) -> None:
+        try:
+            self.client.chat_update(  # type: ignore
+                channel=promotion["channel"],
+                ts=promotion["ts"],
+                blocks=blocks,
+                text="A project was donated to",
+            )
+            with self._lock:
+                self.updated += 1
+        except Exception:
+            # One deleted or archived message shouldn't stop the others being updated
+            with self._lock:
+                self.failed += 1
+            traceback.print_exc()
+
+    def _refresh(self, project_id: Hashable) -> None:
+        project_id = str(project_id)
+        promotions = self.promotions(project_id)
+        if not promotions:
+            return
+        blocks = self.render(project_id)
+        # Wait for this project's updates so a later refresh can't overtake them
+        list(self._pool.map(lambda promotion: self._update(promotion, blocks), promotions))
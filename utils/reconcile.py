@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+# Reconciliation checks funded projects against their TidyHQ invoices and marks
+# fully paid projects as reconciled. The bot runs it on a schedule using its own
+# store, contact directory and invoice index. utils.check_paid runs it once by hand.
+#
+# All "reconciled at" updates from a run are committed in a single store write,
+# with the affected projects locked so the run can't race a pledge or edit.
+# Summaries for different projects are posted to the admin channel concurrently,
+# each project's thread replies are still posted in order.
+
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable
+
+from utils import tidyhq
+from utils.contact_sync import ContactSync
+from utils.fileio import atomic_write_json
+from utils.invoice_index import InvoiceIndex
+from utils.locks import project_locks
+
+
+def invoice_name(project: dict[str, Any]) -> str:
+    # Get the expected invoice name based on dgr status
+    if project.get("dgr", False):
+        return f"Gift/Donation for: {project['title']}"
+    return f"Project pledge: {project['title']}"
+
+
+def check_paid(project: dict[str, Any], invoices: InvoiceIndex) -> dict[str, Any] | None:
+    """Totals a project's paid and unpaid invoices, None if it has no invoices"""
+    # Invoices created since invoicing was checkpointed are known by id, older ones are found by name.
+    # Either way the most recent invoices are first
+    relevant_invoices = [
+        invoice
+        for invoice in (
+            invoices.get(record["id"]) for record in project.get("invoices", {}).values()
+        )
+        if invoice is not None
+    ]
+    if not relevant_invoices:
+        relevant_invoices = invoices.named(invoice_name(project))
+    if not relevant_invoices:
+        return None
+
+    paid_invoices = [invoice for invoice in relevant_invoices if invoice["paid"]]
+    unpaid_invoices = [invoice for invoice in relevant_invoices if not invoice["paid"]]
+    paid_total = sum(invoice["amount"] for invoice in paid_invoices)
+    unpaid_total = sum(invoice["amount_due"] for invoice in unpaid_invoices)
+
+    return {
+        "paid": paid_total >= project["total"],
+        "paid_total": paid_total,
+        "unpaid_total": unpaid_total,
+        "paid_invoices": paid_invoices,
+        "unpaid_invoices": unpaid_invoices,
+    }
+
+
+class Reconciler:
+    """Scheduled reconciliation of funded projects against TidyHQ invoices"""
+
+    def __init__(
+        self,
+        config: dict[str, Any],
+        store: Any,
+        client: Any,
+        contacts: ContactSync,
+        invoices: InvoiceIndex | None = None,
+        workers: int = 4,
+        status_path: str = "reconcile_status.json",
+    ) -> None:
+        self.config = config
+        self.store = store
+        self.client = client
+        self.contacts = contacts
+        self.invoices = invoices or InvoiceIndex(config.get("invoice_index", "tidyhq_invoices.json"))
+        self.workers = workers
+        self.status_path = status_path
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        # Duration and counts from the most recent run
+        self.last_run: dict[str, Any] = {}
+        try:
+            with open(status_path, "r") as f:
+                self.last_run = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _summarise(self, project: dict[str, Any], info: dict[str, Any], include_unpaid: bool) -> None:
+        domain = tidyhq.domain_prefix(self.config)
+        invoice_url_template = f"https://{domain}.tidyhq.com/finances/invoices/{{}}"
+        contact_url_template = f"https://{domain}.tidyhq.com/contacts/{{}}"
+
+        def invoice_lines(invoices: list[dict[str, Any]], field: str) -> str:
+            return "".join(
+                f"• <{contact_url_template.format(invoice['contact_id'])}|{self.contacts.contact_name(invoice['contact_id']) or invoice['contact_id']}> - <{invoice_url_template.format(invoice['id'])}|${invoice[field]}>\n"
+                for invoice in invoices
+            )
+
+        if info["paid"]:
+            admin_message = f"Project `{project['title']}` has been fully paid and reconciled"
+        else:
+            admin_message = f"Project `{project['title']}` has outstanding invoices"
+
+        r = self.client.chat_postMessage(channel=self.config["admin_channel"], text=admin_message)  # type: ignore
+
+        # Reply to the thread with more details
+        replies = [
+            f"{len(info['paid_invoices'])} Paid invoices: ${info['paid_total']} / ${project['total']}",
+            invoice_lines(info["paid_invoices"], "amount"),
+        ]
+        if include_unpaid and not info["paid"]:
+            replies += [
+                f"{len(info['unpaid_invoices'])} Unpaid invoices: ${info['unpaid_total']} / ${project['total']}",
+                invoice_lines(info["unpaid_invoices"], "amount_due"),
+            ]
+        for text in replies:
+            if text:
+                self.client.chat_postMessage(  # type: ignore
+                    channel=self.config["admin_channel"], text=text, thread_ts=r["ts"]
+                )
+
+    def wanted(self) -> Callable[[dict[str, Any]], bool]:
+        """Matches the invoices of projects that aren't reconciled yet, the only ones a run can look at"""
+        names: set[str] = set()
+        ids: set[str] = set()
+        for _, project in self.store.unfunded() + self.store.awaiting_reconciliation():
+            names.add(invoice_name(project))
+            ids.update(str(record["id"]) for record in project.get("invoices", {}).values())
+        return lambda invoice: str(invoice["id"]) in ids or invoice.get("name") in names
+
+    def run(self, include_unpaid: bool = False) -> dict[str, Any]:
+        """Reconciles every funded project that isn't reconciled yet. Returns the run's duration and counts"""
+        with self._lock:
+            started = time.monotonic()
+            stats: dict[str, Any] = {
+                "started at": int(time.time()),
+                "checked": 0,
+                "reconciled": 0,
+                "outstanding": 0,
+                "no invoices": 0,
+                "errors": 0,
+            }
+
+            # Only invoices and contacts changed since the last run are fetched
+            stats["invoices fetched"] = self.invoices.sync(tidyhq.client(self.config), wanted=self.wanted())
+            self.contacts.sync(tidyhq.client(self.config), self.client)
+
+            results: dict[str, tuple[dict[str, Any], dict[str, Any]]] = {}
+            for project_id, project in self.store.awaiting_reconciliation():
+                stats["checked"] += 1
+                info = check_paid(project, self.invoices)
+                if info is None:
+                    print(f"No invoices found for project {project['title']}")
+                    stats["no invoices"] += 1
+                    continue
+                results[project_id] = (project, info)
+                stats["reconciled" if info["paid"] else "outstanding"] += 1
+
+            # Commit every reconciled project at once
+            paid = [project_id for project_id, (_, info) in results.items() if info["paid"]]
+            if paid:
+                with project_locks.projects(paid):
+                    now = int(datetime.now().timestamp())
+                    updates = {}
+                    for project_id in paid:
+                        project = self.store.checkout(project_id)
+                        if project is None:
+                            continue
+                        project["reconciled at"] = now
+                        updates[project_id] = project
+                    self.store.put_many(updates)
+
+            def summarise(item: tuple[dict[str, Any], dict[str, Any]]) -> bool:
+                project, info = item
+                if not (info["paid"] or include_unpaid):
+                    return True
+                try:
+                    self._summarise(project, info, include_unpaid)
+                    return True
+                except Exception:
+                    traceback.print_exc()
+                    return False
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reconcile") as pool:
+                stats["errors"] = sum(1 for ok in pool.map(summarise, results.values()) if not ok)
+
+            stats["duration"] = round(time.monotonic() - started, 3)
+            self.last_run = stats
+            atomic_write_json(self.status_path, stats, indent=4)
+            return stats
+
+    def start(self, interval: float) -> None:
+        """Runs reconciliation every interval seconds in a background thread, picking up the schedule from the last run"""
+        if self._thread is not None or interval <= 0:
+            return
+
+        def loop() -> None:
+            while True:
+                due = self.last_run.get("started at", 0) + interval
+                time.sleep(max(0, due - time.time()))
+                try:
+                    print(f"Reconciliation finished: {self.run()}")
+                except Exception:
+                    traceback.print_exc()
+                    # Don't retry straight away
+                    self.last_run = {**self.last_run, "started at": int(time.time())}
+
+        self._thread = threading.Thread(target=loop, name="reconcile", daemon=True)
+        self._thread.start()
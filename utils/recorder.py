@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+# Opt-in recording of the requests Bolt receives, for replaying real traffic
+# through benchmarks.replay. Enabled by setting record_requests in config.json to
+# the file to append to.
+#
+# Each line of the file is a JSON record. A "start" record is written when the bot
+# starts with a snapshot of the store and the admin group, followed by a
+# "request" record per incoming request with the time it arrived and its body.
+# Bolt runs listeners after every global middleware has returned, so handler
+# times can't be measured here, the replay measures its own.
+#
+# Slack ids are replaced with salted hashes that keep their first letter, the same
+# way in the bodies and the snapshot so the two still refer to each other. Names,
+# tokens and response URLs are removed. Project titles, descriptions and typed
+# values are kept since the handlers' behaviour depends on them.
+
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+# Keys holding a single Slack id
+ID_KEYS = {
+    "user",
+    "user_id",
+    "team",
+    "team_id",
+    "channel",
+    "channel_id",
+    "enterprise_id",
+    "bot_id",
+    "subteam_id",
+    "created by",
+    "last updated by",
+    "selected_user",
+    "selected_conversation",
+    "selected_channel",
+    "initial_user",
+    "initial_conversation",
+    "initial_channel",
+}
+
+# Keys holding a list of Slack ids
+ID_LIST_KEYS = {
+    "users",
+    "added_users",
+    "removed_users",
+    "selected_users",
+    "selected_conversations",
+    "selected_channels",
+    "initial_users",
+    "initial_conversations",
+    "initial_channels",
+}
+
+# Objects describing a user, team or similar, whose id and names are replaced
+OBJECT_KEYS = {"user", "team", "channel", "enterprise", "subteam"}
+NAME_KEYS = {"name", "username", "real_name", "display_name", "domain", "handle"}
+
+# Keys whose values are dropped entirely
+SECRET_KEYS = {"token", "response_url"}
+
+# Mentions may carry a display label after the id, as in <@U123|name>, which is dropped
+MENTION = re.compile(r"<(!subteam\^|[@#])([A-Z][A-Z0-9]+)(\|[^>]*)?>")
+
+
+class Anonymiser:
+    """Replaces Slack ids with stable salted hashes"""
+
+    def __init__(self, salt: str = "") -> None:
+        self.salt = salt
+
+    def id(self, value: str) -> str:
+        if not value:
+            return value
+        digest = hashlib.sha256((self.salt + value).encode()).hexdigest()[:10].upper()
+        return value[0] + digest
+
+    def text(self, value: str) -> str:
+        return MENTION.sub(lambda m: f"<{m.group(1)}{self.id(m.group(2))}>", value)
+
+    def object(self, value: dict[str, Any]) -> dict[str, Any]:
+        """A user, team or channel object"""
+        result = self.value(value)
+        if isinstance(value.get("id"), str):
+            result["id"] = self.id(value["id"])
+        for key in NAME_KEYS & value.keys():
+            result[key] = result.get("id", "").lower()
+        return result
+
+    def value(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            result: dict[str, Any] = {}
+            for k, v in value.items():
+                if k in SECRET_KEYS:
+                    result[k] = ""
+                elif k == "pledges" and isinstance(v, dict):
+                    result[k] = {self.id(user): amount for user, amount in v.items()}
+                elif k in OBJECT_KEYS and isinstance(v, dict):
+                    result[k] = self.object(v)
+                elif k in ID_KEYS and isinstance(v, str):
+                    result[k] = self.id(v)
+                elif k in ID_LIST_KEYS and isinstance(v, list) and all(isinstance(i, str) for i in v):
+                    result[k] = [self.id(i) for i in v]
+                else:
+                    result[k] = self.value(v)
+            return result
+        if isinstance(value, list):
+            return [self.value(v) for v in value]
+        if isinstance(value, str):
+            return self.text(value)
+        return value
+
+
+class RequestRecorder:
+    """Appends anonymised request bodies to a file, add middleware to the app with app.use"""
+
+    def __init__(self, path: str, salt: str = "") -> None:
+        self.path = path
+        self.anonymise = Anonymiser(salt)
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def _write(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def snapshot(self, projects: dict[str, dict[str, Any]], admins: list[str]) -> None:
+        """Writes the state requests recorded from now on will be replayed against"""
+        self._write(
+            {
+                "type": "start",
+                "at": time.time(),
+                "projects": self.anonymise.value(projects),
+                "admins": [self.anonymise.id(user) for user in admins],
+            }
+        )
+
+    def record(self, body: dict[str, Any]) -> None:
+        try:
+            self._write({"type": "request", "at": time.time(), "body": self.anonymise.value(body)})
+            self.recorded += 1
+        except Exception as e:
+            # Recording is for benchmarking and must never break the bot
+            print(f"Failed to record request: {e}")
+
+    def middleware(self, body: dict[str, Any], next: Callable[[], Any]) -> Any:
+        self.record(body)
+        return next()
+
+    async def middleware_async(self, body: dict[str, Any], next: Callable[[], Awaitable[Any]]) -> Any:
+        self.record(body)
+        return await next()
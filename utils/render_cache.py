@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+# Rendered Block Kit fragments for the App Home. Fragments are keyed by project
+# id and project version so they're rendered once per change to the project
+# rather than once per user per home refresh.
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+Blocks = list[dict[str, Any]]
+
+
+class FragmentCache:
+    """LRU cache of block lists, bounded by the approximate size of the cached blocks"""
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[Blocks, int]] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], Blocks]) -> Blocks:
+        """Returns the cached blocks for key, rendering them on a miss. The result is shared and must not be modified"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        blocks = render()
+        size = len(json.dumps(blocks))
+
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (blocks, size)
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+        return blocks
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
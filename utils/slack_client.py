@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+
+# Outbound Slack API calls go through RateLimitedWebClient, which paces each
+# method with a token bucket sized for its Slack rate limit tier, waits out
+# Retry-After when Slack answers with HTTP 429 and lets interactive calls jump
+# ahead of background notifications that are waiting for the same bucket.
+#
+# All clients in a process share one scheduler by default so the bot, the
+# invoicing code it imports and any background workers stay within the same limits.
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Any
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.client import WebClient
+from slack_sdk.web.slack_response import SlackResponse
+
+from utils import instrument
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Requests per minute for each method, based on Slack's published tiers
+# https://api.slack.com/apis/rate-limits
+METHOD_LIMITS: dict[str, int] = {
+    "chat.postMessage": 60,  # Special tier, roughly one message per second per channel
+    "chat.update": 50,  # Tier 3
+    "conversations.open": 50,  # Tier 3
+    "views.publish": 100,  # Tier 4
+    "views.open": 100,  # Tier 4
+    "views.update": 100,  # Tier 4
+    "users.info": 100,  # Tier 4
+    "users.list": 20,  # Tier 2
+    "usergroups.list": 20,  # Tier 2
+    "usergroups.users.list": 20,  # Tier 2
+}
+DEFAULT_LIMIT = 50  # Tier 3
+
+# Methods whose limit applies per channel rather than per workspace
+PER_CHANNEL = {"chat.postMessage"}
+
+# Workspace wide limits for PER_CHANNEL methods, so fanning out to many channels is paced too
+WORKSPACE_LIMITS: dict[str, int] = {
+    "chat.postMessage": 300,  # Slack allows bursts but expects no more than several hundred a minute
+}
+
+
+class TokenBucket:
+    """Token bucket that serves waiting callers in priority order"""
+
+    def __init__(self, per_minute: int) -> None:
+        self.rate = per_minute / 60
+        # Allow short bursts without spending a whole minute's allowance at once
+        self.capacity = max(1.0, per_minute / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+
+    def _refill(self, now: float) -> None:
+        # Nothing accrues while paused
+        start = max(self.updated, min(now, self.paused_until))
+        self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if self._waiters[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self.paused_until:
+                        self._cond.wait(self.paused_until - now)
+                    elif self.tokens < 1:
+                        self._cond.wait((1 - self.tokens) / self.rate)
+                    else:
+                        self.tokens -= 1
+                        return
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def try_acquire(self) -> float:
+        """Takes a token without blocking. Returns 0 on success, otherwise roughly how long to wait before trying again"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            # Threads already waiting in acquire go first
+            if self._waiters or self.tokens < 1:
+                return max(0.05, (1 - self.tokens) / self.rate)
+            self.tokens -= 1
+            return 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for a while, used when Slack returns Retry-After"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # Allow a single call through once the pause is over
+            self.tokens = 1
+            self._cond.notify_all()
+
+
+class RateLimitScheduler:
+    """Token buckets for every method (and channel where relevant) in use"""
+
+    def __init__(self, limits: dict[str, int] | None = None) -> None:
+        self.limits = limits or METHOD_LIMITS
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, str | None], TokenBucket] = {}
+        self.retries = 0
+
+    def bucket(self, method: str, channel: str | None = None) -> TokenBucket:
+        key = (method, channel if method in PER_CHANNEL else None)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.limits.get(method, DEFAULT_LIMIT))
+            return bucket
+
+    def buckets(self, method: str, channel: str | None = None) -> list[TokenBucket]:
+        """Every bucket a call must take a token from, the most specific first"""
+        buckets = [self.bucket(method, channel)]
+        if method in WORKSPACE_LIMITS:
+            key = (method, "*")
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = TokenBucket(WORKSPACE_LIMITS[method])
+            buckets.append(bucket)
+        return buckets
+
+
+shared_scheduler = RateLimitScheduler()
+
+
+def rate_limited(e: Exception) -> bool:
+    """Whether e is Slack refusing a call with HTTP 429, ie after a client has used up its retries"""
+    return isinstance(e, SlackApiError) and getattr(e.response, "status_code", None) == 429
+
+
+def _retry_after(response: Any) -> float:
+    for header, value in getattr(response, "headers", {}).items():
+        if header.lower() == "retry-after":
+            return float(value)
+    return 1.0
+
+
+class RateLimitedWebClient(WebClient):
+    """WebClient that paces calls per Slack rate limit tier and retries 429 responses"""
+
+    def __init__(
+        self,
+        *args: Any,
+        scheduler: RateLimitScheduler | None = None,
+        priority: int = INTERACTIVE,
+        max_retries: int = 3,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or shared_scheduler
+        self.priority = priority
+        self.max_retries = max_retries
+        self._init_args = (args, kwargs)
+
+    def with_priority(self, priority: int) -> "RateLimitedWebClient":
+        """Returns a client that shares this one's buckets but queues at a different priority"""
+        args, kwargs = self._init_args
+        return RateLimitedWebClient(
+            *args,
+            scheduler=self.scheduler,
+            priority=priority,
+            max_retries=self.max_retries,
+            **kwargs,
+        )
+
+    def api_call(self, api_method: str, **kwargs: Any) -> SlackResponse:  # type: ignore
+        instrument.count(f"slack.{api_method}")
+        payload = kwargs.get("json") or kwargs.get("data") or kwargs.get("params") or {}
+        buckets = self.scheduler.buckets(api_method, payload.get("channel"))
+        attempt = 0
+        while True:
+            for bucket in buckets:
+                bucket.acquire(self.priority)
+            try:
+                return super().api_call(api_method, **kwargs)  # type: ignore
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.scheduler.retries += 1
+                # Slack doesn't say which limit was hit, back off the narrowest one
+                buckets[0].pause(_retry_after(e.response))
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+# SQLite backed project store. Projects are stored as JSON documents alongside
+# indexed copies of the fields used to filter them by lifecycle, so the App Home
+# and reconciliation only have to touch matching rows.
+#
+# Migrate an existing store with: python -m utils.store migrate projects.db
+# and set "projects": "projects.db" in config.json.
+#
+# Projects are listed in the order they were added, like the JSON store, so rows
+# are updated in place rather than replaced to keep their rowid.
+
+import copy
+import itertools
+import json
+import sqlite3
+import threading
+from typing import Any
+
+from utils import instrument
+from utils.fileio import atomic_write_json
+from utils.store import is_funded, stamp_aggregates
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    approved INTEGER NOT NULL DEFAULT 0,
+    funded INTEGER NOT NULL DEFAULT 0,
+    funded_at INTEGER,
+    reconciled_at INTEGER,
+    created_by TEXT
+);
+CREATE INDEX IF NOT EXISTS projects_approved ON projects (approved, funded);
+CREATE INDEX IF NOT EXISTS projects_funded_at ON projects (funded_at);
+CREATE INDEX IF NOT EXISTS projects_reconciled_at ON projects (reconciled_at);
+CREATE INDEX IF NOT EXISTS projects_created_by ON projects (created_by);
+"""
+
+
+def _columns(id: str, data: dict[str, Any]) -> tuple[Any, ...]:
+    return (
+        id,
+        json.dumps(data, separators=(",", ":"), sort_keys=True),
+        1 if data.get("approved", False) else 0,
+        1 if is_funded(data) else 0,
+        data.get("funded at") or None,
+        data.get("reconciled at") or None,
+        data.get("created by"),
+    )
+
+
+class SQLiteProjectStore:
+    """Project store backed by an SQLite database, with the same interface as ProjectStore"""
+
+    def __init__(self, path: str = "projects.db") -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+        # Parsed rows, discarded whenever another connection commits a change
+        self._rows: dict[str, dict[str, Any]] = {}
+        self._all: dict[str, dict[str, Any]] | None = None
+        self._data_version: int | None = None
+        # Per project versions, handed out lazily and discarded when a project changes
+        self._versions: dict[str, int] = {}
+        self._clock = itertools.count(1)
+
+        # Number of rows that have been parsed, useful for debugging
+        self.reads = 0
+
+    def _check_version(self) -> None:
+        # Caller must hold self._lock. data_version only changes for commits made by other connections.
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._rows = {}
+            self._all = None
+            self._versions = {}
+            self._data_version = version
+
+    def _parse(self, id: str, data: str) -> dict[str, Any]:
+        if id not in self._rows:
+            self._rows[id] = json.loads(data)
+            self.reads += 1
+            instrument.count("store.parse")
+        return self._rows[id]
+
+    def _query(self, where: str, params: tuple[Any, ...] = ()) -> list[tuple[str, dict[str, Any]]]:
+        instrument.count("store.read")
+        with self._lock:
+            self._check_version()
+            rows = self._db.execute(
+                f"SELECT id, data FROM projects WHERE {where} ORDER BY rowid", params
+            ).fetchall()
+            return [(id, self._parse(id, data)) for id, data in rows]
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        """Returns every project. The result is shared and must be treated as read only"""
+        instrument.count("store.read")
+        with self._lock:
+            self._check_version()
+            if self._all is None:
+                rows = self._db.execute("SELECT id, data FROM projects ORDER BY rowid").fetchall()
+                self._all = {id: self._parse(id, data) for id, data in rows}
+            return self._all
+
+    def get(self, id: str) -> dict[str, Any] | None:
+        """Returns a shared, read only reference to a single project"""
+        instrument.count("store.read")
+        with self._lock:
+            self._check_version()
+            if id in self._rows:
+                return self._rows[id]
+            row = self._db.execute("SELECT data FROM projects WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                return None
+            return self._parse(id, row[0])
+
+    def checkout(self, id: str) -> dict[str, Any] | None:
+        """Returns a private copy of a project that can be modified and passed to put"""
+        project = self.get(id)
+        if project is None:
+            return None
+        return copy.deepcopy(project)
+
+    def version(self, id: str) -> int:
+        """Returns a number that changes whenever the project does, for keying caches"""
+        with self._lock:
+            self._check_version()
+            version = self._versions.get(id)
+            if version is None:
+                version = self._versions[id] = next(self._clock)
+            return version
+
+    def put(self, id: str, data: dict[str, Any]) -> None:
+        self.put_many({id: data})
+
+    def put_many(self, projects: dict[str, dict[str, Any]]) -> None:
+        """Writes several projects in a single transaction"""
+        instrument.count("store.write")
+        for data in projects.values():
+            stamp_aggregates(data)
+        with self._lock:
+            self._check_version()
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT INTO projects (id, data, approved, funded, funded_at, reconciled_at, created_by) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET data = excluded.data, approved = excluded.approved, funded = excluded.funded, "
+                    "funded_at = excluded.funded_at, reconciled_at = excluded.reconciled_at, created_by = excluded.created_by",
+                    [_columns(id, data) for id, data in projects.items()],
+                )
+            for id, data in projects.items():
+                self._rows[id] = copy.deepcopy(data)
+                self._versions.pop(id, None)
+            if self._all is not None:
+                self._all = dict(self._all)
+                self._all.update({id: self._rows[id] for id in projects})
+
+    def delete(self, id: str) -> None:
+        instrument.count("store.write")
+        with self._lock:
+            self._check_version()
+            if self._db.execute("DELETE FROM projects WHERE id = ?", (id,)).rowcount == 0:
+                raise KeyError(id)
+            self._rows.pop(id, None)
+            self._versions.pop(id, None)
+            if self._all is not None:
+                self._all = dict(self._all)
+                self._all.pop(id, None)
+
+    def import_projects(self, projects: dict[str, dict[str, Any]]) -> None:
+        """One shot migration from a projects.json style dict"""
+        self.put_many(copy.deepcopy(projects))
+
+    def compact(self) -> bool:
+        # SQLite manages its own journal
+        return False
+
+    def export(self, path: str) -> None:
+        """Writes every project to path in the readable projects.json format"""
+        atomic_write_json(path, self.load(), indent=4)
+
+    # Lifecycle queries
+
+    def seeking_donations(self) -> list[tuple[str, dict[str, Any]]]:
+        """Approved projects that have not met their goal"""
+        return self._query("approved = 1 AND funded = 0")
+
+    def unfunded(self) -> list[tuple[str, dict[str, Any]]]:
+        return self._query("funded = 0")
+
+    def awaiting_approval(self, created_by: str | None = None) -> list[tuple[str, dict[str, Any]]]:
+        """Unapproved projects, optionally limited to a single creator"""
+        if created_by is None:
+            return self._query("approved = 0")
+        return self._query("created_by = ? AND approved = 0", (created_by,))
+
+    def recently_funded(self, since: int) -> list[tuple[str, dict[str, Any]]]:
+        """Funded projects with a funding timestamp after since"""
+        return self._query("funded_at > ? AND funded = 1", (since,))
+
+    def awaiting_reconciliation(self) -> list[tuple[str, dict[str, Any]]]:
+        """Projects that have a funding timestamp but not a reconciliation timestamp"""
+        return self._query("reconciled_at IS NULL AND funded_at IS NOT NULL")
@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+
+# Process wide project store.
+#
+# projects.json is kept as a readable snapshot. Every change is appended as a
+# single compact record to projects.json.journal and the journal is folded back
+# into the snapshot in the background once it grows past a threshold. Parsed
+# projects are kept in memory and the files are only re-read when they change on
+# disk (ie by utils/check_paid.py or utils/project_output.py running as scripts).
+
+import copy
+import itertools
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from utils import instrument
+from utils.fileio import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore
+
+FileSignature = tuple[int, int, int] | None
+
+
+def _signature(path: str) -> FileSignature:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def compute_aggregates(project: dict[str, Any]) -> tuple[int, int, bool]:
+    """Calculates (pledged total, backers, funded) from the raw pledges"""
+    pledges: dict[str, Any] = project.get("pledges", {})
+    pledged = sum(int(amount) for amount in pledges.values())
+    return pledged, len(pledges), pledged >= project["total"]
+
+
+def aggregates(project: dict[str, Any]) -> tuple[int, int, bool]:
+    """Returns (pledged total, backers, funded), using the values maintained by the store where available"""
+    try:
+        return project["pledged"], project["backers"], project["funded"]
+    except KeyError:
+        # Projects written before aggregates were maintained, or not yet saved
+        return compute_aggregates(project)
+
+
+def stamp_aggregates(project: dict[str, Any]) -> None:
+    """Updates the maintained aggregates, called by the stores on every write"""
+    project["pledged"], project["backers"], project["funded"] = compute_aggregates(project)
+
+
+def pledged_total(project: dict[str, Any]) -> int:
+    return aggregates(project)[0]
+
+
+def is_funded(project: dict[str, Any]) -> bool:
+    return aggregates(project)[2]
+
+
+def verify_aggregates(store: Any, fix: bool = False) -> list[str]:
+    """Returns the ids of projects whose maintained aggregates don't match their pledges, optionally rewriting them"""
+    stale: dict[str, dict[str, Any]] = {}
+    for id, project in store.load().items():
+        expected = compute_aggregates(project)
+        if tuple(project.get(k) for k in ["pledged", "backers", "funded"]) != expected:
+            stale[id] = copy.deepcopy(project)
+    if fix and stale:
+        store.put_many(stale)
+    return list(stale)
+
+
+def _apply(
+    projects: dict[str, dict[str, Any]], record: dict[str, Any], changed: set[str]
+) -> None:
+    if record["op"] == "put":
+        projects[record["id"]] = record["data"]
+        changed.add(record["id"])
+    elif record["op"] == "delete":
+        projects.pop(record["id"], None)
+        changed.add(record["id"])
+    elif record["op"] == "batch":
+        for child in record["records"]:
+            _apply(projects, child, changed)
+    else:
+        raise ValueError(f'Unknown journal operation {record["op"]}')
+
+
+def _replay(
+    path: str,
+    projects: dict[str, dict[str, Any]],
+    offset: int = 0,
+    changed: set[str] | None = None,
+) -> int:
+    """Applies journal records from offset onwards and returns the offset of the first incomplete record"""
+    if changed is None:
+        changed = set()
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return 0
+    # A record without a trailing newline is either still being written or was torn by a crash
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # Torn by a crash part way through an append, which never reported success, so nothing is lost
+            print(f"Skipping unreadable record in {path}: {line[:80]!r}")
+            continue
+        _apply(projects, record, changed)
+    return offset + end
+
+
+class ProjectStore:
+    """Journaled projects store that keeps parsed projects in memory"""
+
+    def __init__(self, path: str = "projects.json", compact_bytes: int = 1024 * 1024) -> None:
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        # Journal that is currently being folded into the snapshot
+        self.compacting_path = f"{path}.journal.compacting"
+        self.lock_path = f"{path}.lock"
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._projects: dict[str, dict[str, Any]] = {}
+        self._signature: tuple[FileSignature, FileSignature, FileSignature] | None = None
+        self._journal_offset = 0
+        # Per project versions, handed out lazily and discarded when a project changes
+        self._versions: dict[str, int] = {}
+        self._clock = itertools.count(1)
+
+        # Number of times a file has been parsed, useful for debugging
+        self.reads = 0
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool = False, path: str | None = None) -> Iterator[None]:
+        # Readers and journal appends share the lock, swapping files around requires it exclusively.
+        # A new descriptor is opened each time since flock is per descriptor rather than per thread.
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(path or self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _signatures(self) -> tuple[FileSignature, FileSignature, FileSignature]:
+        return (
+            _signature(self.path),
+            _signature(self.compacting_path),
+            _signature(self.journal_path),
+        )
+
+    def _read_base(self) -> dict[str, dict[str, Any]]:
+        # Snapshot plus any journal that is part way through compaction
+        try:
+            with open(self.path, "r") as f:
+                projects: dict[str, dict[str, Any]] = json.load(f)
+        except FileNotFoundError:
+            projects = {}
+        _replay(self.compacting_path, projects)
+        self.reads += 1
+        instrument.count("store.parse")
+        return projects
+
+    def _refresh(self) -> None:
+        if self._signatures() == self._signature:
+            return
+        with self._lock, self._file_lock():
+            signature = self._signatures()
+            if signature == self._signature:
+                return
+            journal = signature[2]
+            previous = self._signature
+            if (
+                previous is not None
+                and previous[:2] == signature[:2]
+                and previous[2] is not None
+                and journal is not None
+                and previous[2][0] == journal[0]
+                and journal[1] >= self._journal_offset
+            ):
+                # Only the journal has grown, replay the new records
+                projects = dict(self._projects)
+                changed: set[str] = set()
+                self._journal_offset = _replay(
+                    self.journal_path, projects, self._journal_offset, changed
+                )
+                versions = {k: v for k, v in self._versions.items() if k not in changed}
+            else:
+                projects = self._read_base()
+                self._journal_offset = _replay(self.journal_path, projects)
+                versions = {}
+            # Swap in a new dict rather than mutating so in progress iterations aren't disturbed
+            self._projects = projects
+            self._versions = versions
+            self._signature = signature
+
+    def _append(self, record: dict[str, Any]) -> None:
+        instrument.count("store.write")
+        line = (json.dumps(record, separators=(",", ":"), sort_keys=True) + "\n").encode()
+        with self._file_lock():
+            fd = os.open(self.journal_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # Finish off a record torn by a crash so it can't run into this one
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b"\n":
+                    line = b"\n" + line
+                written = 0
+                while written < len(line):
+                    written += os.write(fd, line[written:])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._refresh()
+        if self._journal_offset >= self.compact_bytes:
+            self.compact_in_background()
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        """Returns every project. The result is shared and must be treated as read only"""
+        instrument.count("store.read")
+        self._refresh()
+        return self._projects
+
+    def get(self, id: str) -> dict[str, Any] | None:
+        """Returns a shared, read only reference to a single project"""
+        return self.load().get(id)
+
+    def checkout(self, id: str) -> dict[str, Any] | None:
+        """Returns a private copy of a project that can be modified and passed to put"""
+        project = self.get(id)
+        if project is None:
+            return None
+        return copy.deepcopy(project)
+
+    def version(self, id: str) -> int:
+        """Returns a number that changes whenever the project does, for keying caches"""
+        self._refresh()
+        version = self._versions.get(id)
+        if version is None:
+            version = self._versions.setdefault(id, next(self._clock))
+        return version
+
+    def put(self, id: str, data: dict[str, Any]) -> None:
+        stamp_aggregates(data)
+        self._append({"op": "put", "id": id, "data": data})
+
+    def put_many(self, projects: dict[str, dict[str, Any]]) -> None:
+        """Writes several projects as a single journal record so either all or none of them land"""
+        records: list[dict[str, Any]] = []
+        for id, data in projects.items():
+            stamp_aggregates(data)
+            records.append({"op": "put", "id": id, "data": data})
+        self._append({"op": "batch", "records": records})
+
+    def delete(self, id: str) -> None:
+        if self.get(id) is None:
+            raise KeyError(id)
+        self._append({"op": "delete", "id": id})
+
+    def compact(self) -> bool:
+        """Folds the journal into the readable snapshot. Returns False if there was nothing to do"""
+        with self._compact_lock, self._file_lock(exclusive=True, path=f"{self.lock_path}.compact"):
+            # Move the journal aside so writers can keep appending while the snapshot is written.
+            # If a previous compaction died part way through its journal is picked up here instead.
+            with self._file_lock(exclusive=True):
+                if not os.path.exists(self.compacting_path):
+                    journal = _signature(self.journal_path)
+                    if journal is None or journal[1] == 0:
+                        return False
+                    os.replace(self.journal_path, self.compacting_path)
+
+            with self._file_lock():
+                projects = self._read_base()
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                # Projects stay in the order they were added, every backend lists them that way
+                json.dump(projects, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._file_lock(exclusive=True):
+                os.replace(tmp, self.path)
+                os.remove(self.compacting_path)
+        return True
+
+    def compact_in_background(self) -> None:
+        if self._compact_lock.locked():
+            return
+        threading.Thread(target=self.compact, name="store-compaction", daemon=True).start()
+
+    def export(self, path: str) -> None:
+        """Writes every project to path in the readable projects.json format"""
+        atomic_write_json(path, self.load(), indent=4)
+
+    # Lifecycle queries. These are full scans here, SQLiteProjectStore answers them from indexes.
+
+    def seeking_donations(self) -> list[tuple[str, dict[str, Any]]]:
+        """Approved projects that have not met their goal"""
+        return [
+            (id, project)
+            for id, project in self.load().items()
+            if project.get("approved", False) and not is_funded(project)
+        ]
+
+    def unfunded(self) -> list[tuple[str, dict[str, Any]]]:
+        return [(id, project) for id, project in self.load().items() if not is_funded(project)]
+
+    def awaiting_approval(self, created_by: str | None = None) -> list[tuple[str, dict[str, Any]]]:
+        """Unapproved projects, optionally limited to a single creator"""
+        return [
+            (id, project)
+            for id, project in self.load().items()
+            if not project.get("approved", False)
+            and (created_by is None or project.get("created by") == created_by)
+        ]
+
+    def recently_funded(self, since: int) -> list[tuple[str, dict[str, Any]]]:
+        """Funded projects with a funding timestamp after since"""
+        return [
+            (id, project)
+            for id, project in self.load().items()
+            if project.get("funded at", 0) > since and is_funded(project)
+        ]
+
+    def awaiting_reconciliation(self) -> list[tuple[str, dict[str, Any]]]:
+        """Projects that have a funding timestamp but not a reconciliation timestamp"""
+        return [
+            (id, project)
+            for id, project in self.load().items()
+            if project.get("funded at", False) and not project.get("reconciled at", False)
+        ]
+
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+_stores: dict[str, Any] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str = "projects.json") -> Any:
+    """Returns the shared store for a given projects file. SQLite is used for .db/.sqlite paths"""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            if path.endswith(SQLITE_EXTENSIONS):
+                from utils.sqlite_store import SQLiteProjectStore
+
+                _stores[key] = SQLiteProjectStore(path)
+            else:
+                _stores[key] = ProjectStore(path)
+        return _stores[key]
+
+
+def configured_store(config: dict[str, Any]) -> Any:
+    """Returns the shared store named by config["projects"]"""
+    return get_store(str(config.get("projects", "projects.json")))
+
+
+if __name__ == "__main__":
+    # python -m utils.store compact
+    # python -m utils.store export [path]
+    # python -m utils.store migrate [projects.db]
+    # python -m utils.store verify [--fix]
+    if len(sys.argv) < 2 or sys.argv[1] not in ["compact", "export", "migrate", "verify"]:
+        print("Usage: python -m utils.store compact|export [path]|migrate [projects.db]|verify [--fix]")
+        sys.exit(1)
+
+    # Every command operates on the configured store, migrate reads from it
+    try:
+        with open("config.json", "r") as f:
+            store = configured_store(json.load(f))
+    except FileNotFoundError:
+        store = get_store()
+
+    if sys.argv[1] == "verify":
+        fix = "--fix" in sys.argv
+        stale = verify_aggregates(store, fix=fix)
+        for id in stale:
+            print(f'{id} ({store.get(id)["title"]}) has stale pledge totals')
+        if not stale:
+            print("All pledge totals match their pledges")
+        elif fix:
+            print(f"Rebuilt pledge totals for {len(stale)} projects")
+        else:
+            print("Run again with --fix to rebuild them")
+            sys.exit(1)
+    elif sys.argv[1] == "migrate":
+        target = sys.argv[2] if len(sys.argv) > 2 else "projects.db"
+        if not target.endswith(SQLITE_EXTENSIONS):
+            print(f"{target} does not look like an SQLite database")
+            sys.exit(1)
+        if os.path.abspath(target) == os.path.abspath(store.path):
+            print(f"{target} is already the configured store")
+            sys.exit(1)
+        projects = store.load()
+        get_store(target).import_projects(projects)
+        print(f"Migrated {len(projects)} projects to {target}")
+        print(f'Set "projects": "{target}" in config.json to start using it')
+    elif sys.argv[1] == "compact":
+        if store.compact():
+            print(f"Journal folded into {store.path}")
+        else:
+            print("Nothing to compact")
+    else:
+        out = sys.argv[2] if len(sys.argv) > 2 else store.path
+        if out == store.path:
+            store.compact()
+        else:
+            store.export(out)
+        print(f"Projects exported to {out}")
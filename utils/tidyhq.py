@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+# All TidyHQ API calls go through TidyHQClient, which keeps connections open in a
+# pooled session, applies timeouts, paces requests, retries transient failures
+# with exponential backoff and walks paginated lists with limit/offset.
+#
+# List responses are parsed as they're downloaded, one item at a time, and only
+# the fields the caller asks for are kept. Neither the response body nor the full
+# list is ever held in memory, however large the organisation is.
+#
+# TidyHQ organisation details (name and domain prefix) rarely change, so they're
+# fetched the first time they're needed rather than at import, kept in memory and
+# saved to disk. A copy on disk older than the refresh interval is refetched, but
+# if TidyHQ can't be reached the last saved copy is used instead.
+
+import codecs
+import json
+import threading
+import time
+import traceback
+from typing import Any, Iterable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import instrument
+from utils.fileio import atomic_write_json
+from utils.slack_client import TokenBucket
+
+API_URL = "https://api.tidyhq.com/v1"
+
+# Statuses worth retrying, requests that failed with anything else won't succeed on a second attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Bytes read from a list response at a time
+CHUNK_SIZE = 65536
+
+# Fields kept from list items, everything else is dropped as each item is parsed
+CONTACT_FIELDS = ("id", "contact_id", "display_name", "first_name", "last_name", "custom_fields")
+INVOICE_FIELDS = ("id", "name", "reference", "amount", "amount_due", "paid", "contact_id")
+
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json_array(
+    chunks: Iterable[bytes], fields: Iterable[str] | None = None
+) -> Iterator[dict[str, Any]]:
+    """Yields the items of a JSON array as its bytes arrive, trimmed to fields if given"""
+    keep = tuple(fields) if fields is not None else None
+    text = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            if buffer[pos] == ",":
+                pos += 1
+                continue
+            try:
+                item, pos_end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The item continues in the next chunk
+                break
+            pos = pos_end
+            yield {field: item[field] for field in keep if field in item} if keep is not None else item
+        buffer = buffer[pos:]
+    raise ValueError("JSON array ended early")
+
+
+class TidyHQClient:
+    """Pooled, rate limited and retrying client for the TidyHQ v1 API"""
+
+    def __init__(
+        self,
+        token: str,
+        timeout: float | tuple[float, float] = (5, 30),
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        per_minute: int = 120,
+        page_size: int = 500,
+        pool_size: int = 8,
+    ) -> None:
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.page_size = page_size
+        self.session = requests.Session()
+        self.session.params = {"access_token": token}  # type: ignore
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._bucket = TokenBucket(per_minute)
+        self.requests = 0
+        self.retries = 0
+
+    def _delay(self, attempt: int, response: requests.Response | None) -> float:
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        return min(30.0, self.backoff * 2**attempt)
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Sends a request, retrying failures that are safe to retry. Raises requests.HTTPError for error responses"""
+        url = f"{API_URL}/{path.strip('/')}"
+        instrument.count(f"tidyhq.{method.upper()} {path.strip('/')}")
+        kwargs.setdefault("timeout", self.timeout)
+        # A POST that may have reached TidyHQ isn't repeated, it could create a duplicate invoice
+        idempotent = method.upper() != "POST"
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            self.requests += 1
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectTimeout:
+                # Never connected, so nothing was sent
+                if attempt >= self.max_retries:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+            else:
+                retryable = response.status_code == 429 or (
+                    idempotent and response.status_code in RETRY_STATUSES
+                )
+                if not retryable or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+            if response is not None and response.status_code == 429:
+                self._bucket.pause(self._delay(attempt, response))
+            else:
+                time.sleep(self._delay(attempt, response))
+            attempt += 1
+            self.retries += 1
+
+    def get(self, path: str, params: dict[str, Any] | None = None) -> Any:
+        return self.request("GET", path, params=params).json()
+
+    def post(self, path: str, params: dict[str, Any] | None = None) -> Any:
+        return self.request("POST", path, params=params).json()
+
+    def stream(
+        self, path: str, params: dict[str, Any] | None = None, fields: Iterable[str] | None = None
+    ) -> Iterator[dict[str, Any]]:
+        """Yields the items of a single list response as they're downloaded"""
+        response = self.request("GET", path, params=params, stream=True)
+        try:
+            yield from iter_json_array(response.iter_content(chunk_size=CHUNK_SIZE), fields)
+        finally:
+            response.close()
+
+    def paginate(
+        self,
+        path: str,
+        params: dict[str, Any] | None = None,
+        page_size: int | None = None,
+        fields: Iterable[str] | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Yields every item of a list endpoint, fetching it a page at a time"""
+        limit = page_size or self.page_size
+        offset = 0
+        while True:
+            count = 0
+            for item in self.stream(path, {**(params or {}), "limit": limit, "offset": offset}, fields):
+                count += 1
+                yield item
+            if count < limit:
+                return
+            offset += limit
+
+    def contacts(self, fields: Iterable[str] | None = CONTACT_FIELDS, **params: Any) -> Iterator[dict[str, Any]]:
+        return self.paginate("contacts", params, fields=fields)
+
+    def invoices(self, fields: Iterable[str] | None = INVOICE_FIELDS, **params: Any) -> Iterator[dict[str, Any]]:
+        return self.paginate("invoices", params, fields=fields)
+
+
+_client_lock = threading.Lock()
+_client: TidyHQClient | None = None
+
+
+def client(config: dict[str, Any]) -> TidyHQClient:
+    """Returns the TidyHQ client shared by everything in this process"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TidyHQClient(
+                str(config["tidyhq_token"]),
+                timeout=(5, config.get("tidyhq_timeout", 30)),
+                max_retries=config.get("tidyhq_retries", 4),
+                per_minute=config.get("tidyhq_rate_limit", 120),
+                page_size=config.get("tidyhq_page_size", 500),
+            )
+        return _client
+
+
+ORG_CACHE_PATH = "tidyhq_org.json"
+ORG_REFRESH = 86400  # Seconds
+
+_org_lock = threading.Lock()
+_org: dict[str, Any] | None = None
+_org_fetched = 0.0
+
+
+def _read_org_cache(path: str) -> tuple[dict[str, Any], float] | None:
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+        return cached["organization"], float(cached["fetched"])
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def organisation(config: dict[str, Any]) -> dict[str, Any]:
+    """Returns the TidyHQ organisation, fetching it if there's no fresh copy in memory or on disk"""
+    global _org, _org_fetched
+    path = config.get("tidyhq_org_cache", ORG_CACHE_PATH)
+    refresh = config.get("tidyhq_org_refresh", ORG_REFRESH)
+    with _org_lock:
+        if _org is None:
+            cached = _read_org_cache(path)
+            if cached:
+                _org, _org_fetched = cached
+        if _org is not None and time.time() - _org_fetched < refresh:
+            return _org
+
+        try:
+            org = client(config).get("organization")
+        except requests.RequestException:
+            if _org is None:
+                raise
+            # Stale details are better than none, try again on the next call
+            print("Could not refresh TidyHQ organisation details, using saved copy")
+            traceback.print_exc()
+            return _org
+
+        _org, _org_fetched = org, time.time()
+        atomic_write_json(path, {"fetched": _org_fetched, "organization": _org}, indent=4)
+        return _org
+
+
+def domain_prefix(config: dict[str, Any]) -> str:
+    """Subdomain used for links into TidyHQ, ie https://<prefix>.tidyhq.com"""
+    return str(organisation(config)["domain_prefix"])